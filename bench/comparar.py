@@ -0,0 +1,56 @@
+"""Compara dos resultados de ``bench/carga.py`` (p. ej. de dos commits).
+
+    python bench/comparar.py antes.json despues.json
+
+Muestra, por nivel de concurrencia y operación, throughput y p50/p99 de ambas
+ejecuciones con la variación relativa. Sale con código 1 si algún p99 empeora
+más que ``--umbral`` por ciento.
+"""
+import argparse
+import json
+import sys
+
+
+def variacion(antes: float, despues: float) -> str:
+    if not antes:
+        return "   n/a"
+    return f"{(despues - antes) / antes * 100:+6.1f}%"
+
+
+def comparar(antes: dict, despues: dict, umbral: float) -> bool:
+    print(f"antes:   {antes['commit']} ({antes['fecha']}, {antes['mezcla']}, {antes['filas']:,} filas)")
+    print(f"después: {despues['commit']} ({despues['fecha']}, {despues['mezcla']}, {despues['filas']:,} filas)")
+    regresion = False
+    niveles_antes = {n["concurrencia"]: n for n in antes["niveles"]}
+    for nivel in despues["niveles"]:
+        previo = niveles_antes.get(nivel["concurrencia"])
+        if previo is None:
+            continue
+        print(f"\nConcurrencia {nivel['concurrencia']}")
+        print(f"  {'operación':<22}{'req/s':>25}{'p50 ms':>27}{'p99 ms':>27}")
+        filas = [("TOTAL", previo["total"], nivel["total"])]
+        filas += [(nombre, previo["operaciones"][nombre], datos)
+                  for nombre, datos in nivel["operaciones"].items() if nombre in previo["operaciones"]]
+        for nombre, a, d in filas:
+            print(f"  {nombre:<22}"
+                  f"{a['rps']:>8} {d['rps']:>8} {variacion(a['rps'], d['rps'])}"
+                  f"{a['p50_ms']:>9} {d['p50_ms']:>9} {variacion(a['p50_ms'], d['p50_ms'])}"
+                  f"{a['p99_ms']:>9} {d['p99_ms']:>9} {variacion(a['p99_ms'], d['p99_ms'])}")
+            if a["p99_ms"] and (d["p99_ms"] - a["p99_ms"]) / a["p99_ms"] * 100 > umbral:
+                regresion = True
+    return regresion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("antes")
+    parser.add_argument("despues")
+    parser.add_argument("--umbral", type=float, default=20, help="Empeoramiento de p99 tolerado (%%)")
+    args = parser.parse_args()
+    with open(args.antes, encoding="utf-8") as a, open(args.despues, encoding="utf-8") as d:
+        regresion = comparar(json.load(a), json.load(d), args.umbral)
+    sys.exit(1 if regresion else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,26 +14,383 @@ CREATE TABLE IF NOT EXISTS personas (
     genero VARCHAR(20) NOT NULL,
     correo_electronico VARCHAR(100) NOT NULL,
     celular VARCHAR(10) NOT NULL,
-    foto BYTEA,
+    foto BYTEA,  -- obsoleta: el servicio de personas migra su contenido a personas_fotos
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Tabla de logs
+-- Fotos: los bytes viven en el almacén de archivos del servicio de personas,
+-- direccionados por su SHA-256; aquí solo los metadatos
+CREATE TABLE IF NOT EXISTS personas_fotos (
+    numero_documento VARCHAR(10) PRIMARY KEY REFERENCES personas(numero_documento) ON DELETE CASCADE,
+    hash CHAR(64) NOT NULL,
+    tamano INTEGER NOT NULL,
+    tipo_contenido VARCHAR(50) NOT NULL,
+    actualizada TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Migración: si existe una tabla logs sin particionar se renombra y más
+-- abajo se adjunta como partición histórica de la nueva tabla particionada
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('public.logs') AND relkind = 'r') THEN
+        ALTER TABLE logs RENAME TO logs_historico;
+        -- La clave primaria de la tabla particionada incluye fecha_transaccion
+        ALTER TABLE logs_historico DROP CONSTRAINT logs_pkey;
+        ALTER INDEX IF EXISTS idx_logs_documento RENAME TO idx_logs_historico_documento;
+        ALTER INDEX IF EXISTS idx_logs_fecha RENAME TO idx_logs_historico_fecha;
+        ALTER INDEX IF EXISTS idx_logs_tipo RENAME TO idx_logs_historico_tipo;
+        DROP TRIGGER IF EXISTS trg_estadisticas_logs ON logs_historico;
+    END IF;
+END $$;
+
+-- Tabla de logs, particionada por mes sobre fecha_transaccion
 CREATE TABLE IF NOT EXISTS logs (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     tipo_operacion VARCHAR(20) NOT NULL,
     numero_documento VARCHAR(10),
     usuario VARCHAR(100),
     detalles JSONB,
-    fecha_transaccion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    fecha_transaccion TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, fecha_transaccion)
+) PARTITION BY RANGE (fecha_transaccion);
+
+DO $$
+DECLARE
+    limite DATE := date_trunc('month', CURRENT_DATE) + INTERVAL '1 month';
+BEGIN
+    IF to_regclass('public.logs_historico') IS NOT NULL
+       AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass('public.logs_historico')) THEN
+        UPDATE logs_historico SET fecha_transaccion = 'epoch' WHERE fecha_transaccion IS NULL;
+        ALTER TABLE logs_historico ALTER COLUMN fecha_transaccion SET NOT NULL;
+        ALTER TABLE logs_historico ALTER COLUMN id DROP DEFAULT;
+        ALTER TABLE logs_historico ALTER COLUMN id TYPE BIGINT;
+        PERFORM setval(
+            pg_get_serial_sequence('public.logs', 'id'),
+            COALESCE((SELECT MAX(id) FROM logs_historico), 0) + 1,
+            false
+        );
+        EXECUTE format(
+            'ALTER TABLE logs ATTACH PARTITION logs_historico FOR VALUES FROM (MINVALUE) TO (%L)', limite
+        );
+    END IF;
+END $$;
+
+-- Crea las particiones mensuales del mes actual y los siguientes; el
+-- servicio de logs la llama periódicamente. Devuelve cuántas creó.
+CREATE OR REPLACE FUNCTION crear_particiones_logs(meses_adelante INT DEFAULT 3)
+RETURNS INT AS $$
+DECLARE
+    desde DATE;
+    nombre TEXT;
+    creadas INT := 0;
+BEGIN
+    FOR i IN 0..meses_adelante LOOP
+        desde := date_trunc('month', CURRENT_DATE) + make_interval(months => i);
+        nombre := 'logs_' || to_char(desde, 'YYYY_MM');
+        CONTINUE WHEN to_regclass('public.' || nombre) IS NOT NULL;
+        BEGIN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF logs FOR VALUES FROM (%L) TO (%L)',
+                nombre, desde, desde + INTERVAL '1 month'
+            );
+            creadas := creadas + 1;
+        EXCEPTION WHEN invalid_object_definition THEN
+            -- El rango ya lo cubre otra partición (p. ej. logs_historico)
+            NULL;
+        END;
+    END LOOP;
+    RETURN creadas;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT crear_particiones_logs(3);
+
+-- Búsqueda por nombre: trigramas sobre el nombre completo normalizado
+-- (minúsculas y sin tildes) para que ILIKE '%x%' y el ranking usen índice
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() no es IMMUTABLE; el envoltorio con diccionario fijo sí puede indexarse
+CREATE OR REPLACE FUNCTION normalizar_nombre(texto TEXT)
+RETURNS TEXT AS $$
+    SELECT lower(public.unaccent('public.unaccent'::regdictionary, coalesce(texto, '')))
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+ALTER TABLE personas ADD COLUMN IF NOT EXISTS nombre_busqueda TEXT
+    GENERATED ALWAYS AS (
+        normalizar_nombre(primer_nombre || ' ' || coalesce(segundo_nombre || ' ', '') || apellidos)
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_personas_nombre_trgm ON personas USING GIN (nombre_busqueda gin_trgm_ops);
+
+-- Versión de los datos: un contador por tabla que se incrementa en cada
+-- sentencia de escritura; las cachés lo usan como sello de validez
+CREATE TABLE IF NOT EXISTS version_datos (
+    tabla VARCHAR(30) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+INSERT INTO version_datos (tabla) VALUES ('personas') ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION incrementar_version_datos()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE version_datos
+    SET version = version + 1, actualizado = CURRENT_TIMESTAMP
+    WHERE tabla = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_personas_version ON personas;
+CREATE TRIGGER trg_personas_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON personas
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_datos();
+
+-- Invalidación de cachés: cada sentencia que modifica personas notifica los
+-- documentos afectados (o '*' si son muchos) por el canal personas_cache
+CREATE OR REPLACE FUNCTION notificar_cambios_personas()
+RETURNS TRIGGER AS $$
+DECLARE
+    documentos TEXT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(numero_documento) INTO documentos FROM filas_nuevas;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(numero_documento) INTO documentos FROM (
+            SELECT numero_documento FROM filas_viejas
+            UNION SELECT numero_documento FROM filas_nuevas
+        ) d;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(numero_documento) INTO documentos FROM filas_viejas;
+    END IF;
+
+    IF TG_OP = 'TRUNCATE' OR cardinality(documentos) > 500 THEN
+        PERFORM pg_notify('personas_cache', '*');
+    ELSIF cardinality(documentos) > 0 THEN
+        PERFORM pg_notify('personas_cache', array_to_string(documentos, ','));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_personas_cache_ins ON personas;
+CREATE TRIGGER trg_personas_cache_ins
+    AFTER INSERT ON personas REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambios_personas();
+DROP TRIGGER IF EXISTS trg_personas_cache_upd ON personas;
+CREATE TRIGGER trg_personas_cache_upd
+    AFTER UPDATE ON personas REFERENCING OLD TABLE AS filas_viejas NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambios_personas();
+DROP TRIGGER IF EXISTS trg_personas_cache_del ON personas;
+CREATE TRIGGER trg_personas_cache_del
+    AFTER DELETE ON personas REFERENCING OLD TABLE AS filas_viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambios_personas();
+DROP TRIGGER IF EXISTS trg_personas_cache_trunc ON personas;
+CREATE TRIGGER trg_personas_cache_trunc
+    AFTER TRUNCATE ON personas
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambios_personas();
+
+-- Feed de cambios: cada sentencia que modifica personas deja una fila por
+-- persona afectada en la misma transacción y avisa por personas_cambios con
+-- el último id. El servicio de personas lee la tabla al recibir el aviso y la
+-- reenvía a los suscriptores; el id permite reanudar el feed
+CREATE TABLE IF NOT EXISTS personas_cambios (
+    id BIGSERIAL PRIMARY KEY,
+    operacion VARCHAR(10) NOT NULL,
+    numero_documento VARCHAR(10),
+    datos JSONB,  -- fila nueva sin la foto; NULL en DELETE y TRUNCATE
+    fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_personas_cambios_fecha ON personas_cambios (fecha);
+
+CREATE OR REPLACE FUNCTION registrar_cambios_personas()
+RETURNS TRIGGER AS $$
+DECLARE
+    ultimo BIGINT;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        WITH insertados AS (
+            INSERT INTO personas_cambios (operacion, numero_documento, datos)
+            SELECT TG_OP, numero_documento, to_jsonb(f) - 'foto' FROM filas_nuevas f ORDER BY id
+            RETURNING id
+        )
+        SELECT MAX(id) INTO ultimo FROM insertados;
+    ELSIF TG_OP = 'DELETE' THEN
+        WITH insertados AS (
+            INSERT INTO personas_cambios (operacion, numero_documento)
+            SELECT TG_OP, numero_documento FROM filas_viejas ORDER BY id
+            RETURNING id
+        )
+        SELECT MAX(id) INTO ultimo FROM insertados;
+    ELSE
+        INSERT INTO personas_cambios (operacion) VALUES (TG_OP) RETURNING id INTO ultimo;
+    END IF;
+
+    IF ultimo IS NOT NULL THEN
+        PERFORM pg_notify('personas_cambios', ultimo::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_personas_cambios_ins ON personas;
+CREATE TRIGGER trg_personas_cambios_ins
+    AFTER INSERT ON personas REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION registrar_cambios_personas();
+DROP TRIGGER IF EXISTS trg_personas_cambios_upd ON personas;
+CREATE TRIGGER trg_personas_cambios_upd
+    AFTER UPDATE ON personas REFERENCING OLD TABLE AS filas_viejas NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION registrar_cambios_personas();
+DROP TRIGGER IF EXISTS trg_personas_cambios_del ON personas;
+CREATE TRIGGER trg_personas_cambios_del
+    AFTER DELETE ON personas REFERENCING OLD TABLE AS filas_viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION registrar_cambios_personas();
+DROP TRIGGER IF EXISTS trg_personas_cambios_trunc ON personas;
+CREATE TRIGGER trg_personas_cambios_trunc
+    AFTER TRUNCATE ON personas
+    FOR EACH STATEMENT EXECUTE FUNCTION registrar_cambios_personas();
+
+-- Estadísticas mantenidas por triggers de sentencia (con tablas de
+-- transición), para que los dashboards lean contadores en O(1)
+CREATE TABLE IF NOT EXISTS estadisticas_personas (
+    genero VARCHAR(20) PRIMARY KEY,
+    cantidad BIGINT NOT NULL DEFAULT 0
+);
+ALTER TABLE estadisticas_personas DROP COLUMN IF EXISTS suma_nacimiento;
+
+-- Por día de cumpleaños (mes * 100 + día): la edad en años cumplidos de cada
+-- persona es el año actual menos su año de nacimiento, menos uno si su
+-- cumpleaños aún no llegó este año. Así el promedio sale de estos contadores
+-- igual que AVG(EXTRACT(YEAR FROM age(fecha_nacimiento)))
+CREATE TABLE IF NOT EXISTS estadisticas_cumpleanos (
+    cumpleanos SMALLINT PRIMARY KEY,
+    cantidad BIGINT NOT NULL DEFAULT 0,
+    suma_anio BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION actualizar_estadisticas_personas()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM estadisticas_personas;
+        DELETE FROM estadisticas_cumpleanos;
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO estadisticas_personas AS e (genero, cantidad)
+        SELECT genero, -COUNT(*) FROM filas_viejas GROUP BY genero
+        ON CONFLICT (genero) DO UPDATE SET cantidad = e.cantidad + EXCLUDED.cantidad;
+
+        INSERT INTO estadisticas_cumpleanos AS e (cumpleanos, cantidad, suma_anio)
+        SELECT to_char(fecha_nacimiento, 'MMDD')::smallint, -COUNT(*), -SUM(EXTRACT(YEAR FROM fecha_nacimiento))
+        FROM filas_viejas GROUP BY 1
+        ON CONFLICT (cumpleanos) DO UPDATE
+        SET cantidad = e.cantidad + EXCLUDED.cantidad, suma_anio = e.suma_anio + EXCLUDED.suma_anio;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO estadisticas_personas AS e (genero, cantidad)
+        SELECT genero, COUNT(*) FROM filas_nuevas GROUP BY genero
+        ON CONFLICT (genero) DO UPDATE SET cantidad = e.cantidad + EXCLUDED.cantidad;
+
+        INSERT INTO estadisticas_cumpleanos AS e (cumpleanos, cantidad, suma_anio)
+        SELECT to_char(fecha_nacimiento, 'MMDD')::smallint, COUNT(*), SUM(EXTRACT(YEAR FROM fecha_nacimiento))
+        FROM filas_nuevas GROUP BY 1
+        ON CONFLICT (cumpleanos) DO UPDATE
+        SET cantidad = e.cantidad + EXCLUDED.cantidad, suma_anio = e.suma_anio + EXCLUDED.suma_anio;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_estadisticas_personas_ins ON personas;
+CREATE TRIGGER trg_estadisticas_personas_ins
+    AFTER INSERT ON personas REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION actualizar_estadisticas_personas();
+DROP TRIGGER IF EXISTS trg_estadisticas_personas_upd ON personas;
+CREATE TRIGGER trg_estadisticas_personas_upd
+    AFTER UPDATE ON personas REFERENCING OLD TABLE AS filas_viejas NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION actualizar_estadisticas_personas();
+DROP TRIGGER IF EXISTS trg_estadisticas_personas_del ON personas;
+CREATE TRIGGER trg_estadisticas_personas_del
+    AFTER DELETE ON personas REFERENCING OLD TABLE AS filas_viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION actualizar_estadisticas_personas();
+DROP TRIGGER IF EXISTS trg_estadisticas_personas_trunc ON personas;
+CREATE TRIGGER trg_estadisticas_personas_trunc
+    AFTER TRUNCATE ON personas
+    FOR EACH STATEMENT EXECUTE FUNCTION actualizar_estadisticas_personas();
+
+-- Contadores de logs: total por tipo y cubetas por hora para la ventana de 24h
+CREATE TABLE IF NOT EXISTS estadisticas_logs (
+    tipo_operacion VARCHAR(20) PRIMARY KEY,
+    cantidad BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS estadisticas_logs_hora (
+    hora TIMESTAMP NOT NULL,
+    tipo_operacion VARCHAR(20) NOT NULL,
+    cantidad BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (hora, tipo_operacion)
+);
+
+CREATE OR REPLACE FUNCTION actualizar_estadisticas_logs()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO estadisticas_logs AS e (tipo_operacion, cantidad)
+    SELECT tipo_operacion, COUNT(*) FROM filas_nuevas GROUP BY tipo_operacion
+    ON CONFLICT (tipo_operacion) DO UPDATE SET cantidad = e.cantidad + EXCLUDED.cantidad;
+
+    INSERT INTO estadisticas_logs_hora AS e (hora, tipo_operacion, cantidad)
+    SELECT date_trunc('hour', fecha_transaccion), tipo_operacion, COUNT(*)
+    FROM filas_nuevas GROUP BY 1, 2
+    ON CONFLICT (hora, tipo_operacion) DO UPDATE SET cantidad = e.cantidad + EXCLUDED.cantidad;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_estadisticas_logs ON logs;
+CREATE TRIGGER trg_estadisticas_logs
+    AFTER INSERT ON logs REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION actualizar_estadisticas_logs();
+
+-- Carga inicial de los contadores al aplicar la migración sobre datos existentes
+INSERT INTO estadisticas_personas (genero, cantidad)
+SELECT genero, COUNT(*)
+FROM personas
+WHERE NOT EXISTS (SELECT 1 FROM estadisticas_personas)
+GROUP BY genero;
+
+INSERT INTO estadisticas_cumpleanos (cumpleanos, cantidad, suma_anio)
+SELECT to_char(fecha_nacimiento, 'MMDD')::smallint, COUNT(*), SUM(EXTRACT(YEAR FROM fecha_nacimiento))
+FROM personas
+WHERE NOT EXISTS (SELECT 1 FROM estadisticas_cumpleanos)
+GROUP BY 1;
+
+INSERT INTO estadisticas_logs (tipo_operacion, cantidad)
+SELECT tipo_operacion, COUNT(*)
+FROM logs
+WHERE NOT EXISTS (SELECT 1 FROM estadisticas_logs)
+GROUP BY tipo_operacion;
+
+INSERT INTO estadisticas_logs_hora (hora, tipo_operacion, cantidad)
+SELECT date_trunc('hour', fecha_transaccion), tipo_operacion, COUNT(*)
+FROM logs
+WHERE fecha_transaccion > NOW() - INTERVAL '24 hours'
+  AND NOT EXISTS (SELECT 1 FROM estadisticas_logs_hora)
+GROUP BY 1, 2;
 
 -- Índices para búsquedas
 CREATE INDEX IF NOT EXISTS idx_personas_documento ON personas(numero_documento);
+CREATE INDEX IF NOT EXISTS idx_personas_fecha_nacimiento ON personas(fecha_nacimiento);
 CREATE INDEX IF NOT EXISTS idx_logs_documento ON logs(numero_documento);
-CREATE INDEX IF NOT EXISTS idx_logs_fecha ON logs(fecha_transaccion);
 CREATE INDEX IF NOT EXISTS idx_logs_tipo ON logs(tipo_operacion);
+-- Paginación por llave (fecha_transaccion, id) en orden descendente; también
+-- sirve los rangos por fecha, así que el índice solo por fecha sobra
+DROP INDEX IF EXISTS idx_logs_fecha;
+CREATE INDEX IF NOT EXISTS idx_logs_fecha_id ON logs(fecha_transaccion, id);
+-- Filtros sobre detalles: contención (@>) y jsonpath (@?, @@)
+CREATE INDEX IF NOT EXISTS idx_logs_detalles ON logs USING GIN (detalles jsonb_path_ops);
 
 -- Insertar datos de prueba
 INSERT INTO personas (tipo_documento, numero_documento, primer_nombre, segundo_nombre, apellidos, fecha_nacimiento, genero, correo_electronico, celular)
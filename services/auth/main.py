@@ -1,8 +1,12 @@
  
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Optional
 import os
+from common.auth import (AUTH_MODO, TokenInvalido, VerificadorJWT, firmar_token,
+                         generar_clave_local)
+from common.metricas import instalar_metricas
 
 app = FastAPI(title="Auth Service")
 
@@ -13,10 +17,21 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+instalar_metricas(app, "auth")
 
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN", "dev-example.auth0.com")
 AUTH0_API_AUDIENCE = os.getenv("AUTH0_API_AUDIENCE", "https://api.example.com")
 
+# En modo local este servicio firma los tokens con su propia clave y publica
+# el JWKS que usan los demás servicios para verificarlos
+clave_local = generar_clave_local(os.getenv("AUTH_CLAVE_ARCHIVO")) if AUTH_MODO == "local" else None
+if clave_local:
+    verificador = VerificadorJWT(jwks_url=None, claves=[clave_local["jwk"]])
+elif AUTH_MODO == "jwks":
+    verificador = VerificadorJWT()
+else:
+    verificador = None
+
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str
@@ -27,24 +42,44 @@ async def health_check():
     return {"status": "healthy", "service": "auth"}
 
 @app.post("/dev-token", response_model=TokenResponse)
-async def get_dev_token():
-    """Token de desarrollo para pruebas"""
+async def get_dev_token(sub: str = "dev-user", ttl: int = Query(3600, ge=60, le=86400)):
+    """Token de desarrollo para pruebas; con ``ttl`` corto sirve para ``?access_token=``"""
+    if clave_local:
+        return TokenResponse(
+            access_token=firmar_token(clave_local, sub, ttl=ttl, name="Usuario de Desarrollo"),
+            token_type="bearer",
+            message="Token RS256 firmado con la clave local (AUTH_MODO=local)"
+        )
     return TokenResponse(
         access_token="dev-token-123456789",
         token_type="bearer",
         message="Token de desarrollo - configurar Auth0 para producción"
     )
 
+@app.get("/.well-known/jwks.json")
+async def jwks():
+    """Claves públicas del modo local"""
+    return {"keys": [clave_local["jwk"]] if clave_local else []}
+
 @app.get("/verify")
-async def verify_token():
-    """Verificación simplificada para desarrollo"""
-    return {
-        "valid": True, 
-        "user": {
-            "sub": "dev-user",
-            "name": "Usuario de Desarrollo"
+async def verify_token(authorization: Optional[str] = Header(None)):
+    """Verifica el token Bearer; sin verificador configurado acepta cualquiera"""
+    if verificador is None:
+        return {
+            "valid": True, 
+            "user": {
+                "sub": "dev-user",
+                "name": "Usuario de Desarrollo"
+            }
         }
-    }
+    esquema, _, token = (authorization or "").partition(" ")
+    if esquema.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Falta el token Bearer")
+    try:
+        claims = await verificador.verificar(token.strip())
+    except TokenInvalido as e:
+        raise HTTPException(status_code=401, detail=f"Token inválido: {e}")
+    return {"valid": True, "user": claims}
 
 @app.get("/config")
 async def get_auth_config():
@@ -52,6 +87,8 @@ async def get_auth_config():
     return {
         "domain": AUTH0_DOMAIN,
         "audience": AUTH0_API_AUDIENCE,
-        "mode": "development" if "dev-example" in AUTH0_DOMAIN else "production"
+        "mode": "development" if "dev-example" in AUTH0_DOMAIN else "production",
+        "verificacion": AUTH_MODO,
+        "estadisticas": verificador.estadisticas() if verificador else None
     }
  
\ No newline at end of file
@@ -0,0 +1 @@
+"""Utilidades compartidas por los servicios (se copian en cada imagen)."""
@@ -0,0 +1,195 @@
+"""Control de admisión: límite de tasa por cliente y de concurrencia por ruta.
+
+Cada ruta limitada tiene una cubeta de tokens por cliente (``tasa`` por
+segundo, capacidad ``rafaga``); sin tokens se responde 429 con
+``Retry-After``. Además, como mucho ``concurrencia`` peticiones de la ruta se
+atienden a la vez en el proceso; las demás esperan hasta ``espera_max``
+segundos (máximo ``cola`` en espera) y después se rechazan con 503, en lugar
+de acumularse sin límite delante de ``db_pool.acquire()``.
+
+El cliente es el ``sub`` del token si hay autenticación, si no la IP que
+reenvía nginx (``X-Real-IP``). Los límites por defecto de cada servicio se
+pueden sobrescribir con ``LIMITES_RUTAS`` (JSON), por ejemplo::
+
+    LIMITES_RUTAS='{"POST /consulta-nlp": {"tasa": 2, "rafaga": 10}, "GET /logs": null}'
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from starlette.responses import JSONResponse
+
+from common.metricas import PoolAgotado, plantilla_ruta, registro
+
+ADMISION_ESPERA_MAX = float(os.getenv("ADMISION_ESPERA_MAX", "2"))
+ADMISION_MAX_CLIENTES = int(os.getenv("ADMISION_MAX_CLIENTES", "100000"))
+LIMITES_RUTAS = os.getenv("LIMITES_RUTAS")
+
+peticiones_rechazadas = registro.contador(
+    "http_requests_rejected_total", "Peticiones rechazadas por el control de admisión",
+    ("servicio", "ruta", "motivo")
+)
+
+
+class Limite:
+    def __init__(
+        self,
+        tasa: Optional[float] = None,
+        rafaga: Optional[float] = None,
+        concurrencia: Optional[int] = None,
+        espera_max: float = ADMISION_ESPERA_MAX,
+        cola: Optional[int] = None,
+    ):
+        self.tasa = tasa
+        self.rafaga = rafaga or (max(1.0, tasa) if tasa else None)
+        self.concurrencia = concurrencia
+        self.espera_max = espera_max
+        self.cola = cola if cola is not None else (concurrencia * 2 if concurrencia else None)
+
+
+class _EstadoRuta:
+    def __init__(self, limite: Limite):
+        self.limite = limite
+        self.semaforo = asyncio.Semaphore(limite.concurrencia) if limite.concurrencia else None
+        self.en_curso = 0
+        self.esperando = 0
+        self.contadores = {"admitidas": 0, "rechazadas_tasa": 0, "rechazadas_concurrencia": 0}
+
+
+class ControlAdmision:
+    def __init__(self, servicio: str, limites: Dict[str, Optional[Limite]],
+                 max_clientes: int = ADMISION_MAX_CLIENTES):
+        self.servicio = servicio
+        self.rutas = {clave: _EstadoRuta(l) for clave, l in limites.items() if l is not None}
+        self.max_clientes = max_clientes
+        # (ruta, cliente) -> [tokens, último instante]; LRU acotado
+        self._cubetas: "OrderedDict[tuple, list]" = OrderedDict()
+
+    def tomar_token(self, clave: str, cliente: str) -> float:
+        """0 si hay token; si no, segundos hasta el próximo."""
+        limite = self.rutas[clave].limite
+        if not limite.tasa:
+            return 0.0
+        ahora = time.monotonic()
+        cubeta = self._cubetas.get((clave, cliente))
+        if cubeta is None:
+            cubeta = self._cubetas[(clave, cliente)] = [limite.rafaga, ahora]
+            if len(self._cubetas) > self.max_clientes:
+                self._cubetas.popitem(last=False)
+        else:
+            self._cubetas.move_to_end((clave, cliente))
+            cubeta[0] = min(limite.rafaga, cubeta[0] + (ahora - cubeta[1]) * limite.tasa)
+            cubeta[1] = ahora
+        if cubeta[0] >= 1:
+            cubeta[0] -= 1
+            return 0.0
+        return (1 - cubeta[0]) / limite.tasa
+
+    def estadisticas(self) -> dict:
+        return {
+            "clientes": len(self._cubetas),
+            "rutas": {
+                clave: {
+                    **estado.contadores,
+                    "en_curso": estado.en_curso,
+                    "esperando": estado.esperando,
+                    "tasa": estado.limite.tasa,
+                    "rafaga": estado.limite.rafaga,
+                    "concurrencia": estado.limite.concurrencia,
+                }
+                for clave, estado in self.rutas.items()
+            },
+        }
+
+
+def _cliente(scope) -> str:
+    usuario = scope.get("state", {}).get("usuario")
+    if usuario and usuario.get("sub"):
+        return f"sub:{usuario['sub']}"
+    cabeceras = dict(scope["headers"])
+    reenviada = cabeceras.get(b"x-real-ip") or cabeceras.get(b"x-forwarded-for", b"").split(b",")[0].strip()
+    if reenviada:
+        return reenviada.decode("latin-1")
+    return scope["client"][0] if scope.get("client") else "desconocido"
+
+
+def _rechazo(codigo: int, detalle: str, reintentar: float) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detalle}, status_code=codigo,
+        headers={"Retry-After": str(max(1, math.ceil(reintentar)))}
+    )
+
+
+class MiddlewareAdmision:
+    def __init__(self, app, control: ControlAdmision):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.control.rutas:
+            await self.app(scope, receive, send)
+            return
+        clave = f"{scope['method']} {plantilla_ruta(scope['app'], scope)}"
+        estado = self.control.rutas.get(clave)
+        if estado is None:
+            await self.app(scope, receive, send)
+            return
+
+        espera = self.control.tomar_token(clave, _cliente(scope))
+        if espera:
+            estado.contadores["rechazadas_tasa"] += 1
+            peticiones_rechazadas.inc(self.control.servicio, clave, "tasa")
+            await _rechazo(429, "Demasiadas peticiones, intente más tarde", espera)(scope, receive, send)
+            return
+
+        limite = estado.limite
+        if estado.semaforo is not None:
+            admitida = False
+            if not (estado.semaforo.locked() and estado.esperando >= limite.cola):
+                estado.esperando += 1
+                try:
+                    await asyncio.wait_for(estado.semaforo.acquire(), timeout=limite.espera_max)
+                    admitida = True
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    estado.esperando -= 1
+            if not admitida:
+                estado.contadores["rechazadas_concurrencia"] += 1
+                peticiones_rechazadas.inc(self.control.servicio, clave, "concurrencia")
+                await _rechazo(503, "Servicio saturado, intente más tarde", limite.espera_max)(scope, receive, send)
+                return
+
+        estado.contadores["admitidas"] += 1
+        estado.en_curso += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            estado.en_curso -= 1
+            if estado.semaforo is not None:
+                estado.semaforo.release()
+
+
+def _limites_configurados(por_defecto: Dict[str, Optional[Limite]]) -> Dict[str, Optional[Limite]]:
+    limites = dict(por_defecto)
+    if LIMITES_RUTAS:
+        for clave, valores in json.loads(LIMITES_RUTAS).items():
+            limites[clave] = Limite(**valores) if valores is not None else None
+    return limites
+
+
+async def _pool_agotado(request, exc):
+    return _rechazo(503, "Sin conexiones libres a la base de datos, intente más tarde", 1)
+
+
+def instalar_admision(app, servicio: str, limites: Dict[str, Optional[Limite]]) -> ControlAdmision:
+    """Limita las rutas de ``limites`` (``"METODO /ruta"``) y responde 503 si
+    se agota la espera por una conexión del pool."""
+    control = ControlAdmision(servicio, _limites_configurados(limites))
+    app.add_middleware(MiddlewareAdmision, control=control)
+    app.add_exception_handler(PoolAgotado, _pool_agotado)
+    return control
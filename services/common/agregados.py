@@ -0,0 +1,79 @@
+"""Agregados de personas calculados en la base con una sola consulta.
+
+Las dimensiones y métricas se eligen de listas cerradas, así el SQL se arma
+solo con fragmentos conocidos; los valores de los filtros van como
+parámetros. Lo usan ``/agregados`` de consultas y la recuperación del NLP.
+"""
+from typing import Dict, List, Sequence, Tuple
+
+TRAMO_ANIOS_DEFECTO = 10
+
+# nombre -> expresión SQL; el tramo de años se sustituye tras validarlo
+DIMENSIONES = {
+    "genero": "genero",
+    "tipo_documento": "tipo_documento",
+    "anio_nacimiento": "(EXTRACT(YEAR FROM fecha_nacimiento)::int / {tramo} * {tramo})",
+    "mes_creacion": "date_trunc('month', created_at)::date",
+}
+# La edad mínima es la de la fecha de nacimiento más reciente y viceversa
+METRICAS = {
+    "cantidad": "COUNT(*)",
+    "edad_min": "EXTRACT(YEAR FROM age(MAX(fecha_nacimiento)))::int",
+    "edad_max": "EXTRACT(YEAR FROM age(MIN(fecha_nacimiento)))::int",
+    "edad_promedio": "ROUND(AVG(EXTRACT(YEAR FROM age(fecha_nacimiento)))::numeric, 1)::float8",
+}
+METRICAS_DEFECTO = ("cantidad",)
+
+
+def _lista(valor, validos, que: str) -> List[str]:
+    nombres = [n.strip() for n in valor.split(",") if n.strip()] if isinstance(valor, str) else list(valor or ())
+    desconocidos = [n for n in nombres if n not in validos]
+    if desconocidos:
+        raise ValueError(f"{que} desconocidas: {', '.join(desconocidos)}. Válidas: {', '.join(validos)}")
+    # Sin repetidos, conservando el orden pedido
+    return list(dict.fromkeys(nombres))
+
+
+def interpretar(agrupar, metricas) -> Tuple[List[str], List[str]]:
+    """Dimensiones y métricas validadas (``ValueError`` si hay desconocidas)."""
+    dimensiones = _lista(agrupar, DIMENSIONES, "Dimensiones")
+    metricas = _lista(metricas, METRICAS, "Métricas") or list(METRICAS_DEFECTO)
+    return dimensiones, metricas
+
+
+def consulta_agregados(
+    dimensiones: Sequence[str],
+    metricas: Sequence[str],
+    where: str = "",
+    tramo_anios: int = TRAMO_ANIOS_DEFECTO,
+    total: bool = False,
+) -> str:
+    """``SELECT`` agrupado; ``where`` llega armado por el llamador con sus
+    parámetros ``$n``. Con ``total`` se añade la fila del total general
+    (``es_total``) en la misma consulta."""
+    if tramo_anios < 1:
+        raise ValueError("El tramo de años debe ser positivo")
+    expresiones = [DIMENSIONES[d].format(tramo=int(tramo_anios)) for d in dimensiones]
+    columnas = [f"{e} AS {d}" for e, d in zip(expresiones, dimensiones)]
+    columnas += [f"{METRICAS[m]} AS {m}" for m in metricas]
+    if dimensiones and total:
+        columnas.append(f"GROUPING({expresiones[0]}) = 1 AS es_total")
+    sql = f"SELECT {', '.join(columnas)} FROM personas{where}"
+    if dimensiones:
+        grupo = ", ".join(expresiones)
+        sql += f" GROUP BY GROUPING SETS (({grupo}), ())" if total else f" GROUP BY {grupo}"
+        sql += f" ORDER BY {grupo}"
+    return sql
+
+
+async def calcular_agregados(
+    conn,
+    dimensiones: Sequence[str],
+    metricas: Sequence[str],
+    where: str = "",
+    params: Sequence = (),
+    tramo_anios: int = TRAMO_ANIOS_DEFECTO,
+    total: bool = False,
+) -> List[Dict]:
+    sql = consulta_agregados(dimensiones, metricas, where, tramo_anios, total)
+    return [dict(r) for r in await conn.fetch(sql, *params)]
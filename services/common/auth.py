@@ -0,0 +1,283 @@
+"""Verificación de JWT (RS256) en proceso, sin llamar al servicio de auth.
+
+Las claves públicas se obtienen del JWKS (``AUTH_JWKS_URL``) y se refrescan en
+segundo plano; un ``kid`` desconocido fuerza un refresco inmediato (con un
+mínimo entre refrescos). Los claims ya verificados se cachean por token hasta
+su expiración, así verificar un token repetido es una búsqueda en un dict.
+
+``AUTH_MODO``:
+  desactivado  no se exige token (por defecto, compatible con el frontend)
+  local        el servicio de auth genera un par de claves propio, firma los
+               tokens de ``/dev-token`` y publica el JWKS; sin Auth0
+  jwks         tokens de un proveedor externo (Auth0) con su JWKS
+
+``EventSource`` no puede enviar ``Authorization``: en las rutas de streaming
+que lo declaran se acepta el token en ``?access_token=``, solo si es de vida
+corta (``AUTH_TOKEN_CONSULTA_TTL``), porque la URL queda en los logs de acceso.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterable, Optional
+from urllib.parse import parse_qs
+
+import httpx
+from fastapi import HTTPException, Request
+from jose import jwt, JWTError
+from starlette.responses import JSONResponse
+
+from common.cache import CacheTTL
+from common.metricas import registro
+
+AUTH_MODO = os.getenv("AUTH_MODO", "desactivado")
+AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN", "dev-example.auth0.com")
+AUTH_AUDIENCIA = os.getenv("AUTH_AUDIENCIA", os.getenv("AUTH0_API_AUDIENCE", "https://api.example.com"))
+AUTH_EMISOR = os.getenv("AUTH_EMISOR") or None
+AUTH_JWKS_URL = os.getenv(
+    "AUTH_JWKS_URL",
+    "http://auth-service:8000/.well-known/jwks.json" if AUTH_MODO == "local"
+    else f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
+)
+AUTH_JWKS_REFRESCO = float(os.getenv("AUTH_JWKS_REFRESCO", "600"))
+AUTH_JWKS_REFRESCO_MIN = float(os.getenv("AUTH_JWKS_REFRESCO_MIN", "10"))
+AUTH_CACHE_TOKENS = int(os.getenv("AUTH_CACHE_TOKENS", "10000"))
+AUTH_TOKEN_CONSULTA_TTL = int(os.getenv("AUTH_TOKEN_CONSULTA_TTL", "300"))
+# Operaciones destructivas (p. ej. borrar particiones de logs)
+AUTH_ALCANCE_ADMIN = os.getenv("AUTH_ALCANCE_ADMIN", "admin")
+RUTAS_PUBLICAS = ("/health", "/metrics", "/docs", "/openapi.json", "/redoc", "/.well-known/jwks.json")
+
+verificacion_duracion = registro.histograma(
+    "auth_verification_seconds", "Tiempo añadido por la verificación del token",
+    ("resultado",),
+    buckets=(0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.25, 1.0)
+)
+
+
+class TokenInvalido(Exception):
+    """Token ausente, mal formado, expirado o con firma inválida."""
+
+
+def _b64url(numero: int) -> str:
+    datos = numero.to_bytes((numero.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(datos).rstrip(b"=").decode()
+
+
+def generar_clave_local(ruta: Optional[str] = None) -> dict:
+    """Par RSA para el modo local: PEM privado para firmar y JWK público. Con
+    ``ruta`` la clave se guarda y se reutiliza entre reinicios."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    if ruta and os.path.exists(ruta):
+        with open(ruta, "rb") as archivo:
+            privada = serialization.load_pem_private_key(archivo.read(), password=None)
+    else:
+        privada = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = privada.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    if ruta and not os.path.exists(ruta):
+        with open(ruta, "w") as archivo:
+            archivo.write(pem)
+
+    publica = privada.public_key().public_numbers()
+    jwk = {"kty": "RSA", "alg": "RS256", "use": "sig", "n": _b64url(publica.n), "e": _b64url(publica.e)}
+    jwk["kid"] = hashlib.sha256(json.dumps(jwk, sort_keys=True).encode()).hexdigest()[:16]
+    return {"privada_pem": pem, "jwk": jwk}
+
+
+def firmar_token(clave: dict, sub: str, ttl: float = 3600, **claims) -> str:
+    ahora = int(time.time())
+    contenido = {"sub": sub, "aud": AUTH_AUDIENCIA, "iat": ahora, "exp": ahora + int(ttl), **claims}
+    if AUTH_EMISOR:
+        contenido.setdefault("iss", AUTH_EMISOR)
+    return jwt.encode(contenido, clave["privada_pem"], algorithm="RS256", headers={"kid": clave["jwk"]["kid"]})
+
+
+class VerificadorJWT:
+    def __init__(
+        self,
+        jwks_url: Optional[str] = AUTH_JWKS_URL,
+        audiencia: Optional[str] = AUTH_AUDIENCIA,
+        emisor: Optional[str] = AUTH_EMISOR,
+        claves: Iterable[dict] = (),
+        refresco: float = AUTH_JWKS_REFRESCO,
+        max_tokens: int = AUTH_CACHE_TOKENS,
+    ):
+        self.jwks_url = jwks_url
+        self.audiencia = audiencia
+        self.emisor = emisor
+        self.refresco = refresco
+        self._claves: Dict[str, dict] = {c["kid"]: c for c in claves}
+        self._claims = CacheTTL(max_entradas=max_tokens, ttl=refresco)
+        self._ultimo_refresco = 0.0
+        self._bloqueo = asyncio.Lock()
+        self._tarea: Optional[asyncio.Task] = None
+        self.contadores = {"verificados": 0, "desde_cache": 0, "rechazados": 0, "refrescos_jwks": 0,
+                           "errores_jwks": 0, "segundos_verificando": 0.0}
+
+    async def refrescar_claves(self, forzar: bool = False):
+        """Descarga el JWKS; sin ``forzar`` respeta el intervalo mínimo."""
+        if not self.jwks_url:
+            return
+        async with self._bloqueo:
+            if not forzar and time.monotonic() - self._ultimo_refresco < AUTH_JWKS_REFRESCO_MIN:
+                return
+            self._ultimo_refresco = time.monotonic()
+            try:
+                async with httpx.AsyncClient(timeout=5) as cliente:
+                    respuesta = await cliente.get(self.jwks_url)
+                    respuesta.raise_for_status()
+                claves = {c["kid"]: c for c in respuesta.json().get("keys", []) if "kid" in c}
+                # Una respuesta vacía no borra las claves conocidas
+                if claves:
+                    self._claves = claves
+                self.contadores["refrescos_jwks"] += 1
+            except Exception as e:
+                self.contadores["errores_jwks"] += 1
+                print(f"Error descargando JWKS de {self.jwks_url}: {e}")
+
+    def iniciar(self):
+        if self._tarea is None and self.jwks_url:
+            self._tarea = asyncio.create_task(self._refrescar_periodicamente())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    async def _refrescar_periodicamente(self):
+        while True:
+            await self.refrescar_claves()
+            await asyncio.sleep(self.refresco)
+
+    async def verificar(self, token: str) -> dict:
+        """Claims del token o ``TokenInvalido``."""
+        inicio = time.perf_counter()
+        claims = self._claims.obtener(token)
+        if claims is not None and claims.get("exp", 0) > time.time():
+            self.contadores["desde_cache"] += 1
+            self._medir(inicio, "cache")
+            return claims
+
+        try:
+            try:
+                kid = jwt.get_unverified_header(token).get("kid")
+            except JWTError as e:
+                raise TokenInvalido(f"Token mal formado: {e}")
+            if kid not in self._claves:
+                self.iniciar()
+                await self.refrescar_claves(forzar=not self._claves)
+            clave = self._claves.get(kid)
+            if clave is None:
+                raise TokenInvalido("Clave de firma desconocida")
+            try:
+                claims = jwt.decode(
+                    token, clave, algorithms=["RS256"], audience=self.audiencia, issuer=self.emisor,
+                    options={"verify_aud": bool(self.audiencia), "verify_iss": bool(self.emisor)}
+                )
+            except JWTError as e:
+                raise TokenInvalido(str(e))
+        except TokenInvalido:
+            self.contadores["rechazados"] += 1
+            self._medir(inicio, "invalido")
+            raise
+
+        restante = claims.get("exp", 0) - time.time()
+        if restante > 0:
+            self._claims.guardar(token, claims, ttl=restante)
+        self.contadores["verificados"] += 1
+        self._medir(inicio, "verificado")
+        return claims
+
+    def _medir(self, inicio: float, resultado: str):
+        duracion = time.perf_counter() - inicio
+        self.contadores["segundos_verificando"] += duracion
+        verificacion_duracion.observar(duracion, resultado)
+
+    def estadisticas(self) -> dict:
+        total = self.contadores["verificados"] + self.contadores["desde_cache"] + self.contadores["rechazados"]
+        return {
+            **self.contadores,
+            "claves": len(self._claves),
+            "promedio_us": round(self.contadores["segundos_verificando"] / total * 1e6, 1) if total else 0.0,
+            "cache_tokens": self._claims.estadisticas(),
+        }
+
+
+def _no_autorizado(detalle: str) -> JSONResponse:
+    return JSONResponse({"detail": detalle}, status_code=401, headers={"WWW-Authenticate": "Bearer"})
+
+
+class MiddlewareAuth:
+    """Exige ``Authorization: Bearer <jwt>`` salvo en las rutas públicas y
+    deja los claims en ``request.state.usuario``. En ``token_en_consulta`` el
+    token puede llegar en ``?access_token=`` (para ``EventSource``)."""
+
+    def __init__(self, app, verificador: VerificadorJWT, publicas=RUTAS_PUBLICAS, token_en_consulta=()):
+        self.app = app
+        self.verificador = verificador
+        self.publicas = tuple(publicas)
+        self.token_en_consulta = frozenset(token_en_consulta)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"].startswith(self.publicas):
+            await self.app(scope, receive, send)
+            return
+
+        cabeceras = dict(scope["headers"])
+        esquema, _, token = cabeceras.get(b"authorization", b"").decode("latin-1").partition(" ")
+        en_consulta = False
+        if not token and scope["path"] in self.token_en_consulta:
+            esquema, en_consulta = "bearer", True
+            token = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("access_token", [""])[0]
+        if esquema.lower() != "bearer" or not token:
+            await _no_autorizado("Falta el token Bearer")(scope, receive, send)
+            return
+        try:
+            claims = await self.verificador.verificar(token.strip())
+        except TokenInvalido as e:
+            await _no_autorizado(f"Token inválido: {e}")(scope, receive, send)
+            return
+        if en_consulta and claims.get("exp", 0) - claims.get("iat", 0) > AUTH_TOKEN_CONSULTA_TTL:
+            await _no_autorizado(
+                f"El token en la URL debe durar como mucho {AUTH_TOKEN_CONSULTA_TTL}s"
+            )(scope, receive, send)
+            return
+        scope.setdefault("state", {})["usuario"] = claims
+        await self.app(scope, receive, send)
+
+
+def instalar_auth(app, modo: str = AUTH_MODO, publicas=RUTAS_PUBLICAS, token_en_consulta=()) -> Optional[VerificadorJWT]:
+    """Protege la app si ``modo`` no es ``desactivado``; devuelve el verificador."""
+    if modo == "desactivado":
+        return None
+    verificador = VerificadorJWT()
+    app.add_middleware(MiddlewareAuth, verificador=verificador, publicas=publicas,
+                       token_en_consulta=token_en_consulta)
+    return verificador
+
+
+def alcances(claims: dict) -> set:
+    """``scope`` (OAuth, separado por espacios) y ``permissions`` (Auth0)."""
+    return set((claims.get("scope") or "").split()) | set(claims.get("permissions") or ())
+
+
+def exigir_alcance(request: Request, alcance: str = AUTH_ALCANCE_ADMIN) -> None:
+    """403 si el token no trae ``alcance``. Sin autenticación no hay token
+    que revisar: solo se aceptan llamadas desde el propio contenedor."""
+    if AUTH_MODO == "desactivado":
+        cliente = request.client.host if request.client else None
+        if cliente not in ("127.0.0.1", "::1"):
+            raise HTTPException(status_code=403, detail="Solo disponible desde el propio servicio sin autenticación")
+        return
+    claims = getattr(request.state, "usuario", None) or {}
+    if alcance not in alcances(claims):
+        raise HTTPException(status_code=403, detail=f"Se requiere el alcance '{alcance}'")
@@ -0,0 +1,71 @@
+"""Caché en proceso LRU con expiración (TTL) y métricas de aciertos."""
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+_AUSENTE = object()
+
+
+class CacheTTL:
+    def __init__(self, max_entradas: int = 1024, ttl: float = 60.0):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.contadores = {"hits": 0, "misses": 0, "expirados": 0, "desalojados": 0, "invalidados": 0}
+
+    def obtener(self, clave: Hashable, defecto: Any = None) -> Any:
+        entrada = self._datos.get(clave, _AUSENTE)
+        if entrada is _AUSENTE:
+            self.contadores["misses"] += 1
+            return defecto
+        valor, expira = entrada
+        if expira < time.monotonic():
+            del self._datos[clave]
+            self.contadores["expirados"] += 1
+            self.contadores["misses"] += 1
+            return defecto
+        self._datos.move_to_end(clave)
+        self.contadores["hits"] += 1
+        return valor
+
+    def guardar(self, clave: Hashable, valor: Any, ttl: Optional[float] = None):
+        self._datos[clave] = (valor, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+            self.contadores["desalojados"] += 1
+
+    async def obtener_o_calcular(
+        self, clave: Hashable, calcular: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, dict]:
+        """Devuelve el valor cacheado o lo calcula, junto con metadatos de
+        frescura para que el cliente sepa qué tan viejo es el dato."""
+        entrada = self.obtener(clave)
+        desde_cache = entrada is not None
+        if not desde_cache:
+            entrada = (await calcular(), datetime.now(), time.monotonic())
+            self.guardar(clave, entrada)
+        valor, calculado_en, instante = entrada
+        return valor, {
+            "cache": desde_cache,
+            "calculado_en": calculado_en.isoformat(),
+            "antiguedad_segundos": round(time.monotonic() - instante, 3),
+            "ttl_segundos": self.ttl,
+        }
+
+    def invalidar(self, clave: Hashable):
+        if self._datos.pop(clave, _AUSENTE) is not _AUSENTE:
+            self.contadores["invalidados"] += 1
+
+    def limpiar(self):
+        self.contadores["invalidados"] += len(self._datos)
+        self._datos.clear()
+
+    def estadisticas(self) -> dict:
+        consultas = self.contadores["hits"] + self.contadores["misses"]
+        return {
+            **self.contadores,
+            "entradas": len(self._datos),
+            "ratio_aciertos": round(self.contadores["hits"] / consultas, 4) if consultas else 0.0,
+        }
@@ -0,0 +1,208 @@
+"""Caché de lectura (read-through) para consultas por número de documento.
+
+Nivel 1: ``CacheTTL`` en proceso. Nivel 2 (opcional): una caché compartida
+entre réplicas, Redis si ``CACHE_COMPARTIDO_URL`` es ``redis://...`` o un
+sustituto en memoria con ``memoria://`` para pruebas locales.
+
+Las escrituras sobre ``personas`` disparan ``pg_notify('personas_cache', ...)``
+desde un trigger; cada réplica escucha el canal con una conexión dedicada e
+invalida sus entradas. El payload es una lista de documentos separada por
+comas, o ``*`` para vaciar la caché.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+import asyncpg
+
+from common.cache import CacheTTL
+from common.serializacion import a_json
+
+CANAL_INVALIDACION = "personas_cache"
+CACHE_PERSONAS_TTL = float(os.getenv("CACHE_PERSONAS_TTL", "60"))
+CACHE_PERSONAS_MAX = int(os.getenv("CACHE_PERSONAS_MAX", "10000"))
+CACHE_COMPARTIDO_URL = os.getenv("CACHE_COMPARTIDO_URL")
+
+
+class CacheCompartidoMemoria:
+    """Sustituto local de la caché compartida (misma interfaz que Redis)."""
+
+    def __init__(self):
+        self._datos = {}
+
+    async def obtener(self, clave: str) -> Optional[str]:
+        entrada = self._datos.get(clave)
+        if entrada is None or entrada[1] < time.monotonic():
+            self._datos.pop(clave, None)
+            return None
+        return entrada[0]
+
+    async def guardar(self, clave: str, valor: str, ttl: float):
+        self._datos[clave] = (valor, time.monotonic() + ttl)
+
+    async def invalidar(self, *claves: str):
+        for clave in claves:
+            self._datos.pop(clave, None)
+
+    async def limpiar(self, prefijo: str):
+        for clave in [c for c in self._datos if c.startswith(prefijo)]:
+            del self._datos[clave]
+
+
+class CacheCompartidoRedis:
+    def __init__(self, url: str):
+        import redis.asyncio as redis  # dependencia opcional
+        self._redis = redis.from_url(url)
+
+    async def obtener(self, clave: str) -> Optional[str]:
+        return await self._redis.get(clave)
+
+    async def guardar(self, clave: str, valor: str, ttl: float):
+        await self._redis.set(clave, valor, px=int(ttl * 1000))
+
+    async def invalidar(self, *claves: str):
+        if claves:
+            await self._redis.delete(*claves)
+
+    async def limpiar(self, prefijo: str):
+        async for clave in self._redis.scan_iter(match=f"{prefijo}*"):
+            await self._redis.delete(clave)
+
+
+def crear_cache_compartido(url: Optional[str] = CACHE_COMPARTIDO_URL):
+    if not url:
+        return None
+    if url.startswith("memoria://"):
+        return CacheCompartidoMemoria()
+    try:
+        return CacheCompartidoRedis(url)
+    except Exception as e:
+        print(f"Caché compartida no disponible ({e}) - solo caché en proceso")
+        return None
+
+
+class CacheLectura:
+    def __init__(
+        self,
+        nombre: str,
+        ttl: float = CACHE_PERSONAS_TTL,
+        max_entradas: int = CACHE_PERSONAS_MAX,
+        compartido=None,
+    ):
+        self.prefijo = f"{nombre}:"
+        self.ttl = ttl
+        self.local = CacheTTL(max_entradas=max_entradas, ttl=ttl)
+        self.compartido = compartido
+        self.contadores = {"hits_compartido": 0, "errores_compartido": 0, "notificaciones": 0}
+        self._conexion = None
+        self._tarea: Optional[asyncio.Task] = None
+        # Cambia con cada invalidación; un valor cargado mientras tanto puede
+        # estar obsoleto y no se guarda
+        self._generacion = 0
+
+    @property
+    def generacion(self) -> int:
+        """Para distinguir cargas empezadas antes y después de una invalidación."""
+        return self._generacion
+
+    async def obtener(self, clave: str, cargar: Callable[[], Awaitable[Any]]) -> Any:
+        """Devuelve el valor cacheado o lo carga con ``cargar``. ``None`` no se cachea."""
+        valor = self.local.obtener(clave)
+        if valor is not None:
+            return valor
+
+        if self.compartido:
+            try:
+                serializado = await self.compartido.obtener(self.prefijo + clave)
+            except Exception as e:
+                self.contadores["errores_compartido"] += 1
+                print(f"Error leyendo caché compartida: {e}")
+                serializado = None
+            if serializado is not None:
+                self.contadores["hits_compartido"] += 1
+                valor = json.loads(serializado)
+                self.local.guardar(clave, valor)
+                return valor
+
+        generacion = self._generacion
+        valor = await cargar()
+        if valor is not None and generacion == self._generacion:
+            self.local.guardar(clave, valor)
+            if self.compartido:
+                try:
+                    await self.compartido.guardar(
+                        self.prefijo + clave, json.dumps(valor, default=a_json), self.ttl
+                    )
+                except Exception as e:
+                    self.contadores["errores_compartido"] += 1
+                    print(f"Error escribiendo caché compartida: {e}")
+        return valor
+
+    async def invalidar(self, *claves: str):
+        self._generacion += 1
+        for clave in claves:
+            self.local.invalidar(clave)
+        if self.compartido:
+            try:
+                await self.compartido.invalidar(*(self.prefijo + c for c in claves))
+            except Exception as e:
+                self.contadores["errores_compartido"] += 1
+                print(f"Error invalidando caché compartida: {e}")
+
+    async def limpiar(self):
+        self._generacion += 1
+        self.local.limpiar()
+        if self.compartido:
+            try:
+                await self.compartido.limpiar(self.prefijo)
+            except Exception as e:
+                self.contadores["errores_compartido"] += 1
+                print(f"Error vaciando caché compartida: {e}")
+
+    def iniciar_escucha(self, dsn: str, canal: str = CANAL_INVALIDACION):
+        """Escucha las invalidaciones de otras réplicas en segundo plano."""
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._escuchar(dsn, canal))
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    async def _escuchar(self, dsn: str, canal: str):
+        def al_notificar(conexion, pid, canal, payload):
+            self.contadores["notificaciones"] += 1
+            if payload == "*":
+                asyncio.create_task(self.limpiar())
+            else:
+                asyncio.create_task(self.invalidar(*payload.split(",")))
+
+        while True:
+            try:
+                self._conexion = await asyncpg.connect(dsn)
+                await self._conexion.add_listener(canal, al_notificar)
+                # Lo que cambió mientras no se escuchaba es desconocido
+                await self.limpiar()
+                perdida = asyncio.Event()
+                self._conexion.add_termination_listener(lambda c: perdida.set())
+                await perdida.wait()
+            except asyncio.CancelledError:
+                if self._conexion and not self._conexion.is_closed():
+                    await self._conexion.close()
+                raise
+            except Exception as e:
+                print(f"Error escuchando invalidaciones de caché: {e}")
+            await asyncio.sleep(1)
+
+    def estadisticas(self) -> dict:
+        return {
+            **self.local.estadisticas(),
+            **self.contadores,
+            "compartido": type(self.compartido).__name__ if self.compartido else None,
+        }
@@ -0,0 +1,87 @@
+"""Coalescencia de peticiones idénticas simultáneas (single-flight).
+
+La primera petición con una clave lanza la ejecución en una tarea propia; las
+que llegan con la misma clave mientras sigue en curso esperan esa misma tarea
+y reciben su resultado o su excepción. Nada se guarda al terminar: para eso
+están las cachés, que llaman al coalescedor solo en los fallos.
+
+Cada petición espera la tarea con ``asyncio.shield``: si un cliente se va,
+solo se cancela su espera. La tarea compartida se cancela únicamente cuando
+ya no la espera nadie, y en ese momento sale del mapa para que una petición
+nueva no se una a una ejecución que se está cancelando.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from common.metricas import registro
+
+peticiones = registro.contador(
+    "singleflight_requests_total", "Peticiones por rol: lider ejecuta, seguidor comparte", ("grupo", "rol")
+)
+resultados = registro.contador(
+    "singleflight_executions_total", "Ejecuciones compartidas por resultado", ("grupo", "resultado")
+)
+en_vuelo_gauge = registro.gauge(
+    "singleflight_inflight", "Claves con una ejecución en curso", ("grupo",)
+)
+
+
+class _Vuelo:
+    __slots__ = ("tarea", "esperando")
+
+    def __init__(self, tarea: asyncio.Task):
+        self.tarea = tarea
+        self.esperando = 0
+
+
+class Coalescedor:
+    def __init__(self, grupo: str):
+        self.grupo = grupo
+        self._vuelos: Dict[Hashable, _Vuelo] = {}
+        self.contadores = {"lideres": 0, "seguidores": 0, "ok": 0, "errores": 0, "cancelados": 0}
+        en_vuelo_gauge.fijar(lambda: len(self._vuelos), grupo)
+
+    async def ejecutar(self, clave: Hashable, funcion: Callable[[], Awaitable[Any]]) -> Any:
+        vuelo = self._vuelos.get(clave)
+        if vuelo is None:
+            vuelo = _Vuelo(asyncio.ensure_future(funcion()))
+            self._vuelos[clave] = vuelo
+            vuelo.tarea.add_done_callback(lambda tarea: self._terminar(clave, vuelo))
+            rol = "lider"
+        else:
+            rol = "seguidor"
+        self.contadores[rol + "es"] += 1
+        peticiones.inc(self.grupo, rol)
+
+        vuelo.esperando += 1
+        try:
+            return await asyncio.shield(vuelo.tarea)
+        finally:
+            vuelo.esperando -= 1
+            if not vuelo.esperando and not vuelo.tarea.done():
+                self._soltar(clave, vuelo)
+                vuelo.tarea.cancel()
+
+    def _soltar(self, clave: Hashable, vuelo: _Vuelo):
+        if self._vuelos.get(clave) is vuelo:
+            del self._vuelos[clave]
+
+    def _terminar(self, clave: Hashable, vuelo: _Vuelo):
+        self._soltar(clave, vuelo)
+        if vuelo.tarea.cancelled():
+            resultado = "cancelados"
+        elif vuelo.tarea.exception() is not None:
+            # exception() también la marca como recuperada si ya nadie espera
+            resultado = "errores"
+        else:
+            resultado = "ok"
+        self.contadores[resultado] += 1
+        resultados.inc(self.grupo, resultado)
+
+    def estadisticas(self) -> dict:
+        total = self.contadores["lideres"] + self.contadores["seguidores"]
+        return {
+            **self.contadores,
+            "en_vuelo": len(self._vuelos),
+            "ratio_coalescencia": round(self.contadores["seguidores"] / total, 4) if total else 0.0,
+        }
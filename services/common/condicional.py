@@ -0,0 +1,76 @@
+"""Peticiones condicionales: ``ETag``, ``Last-Modified`` y respuestas 304.
+
+El ``ETag`` es débil: identifica los datos, no los bytes exactos, así los
+``metadatos`` de frescura que cambian en cada petición quedan fuera del
+validador. Sin un validador explícito (una versión de datos) se deriva del
+contenido. ``Cache-Control: no-cache`` deja guardar la respuesta pero obliga a
+revalidarla; con autenticación activa además es ``private``, para que solo
+la guarden el navegador y el gateway (que separa su caché por token).
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from common.auth import AUTH_MODO
+from common.serializacion import RespuestaJSONRapida, codificar
+
+CACHE_CONTROL = "no-cache" if AUTH_MODO == "desactivado" else "private, no-cache"
+
+
+def etag_debil(*partes) -> str:
+    return 'W/"%s"' % hashlib.sha1(codificar(partes)).hexdigest()[:20]
+
+
+def fecha_http(fecha: datetime) -> str:
+    """Fechas ``TIMESTAMP`` de la base (sin zona, en UTC) en formato HTTP."""
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return format_datetime(fecha.astimezone(timezone.utc), usegmt=True)
+
+
+def _sin_debil(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def no_modificado(request: Request, etag: str, ultima_modificacion: Optional[datetime] = None) -> bool:
+    """``If-None-Match`` (comparación débil) y, solo en su ausencia,
+    ``If-Modified-Since`` con precisión de segundos."""
+    si_no_coincide = request.headers.get("if-none-match")
+    if si_no_coincide is not None:
+        etiquetas = [e.strip() for e in si_no_coincide.split(",")]
+        return "*" in etiquetas or _sin_debil(etag) in map(_sin_debil, etiquetas)
+    si_modificado = request.headers.get("if-modified-since")
+    if si_modificado and ultima_modificacion is not None:
+        try:
+            desde = parsedate_to_datetime(si_modificado)
+        except (TypeError, ValueError):
+            return False
+        # "-0000" y las fechas sin zona llegan sin tzinfo: HTTP las da en UTC
+        if desde.tzinfo is None:
+            desde = desde.replace(tzinfo=timezone.utc)
+        if ultima_modificacion.tzinfo is None:
+            ultima_modificacion = ultima_modificacion.replace(tzinfo=timezone.utc)
+        return ultima_modificacion.replace(microsecond=0) <= desde
+    return False
+
+
+def respuesta_condicional(
+    request: Request,
+    datos: dict,
+    extra: Optional[dict] = None,
+    etag: Optional[str] = None,
+    ultima_modificacion: Optional[datetime] = None,
+) -> Response:
+    """``datos`` (más ``extra``, que no entra en el validador) como JSON, o un
+    304 vacío si el cliente ya tiene esa versión."""
+    etag = etag or etag_debil(datos)
+    cabeceras = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if ultima_modificacion is not None:
+        cabeceras["Last-Modified"] = fecha_http(ultima_modificacion)
+    if no_modificado(request, etag, ultima_modificacion):
+        return Response(status_code=304, headers=cabeceras)
+    return RespuestaJSONRapida(codificar({**datos, **extra} if extra else datos), headers=cabeceras)
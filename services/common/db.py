@@ -0,0 +1,141 @@
+"""Pool de conexiones compartido por los servicios.
+
+``crear_pool()`` reemplaza el ``asyncpg.create_pool(DATABASE_URL, min_size=2,
+max_size=10)`` repetido en cada servicio: el tamaño, la espera máxima por una
+conexión y los timeouts salen de variables de entorno, las conexiones se
+abren al arrancar y cada una prepara las consultas calientes registradas con
+``consulta_preparada``: un SQL roto se avisa al abrir la conexión y no en la
+primera petición, y los tipos que usan quedan resueltos en la conexión, así
+esa petición no paga la introspección.
+
+Las sentencias preparadas de cada conexión viven en su caché de sentencias
+(por texto SQL): la primera ejecución hace el Parse y las siguientes solo
+Bind/Execute. Guardar los ``PreparedStatement`` por conexión no sirve con un
+pool: asyncpg los invalida cada vez que la conexión vuelve al pool, y
+prepararlos de nuevo en cada préstamo duplica el tiempo de una lectura
+(~590 µs frente a ~310 µs medidos en local). Para que el conjunto caliente
+sea fijo, las entradas de la caché no caducan y hay sitio para todas las
+registradas además de ``DB_CACHE_SENTENCIAS`` consultas dinámicas.
+
+Detrás de un pooler en modo transacción (PgBouncer, ``DB_PGBOUNCER=1``) las
+sentencias preparadas no sobreviven entre transacciones: se desactiva la
+caché de sentencias y no se prepara nada, y lo que necesita una sesión
+propia (LISTEN, advisory locks) usa ``conectar_directo()`` contra
+``DATABASE_URL_DIRECTA``.
+
+``DB_PRESUPUESTO`` es el total de conexiones del pool que puede abrir un
+servicio sumando todos sus procesos (``SERVICIO_REPLICAS`` contenedores por
+``UVICORN_WORKERS`` workers): cada proceso se queda con su parte, así escalar
+no multiplica las conexiones contra Postgres. Un contenedor no sabe cuántos
+hay: se escala con ``*_REPLICAS``, que fija a la vez ``deploy.replicas`` y
+``SERVICIO_REPLICAS``; ``docker compose up --scale`` solo cambia lo primero. Las conexiones directas
+(LISTEN, mantenimiento) van aparte, una o dos por proceso.
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+
+import asyncpg
+
+from common.metricas import DB_ESPERA_MAX, instrumentar_pool, registrar_conexion
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_URL_DIRECTA = os.getenv("DATABASE_URL_DIRECTA") or DATABASE_URL
+DB_PRESUPUESTO = int(os.getenv("DB_PRESUPUESTO", "0"))
+DB_PROCESOS = max(1, int(os.getenv("SERVICIO_REPLICAS", "1")) * int(os.getenv("UVICORN_WORKERS", "1")))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+if DB_PRESUPUESTO:
+    DB_POOL_MAX = min(DB_POOL_MAX, max(1, DB_PRESUPUESTO // DB_PROCESOS))
+DB_POOL_MIN = min(int(os.getenv("DB_POOL_MIN", "2")), DB_POOL_MAX)
+DB_PRECALENTAR = int(os.getenv("DB_PRECALENTAR", str(DB_POOL_MIN)))
+DB_INACTIVA_MAX = float(os.getenv("DB_INACTIVA_MAX", "300"))
+DB_COMANDO_TIMEOUT = float(os.getenv("DB_COMANDO_TIMEOUT", "0")) or None
+DB_CACHE_SENTENCIAS = int(os.getenv("DB_CACHE_SENTENCIAS", "100"))
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "").lower() in ("1", "true", "si")
+
+log = logging.getLogger(__name__)
+
+# nombre -> SQL de las consultas calientes
+CONSULTAS: Dict[str, str] = {}
+
+
+def consulta_preparada(nombre: str, sql: str) -> str:
+    """Registra una consulta caliente; cada conexión nueva la prepara."""
+    CONSULTAS[nombre] = sql
+    return nombre
+
+
+class _Sentencia:
+    """Ejecuta una consulta registrada con la sentencia preparada de la
+    conexión (en su caché); solo la primera ejecución hace el Parse."""
+
+    __slots__ = ("_conn", "_sql")
+
+    def __init__(self, conn, sql: str):
+        self._conn, self._sql = conn, sql
+
+    def fetch(self, *args):
+        return self._conn.fetch(self._sql, *args)
+
+    def fetchrow(self, *args):
+        return self._conn.fetchrow(self._sql, *args)
+
+    def fetchval(self, *args, column: int = 0):
+        return self._conn.fetchval(self._sql, *args, column=column)
+
+
+def sentencia(conn, nombre: str) -> _Sentencia:
+    return _Sentencia(conn, CONSULTAS[nombre])
+
+
+async def _iniciar_conexion(conn):
+    await registrar_conexion(conn)
+    if DB_PGBOUNCER or not DB_CACHE_SENTENCIAS:
+        return
+    for nombre, sql in CONSULTAS.items():
+        try:
+            await conn.prepare(sql)
+        except Exception as e:
+            # Una consulta rota no debe impedir abrir el pool
+            log.warning("No se pudo preparar la consulta %s: %s", nombre, e)
+
+
+async def crear_pool(
+    dsn: Optional[str] = None,
+    nombre: str = "principal",
+    min_size: int = DB_POOL_MIN,
+    max_size: int = DB_POOL_MAX,
+    aplicacion: Optional[str] = None,
+):
+    """Pool instrumentado y precalentado con la configuración del entorno."""
+    servidor = {"application_name": aplicacion} if aplicacion else {}
+    pool = await asyncpg.create_pool(
+        dsn or DATABASE_URL,
+        min_size=min_size,
+        max_size=max_size,
+        max_inactive_connection_lifetime=DB_INACTIVA_MAX,
+        command_timeout=DB_COMANDO_TIMEOUT,
+        statement_cache_size=0 if DB_PGBOUNCER else DB_CACHE_SENTENCIAS + len(CONSULTAS),
+        # Sin caducidad: las consultas calientes no se vuelven a preparar
+        max_cached_statement_lifetime=0,
+        server_settings=servidor,
+        init=_iniciar_conexion,
+    )
+    await precalentar(pool, min(DB_PRECALENTAR, max_size))
+    return instrumentar_pool(pool, nombre, DB_ESPERA_MAX)
+
+
+async def precalentar(pool, cantidad: int):
+    """Abre ``cantidad`` conexiones a la vez para no pagar la conexión (y la
+    preparación de sentencias) en las primeras peticiones."""
+    if cantidad <= 0:
+        return
+    conexiones = await asyncio.gather(*(pool.acquire() for _ in range(cantidad)))
+    for conn in conexiones:
+        await pool.release(conn)
+
+
+async def conectar_directo():
+    """Conexión propia, fuera del pooler, para LISTEN y advisory locks."""
+    return await asyncpg.connect(DATABASE_URL_DIRECTA)
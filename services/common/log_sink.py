@@ -0,0 +1,122 @@
+"""Sink asíncrono de logs de auditoría.
+
+Los servicios encolan las filas de ``logs`` en memoria y una tarea en segundo
+plano las escribe por lotes con ``COPY``, de modo que la latencia de las
+lecturas no depende de la velocidad con la que la tabla acepta escrituras.
+"""
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from common.metricas import log_sink_escritura
+
+COLUMNAS_LOG = ["tipo_operacion", "numero_documento", "usuario", "detalles", "fecha_transaccion"]
+_FIN = object()
+
+
+class LogSink:
+    def __init__(
+        self,
+        max_cola: int = int(os.getenv("LOG_SINK_MAX_COLA", "10000")),
+        tam_lote: int = int(os.getenv("LOG_SINK_LOTE", "500")),
+        intervalo: float = float(os.getenv("LOG_SINK_INTERVALO", "0.5")),
+        espera_max: float = float(os.getenv("LOG_SINK_ESPERA_MAX", "0.05")),
+    ):
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=max_cola)
+        self.tam_lote = tam_lote
+        self.intervalo = intervalo
+        self.espera_max = espera_max
+        self.pool = None
+        self._tarea: Optional[asyncio.Task] = None
+        self.contadores = {
+            "encolados": 0,
+            "escritos": 0,
+            "descartados": 0,
+            "esperas_backpressure": 0,
+            "lotes": 0,
+            "errores": 0,
+        }
+
+    def iniciar(self, pool):
+        """Arranca el flusher en segundo plano sobre el pool dado."""
+        self.pool = pool
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._flusher())
+
+    async def detener(self):
+        """Detiene el flusher y escribe lo que quede en la cola."""
+        if self._tarea:
+            # El centinela hace que el flusher vacíe la cola y termine
+            await self.cola.put(_FIN)
+            await self._tarea
+            self._tarea = None
+
+    async def registrar(
+        self,
+        tipo: str,
+        documento: Optional[str] = None,
+        detalles: Optional[dict] = None,
+        usuario: Optional[str] = None,
+    ) -> bool:
+        """Encola un registro. Si la cola está llena espera como máximo
+        ``espera_max`` segundos y después lo descarta."""
+        fila = (tipo, documento, usuario, json.dumps(detalles or {}, default=str), datetime.now())
+        try:
+            self.cola.put_nowait(fila)
+        except asyncio.QueueFull:
+            self.contadores["esperas_backpressure"] += 1
+            try:
+                await asyncio.wait_for(self.cola.put(fila), timeout=self.espera_max)
+            except asyncio.TimeoutError:
+                self.contadores["descartados"] += 1
+                return False
+        self.contadores["encolados"] += 1
+        return True
+
+    def estadisticas(self) -> dict:
+        return {**self.contadores, "pendientes": self.cola.qsize()}
+
+    async def _flusher(self):
+        loop = asyncio.get_running_loop()
+        fin = False
+        while not fin:
+            # Se escribe cuando el lote se llena o cuando vence el intervalo
+            filas = [await self.cola.get()]
+            limite = loop.time() + self.intervalo
+            while len(filas) < self.tam_lote:
+                if not self.cola.empty():
+                    filas.append(self.cola.get_nowait())
+                    continue
+                restante = limite - loop.time()
+                if filas[-1] is _FIN or restante <= 0:
+                    break
+                try:
+                    filas.append(await asyncio.wait_for(self.cola.get(), timeout=restante))
+                except asyncio.TimeoutError:
+                    break
+            if _FIN in filas:
+                fin = True
+                filas = [f for f in filas if f is not _FIN]
+                while not self.cola.empty():
+                    filas.append(self.cola.get_nowait())
+            for i in range(0, len(filas), self.tam_lote):
+                await self._escribir(filas[i:i + self.tam_lote])
+
+    async def _escribir(self, filas: list):
+        if not filas or not self.pool:
+            return
+        inicio = time.perf_counter()
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.copy_records_to_table("logs", records=filas, columns=COLUMNAS_LOG)
+            self.contadores["escritos"] += len(filas)
+            self.contadores["lotes"] += 1
+            log_sink_escritura.observar(time.perf_counter() - inicio, "ok")
+        except Exception as e:
+            log_sink_escritura.observar(time.perf_counter() - inicio, "error")
+            self.contadores["errores"] += 1
+            self.contadores["descartados"] += len(filas)
+            print(f"Error escribiendo lote de logs: {e}")
@@ -0,0 +1,273 @@
+"""Métricas en formato de exposición de Prometheus, sin dependencias externas.
+
+``instalar_metricas(app, servicio)`` añade un middleware ASGI que mide la
+latencia de cada petición por ruta y un endpoint ``/metrics``. Para la base
+de datos, ``instrumentar_pool`` mide la espera al pedir una conexión del pool
+y ``registrar_conexion`` (como ``init`` de ``create_pool``) el tiempo de cada
+consulta.
+"""
+import os
+import re
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from starlette.routing import Match
+
+DB_ESPERA_MAX = float(os.getenv("DB_ESPERA_MAX", "10"))
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _etiquetas(nombres: Tuple[str, ...], valores: Tuple[str, ...], extra: str = "") -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self._valores: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *valores: str, cantidad: float = 1):
+        self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def muestras(self) -> Iterable[str]:
+        for valores, total in self._valores.items():
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, valores)} {total}"
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (), buckets=BUCKETS_LATENCIA):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observar(self, valor: float, *valores: str):
+        serie = self._series.get(valores)
+        if serie is None:
+            serie = self._series[valores] = [[0] * len(self.buckets), 0.0, 0]
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                serie[0][i] += 1
+        serie[1] += valor
+        serie[2] += 1
+
+    def muestras(self) -> Iterable[str]:
+        for valores, (conteos, suma, total) in self._series.items():
+            for limite, conteo in zip(self.buckets, conteos):
+                etiquetas = _etiquetas(self.etiquetas, valores, 'le="%s"' % limite)
+                yield f"{self.nombre}_bucket{etiquetas} {conteo}"
+            etiquetas = _etiquetas(self.etiquetas, valores, 'le="+Inf"')
+            yield f"{self.nombre}_bucket{etiquetas} {total}"
+            yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {suma}"
+            yield f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {total}"
+
+
+class Gauge:
+    """Valor calculado en el momento del scrape a partir de una función."""
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self._fuentes: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def fijar(self, funcion: Callable[[], float], *valores: str):
+        self._fuentes[valores] = funcion
+
+    def muestras(self) -> Iterable[str]:
+        for valores, funcion in self._fuentes.items():
+            try:
+                yield f"{self.nombre}{_etiquetas(self.etiquetas, valores)} {float(funcion())}"
+            except Exception:
+                continue
+
+
+class Registro:
+    def __init__(self):
+        self._metricas: Dict[str, object] = {}
+
+    def _obtener(self, clase, nombre, ayuda, etiquetas, **kwargs):
+        if nombre not in self._metricas:
+            self._metricas[nombre] = clase(nombre, ayuda, tuple(etiquetas), **kwargs)
+        return self._metricas[nombre]
+
+    def contador(self, nombre: str, ayuda: str, etiquetas=()) -> Contador:
+        return self._obtener(Contador, nombre, ayuda, etiquetas)
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas=(), buckets=BUCKETS_LATENCIA) -> Histograma:
+        return self._obtener(Histograma, nombre, ayuda, etiquetas, buckets=buckets)
+
+    def gauge(self, nombre: str, ayuda: str, etiquetas=()) -> Gauge:
+        return self._obtener(Gauge, nombre, ayuda, etiquetas)
+
+    def exposicion(self) -> str:
+        lineas = []
+        for metrica in self._metricas.values():
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(metrica.muestras())
+        return "\n".join(lineas) + "\n"
+
+
+# Registro único por proceso
+registro = Registro()
+
+peticiones_duracion = registro.histograma(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta",
+    ("servicio", "metodo", "ruta", "estado")
+)
+pool_espera = registro.histograma(
+    "db_pool_acquire_seconds", "Espera para obtener una conexión del pool", ("pool",)
+)
+pool_timeouts = registro.contador(
+    "db_pool_acquire_timeouts_total", "Esperas de conexión que vencieron", ("pool",)
+)
+pool_conexiones = registro.gauge(
+    "db_pool_connections", "Conexiones del pool por estado", ("pool", "estado")
+)
+consultas_duracion = registro.histograma(
+    "db_query_duration_seconds", "Duración de las consultas SQL", ("consulta", "error")
+)
+llm_duracion = registro.histograma(
+    "llm_call_duration_seconds", "Duración de las llamadas al modelo de lenguaje", ("modelo", "resultado")
+)
+log_sink_escritura = registro.histograma(
+    "log_sink_flush_seconds", "Duración de la escritura de cada lote de logs", ("resultado",)
+)
+
+
+def plantilla_ruta(app, scope) -> str:
+    """Ruta declarada (``/personas/{numero_documento}``) para no disparar la
+    cardinalidad con valores concretos."""
+    for ruta in app.router.routes:
+        coincidencia, _ = ruta.matches(scope)
+        if coincidencia == Match.FULL:
+            return getattr(ruta, "path", scope["path"])
+    return "sin_ruta"
+
+
+class MiddlewareMetricas:
+    def __init__(self, app, servicio: str):
+        self.app = app
+        self.servicio = servicio
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        estado = {"codigo": 500}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado["codigo"] = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            # Incluye el cuerpo completo, también en respuestas en streaming
+            ruta = plantilla_ruta(scope["app"], scope) if "app" in scope else scope["path"]
+            peticiones_duracion.observar(
+                time.perf_counter() - inicio,
+                self.servicio, scope["method"], ruta, str(estado["codigo"])
+            )
+
+
+def instalar_metricas(app: FastAPI, servicio: str):
+    """Añade el middleware de latencias y el endpoint ``/metrics``."""
+    app.add_middleware(MiddlewareMetricas, servicio=servicio)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metricas():
+        return PlainTextResponse(registro.exposicion(), media_type="text/plain; version=0.0.4")
+
+
+_ESPACIOS = re.compile(r"\s+")
+
+
+def _resumen_consulta(query: str) -> str:
+    """Inicio de la consulta más una huella del texto completo, para que las
+    variantes con el mismo prefijo no se mezclen en una sola serie."""
+    texto = _ESPACIOS.sub(" ", query).strip()
+    return f"{texto[:80]} #{zlib.crc32(texto.encode()):08x}"
+
+
+def _registrar_consulta(registro_consulta):
+    consultas_duracion.observar(
+        registro_consulta.elapsed,
+        _resumen_consulta(registro_consulta.query),
+        "1" if registro_consulta.exception else "0",
+    )
+
+
+async def registrar_conexion(conn):
+    """``init`` para ``create_pool``: mide cada consulta de la conexión."""
+    conn.add_query_logger(_registrar_consulta)
+
+
+class PoolAgotado(TimeoutError):
+    """Venció la espera por una conexión libre del pool."""
+
+
+class _Adquisicion:
+    def __init__(self, pool, nombre: str, timeout):
+        self._pool, self._nombre, self._timeout = pool, nombre, timeout
+        self._conn = None
+
+    async def _adquirir(self):
+        inicio = time.perf_counter()
+        try:
+            conn = await self._pool.acquire(timeout=self._timeout)
+        except TimeoutError:
+            pool_timeouts.inc(self._nombre)
+            raise PoolAgotado(f"Sin conexiones libres en el pool {self._nombre}")
+        finally:
+            pool_espera.observar(time.perf_counter() - inicio, self._nombre)
+        return conn
+
+    def __await__(self):
+        return self._adquirir().__await__()
+
+    async def __aenter__(self):
+        self._conn = await self._adquirir()
+        return self._conn
+
+    async def __aexit__(self, *exc):
+        await self._pool.release(self._conn)
+
+
+class PoolInstrumentado:
+    """Envoltorio de ``asyncpg.Pool`` que mide la espera de ``acquire`` y la
+    acota a ``espera_max`` segundos (``PoolAgotado`` al vencer)."""
+
+    def __init__(self, pool, nombre: str = "principal", espera_max: float = DB_ESPERA_MAX):
+        self._pool = pool
+        self.nombre = nombre
+        self.espera_max = espera_max
+        pool_conexiones.fijar(lambda: pool.get_size() - pool.get_idle_size(), nombre, "en_uso")
+        pool_conexiones.fijar(pool.get_idle_size, nombre, "libres")
+        pool_conexiones.fijar(pool.get_max_size, nombre, "maximo")
+
+    def acquire(self, *, timeout=None):
+        return _Adquisicion(self._pool, self.nombre, self.espera_max if timeout is None else timeout)
+
+    def __getattr__(self, nombre):
+        return getattr(self._pool, nombre)
+
+
+def instrumentar_pool(pool, nombre: str = "principal", espera_max: float = DB_ESPERA_MAX) -> PoolInstrumentado:
+    return PoolInstrumentado(pool, nombre, espera_max)
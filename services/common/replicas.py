@@ -0,0 +1,247 @@
+"""Enrutado de lecturas a réplicas de PostgreSQL.
+
+Con ``DATABASE_URL_LECTURA`` (una o varias DSN separadas por comas) las
+consultas de solo lectura se envían a las réplicas; las escrituras y la
+tabla de logs siguen en el primario. Una tarea sondea cada réplica cada
+``REPLICA_SONDEO`` segundos y mide su atraso frente al primario; una réplica
+caída o con más de ``REPLICA_ATRASO_MAX`` segundos de atraso deja de recibir
+lecturas hasta que se recupere, y sin réplicas sanas se lee del primario.
+
+Lectura de lo escrito: personas devuelve en ``X-Token-Consistencia`` la
+posición del WAL tras cada escritura. Quien la reenvía en la misma cabecera
+solo lee de réplicas que ya aplicaron esa posición (si ninguna, del primario).
+
+Para probarlo en local basta una réplica en streaming de otra instancia::
+
+    pg_basebackup -D /tmp/replica -R -h /tmp -U admin
+    postgres -D /tmp/replica -p 5433 -k /tmp
+    DATABASE_URL_LECTURA=postgresql://admin@/personas_db?host=/tmp&port=5433
+"""
+import asyncio
+import contextvars
+import itertools
+import os
+from typing import List, Optional
+
+from common.db import DB_POOL_MAX, crear_pool
+from common.metricas import registro
+
+DATABASE_URL_LECTURA = [d.strip() for d in os.getenv("DATABASE_URL_LECTURA", "").split(",") if d.strip()]
+REPLICA_ATRASO_MAX = float(os.getenv("REPLICA_ATRASO_MAX", "5"))
+REPLICA_SONDEO = float(os.getenv("REPLICA_SONDEO", "2"))
+REPLICA_POOL_MAX = int(os.getenv("REPLICA_POOL_MAX", str(DB_POOL_MAX)))
+CABECERA_CONSISTENCIA = "X-Token-Consistencia"
+
+_token_consistencia: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar(
+    "token_consistencia", default=None
+)
+
+replica_atraso = registro.gauge(
+    "db_replica_lag_seconds", "Atraso de replicación medido en el último sondeo", ("replica",)
+)
+lecturas = registro.contador(
+    "db_read_routing_total", "Lecturas enrutadas por destino", ("destino", "motivo")
+)
+
+
+def lsn_a_entero(lsn: str) -> int:
+    """``'16/B374D848'`` -> posición en bytes."""
+    alto, _, bajo = lsn.partition("/")
+    return (int(alto, 16) << 32) + int(bajo, 16)
+
+
+def entero_a_lsn(posicion: int) -> str:
+    return f"{posicion >> 32:X}/{posicion & 0xFFFFFFFF:X}"
+
+
+def token_actual() -> Optional[int]:
+    return _token_consistencia.get()
+
+
+async def posicion_wal(pool) -> str:
+    """Token de consistencia: posición actual del WAL del primario. Tras un
+    commit es mayor o igual que la del registro de ese commit."""
+    async with pool.acquire() as conn:
+        return await conn.fetchval("SELECT pg_current_wal_lsn()::text")
+
+
+class _Replica:
+    def __init__(self, indice: int, dsn: str):
+        self.nombre = f"replica{indice}"
+        self.dsn = dsn
+        self.pool = None
+        self.sana = False
+        self.lsn = 0
+        self.atraso = None
+        self.error: Optional[str] = None
+        # Sin medición la muestra se omite
+        replica_atraso.fijar(lambda: self.atraso, self.nombre)
+
+    def estado(self) -> dict:
+        return {
+            "sana": self.sana,
+            "atraso_segundos": None if self.atraso is None else round(self.atraso, 3),
+            "lsn": entero_a_lsn(self.lsn) if self.lsn else None,
+            "error": self.error,
+        }
+
+
+class EnrutadorLecturas:
+    """Elige el pool de cada lectura: una réplica sana y al día con el token
+    de la petición, o el primario."""
+
+    def __init__(self, primario, dsns: List[str] = DATABASE_URL_LECTURA,
+                 atraso_max: float = REPLICA_ATRASO_MAX, sondeo: float = REPLICA_SONDEO):
+        self.primario = primario
+        self.replicas = [_Replica(i, dsn) for i, dsn in enumerate(dsns)]
+        self.atraso_max = atraso_max
+        self.sondeo = sondeo
+        self._turno = itertools.count()
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def iniciar(self):
+        if self.replicas and self._tarea is None:
+            await self.sondear()
+            self._tarea = asyncio.create_task(self._sondear_periodicamente())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        for replica in self.replicas:
+            if replica.pool:
+                await replica.pool.close()
+                replica.pool = None
+
+    async def _sondear_periodicamente(self):
+        while True:
+            await asyncio.sleep(self.sondeo)
+            try:
+                await self.sondear()
+            except Exception as e:
+                print(f"Error sondeando réplicas: {e}")
+
+    async def sondear(self):
+        """Mide el atraso de cada réplica respecto al WAL del primario."""
+        try:
+            lsn_primario = lsn_a_entero(await posicion_wal(self.primario))
+        except Exception as e:
+            # Sin primario no se puede medir el atraso en bytes; se usa solo el tiempo
+            print(f"No se pudo leer la posición del primario: {e}")
+            lsn_primario = None
+        await asyncio.gather(*(self._sondear_replica(r, lsn_primario) for r in self.replicas))
+
+    async def _sondear_replica(self, replica: _Replica, lsn_primario: Optional[int]):
+        try:
+            if replica.pool is None:
+                replica.pool = await crear_pool(replica.dsn, nombre=replica.nombre, max_size=REPLICA_POOL_MAX)
+            async with replica.pool.acquire(timeout=self.sondeo) as conn:
+                fila = await conn.fetchrow("""
+                    SELECT pg_is_in_recovery() AS en_recuperacion,
+                           pg_last_wal_replay_lsn()::text AS lsn,
+                           EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) AS desde_ultima
+                """)
+        except Exception as e:
+            replica.sana, replica.atraso, replica.error = False, None, str(e)
+            return
+
+        if not fila["en_recuperacion"] or fila["lsn"] is None:
+            replica.sana, replica.atraso, replica.error = False, None, "No es una réplica en recuperación"
+            return
+        replica.lsn = lsn_a_entero(fila["lsn"])
+        if lsn_primario is not None and replica.lsn >= lsn_primario:
+            # Sin escrituras pendientes el tiempo desde la última no es atraso
+            replica.atraso = 0.0
+        else:
+            replica.atraso = float(fila["desde_ultima"] or 0.0)
+        replica.sana = replica.atraso <= self.atraso_max
+        replica.error = None if replica.sana else f"Atraso de {replica.atraso:.1f}s"
+
+    def pool(self, token: Optional[int] = None):
+        """Pool para una lectura; ``token`` por defecto es el de la petición."""
+        if token is None:
+            token = token_actual()
+        candidatas = [r for r in self.replicas if r.sana and r.pool is not None]
+        if not candidatas:
+            if self.replicas:
+                lecturas.inc("primario", "sin_replicas")
+            return self.primario
+        if token is not None:
+            candidatas = [r for r in candidatas if r.lsn >= token]
+            if not candidatas:
+                lecturas.inc("primario", "consistencia")
+                return self.primario
+        replica = candidatas[next(self._turno) % len(candidatas)]
+        lecturas.inc(replica.nombre, "replica")
+        return replica.pool
+
+    def estadisticas(self) -> dict:
+        return {r.nombre: r.estado() for r in self.replicas}
+
+
+class MiddlewareConsistencia:
+    """Deja el token de ``X-Token-Consistencia`` disponible para ``pool()``."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        valor = dict(scope["headers"]).get(CABECERA_CONSISTENCIA.lower().encode())
+        token = None
+        if valor:
+            try:
+                token = lsn_a_entero(valor.decode("latin-1").strip())
+            except ValueError:
+                # Un token mal formado no debe romper la lectura: va al primario
+                token = 1 << 64
+        marca = _token_consistencia.set(token)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _token_consistencia.reset(marca)
+
+
+class MiddlewareTokenEscritura:
+    """Añade ``X-Token-Consistencia`` a las respuestas de escrituras exitosas."""
+
+    def __init__(self, app, obtener_pool):
+        self.app = app
+        self.obtener_pool = obtener_pool
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            await self.app(scope, receive, send)
+            return
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start" and mensaje["status"] < 400:
+                pool = self.obtener_pool()
+                if pool is not None:
+                    try:
+                        token = await posicion_wal(pool)
+                        mensaje["headers"] = list(mensaje.get("headers", [])) + [
+                            (CABECERA_CONSISTENCIA.lower().encode(), token.encode())
+                        ]
+                    except Exception as e:
+                        print(f"No se pudo obtener el token de consistencia: {e}")
+            await send(mensaje)
+
+        await self.app(scope, receive, enviar)
+
+
+def instalar_replicas(app, primario=None) -> None:
+    """Servicios de lectura: lee el token de las peticiones. Con ``primario``
+    (una función que devuelve el pool) el servicio es el que escribe y emite
+    el token tras cada escritura, solo si hay réplicas configuradas."""
+    if primario is not None:
+        if DATABASE_URL_LECTURA:
+            app.add_middleware(MiddlewareTokenEscritura, obtener_pool=primario)
+        return
+    app.add_middleware(MiddlewareConsistencia)
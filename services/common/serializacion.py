@@ -0,0 +1,72 @@
+"""Serialización directa de filas de asyncpg a JSON.
+
+Camino rápido para listados grandes: las filas se codifican a bytes sin crear
+modelos de Pydantic ni revalidarlas (vienen de la base de datos). Usa
+``orjson`` si está instalado y ``json`` de la biblioteca estándar si no.
+``columnas_proyectadas`` interpreta ``?fields=`` para pedir solo algunas
+columnas.
+"""
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable, List, Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # dependencia opcional
+    orjson = None
+
+
+def a_json(valor):
+    """Serializador por defecto para tipos que devuelve asyncpg."""
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (bytes, memoryview)):
+        return base64.b64encode(valor).decode()
+    return str(valor)
+
+
+def codificar(valor) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(valor, default=a_json, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(valor, default=a_json, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def codificar_filas(filas: Iterable) -> bytes:
+    """Lista de ``Record`` a un arreglo JSON."""
+    return codificar([dict(f) for f in filas])
+
+
+class RespuestaJSONRapida(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return content if isinstance(content, bytes) else codificar(content)
+
+
+def columnas_proyectadas(
+    campos: Optional[str],
+    disponibles: Sequence[str],
+    por_defecto: Sequence[str],
+    obligatorias: Sequence[str] = ("id",),
+) -> List[str]:
+    """Columnas pedidas en ``campos`` (separadas por comas), validadas contra
+    ``disponibles``. Las ``obligatorias`` se añaden siempre (``id`` es el
+    cursor de la paginación)."""
+    if not campos:
+        return list(por_defecto)
+    pedidas = [c.strip() for c in campos.split(",") if c.strip()]
+    desconocidas = [c for c in pedidas if c not in disponibles]
+    if desconocidas:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos desconocidos: {', '.join(desconocidas)}. Disponibles: {', '.join(disponibles)}"
+        )
+    columnas = [c for c in obligatorias if c not in pedidas] + pedidas
+    return list(dict.fromkeys(columnas))
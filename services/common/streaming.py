@@ -0,0 +1,73 @@
+"""Exportación en streaming (NDJSON o CSV) desde un cursor de servidor de asyncpg.
+
+La conexión se mantiene durante toda la respuesta y las filas se leen en
+bloques de ``prefetch``, así la memoria se mantiene plana aunque se exporten
+cientos de miles de registros.
+"""
+import csv
+import io
+
+from fastapi.responses import StreamingResponse
+
+from common.serializacion import a_json, codificar
+
+PREFETCH = 500
+
+
+async def _bloques(pool, query: str, params: list, prefetch: int):
+    async with pool.acquire() as conn:
+        # Los cursores de servidor solo existen dentro de una transacción
+        async with conn.transaction():
+            bloque = []
+            async for fila in conn.cursor(query, *params, prefetch=prefetch):
+                bloque.append(fila)
+                if len(bloque) >= prefetch:
+                    yield bloque
+                    bloque = []
+            if bloque:
+                yield bloque
+
+
+async def filas_ndjson(pool, query: str, params: list, prefetch: int = PREFETCH):
+    async for bloque in _bloques(pool, query, params, prefetch):
+        yield b"\n".join(codificar(dict(fila)) for fila in bloque) + b"\n"
+
+
+def _celda(valor):
+    """Valor de una columna como texto CSV; JSON y fechas en su forma textual."""
+    if valor is None:
+        return ""
+    if isinstance(valor, (dict, list)):
+        return codificar(valor).decode()
+    if isinstance(valor, (str, int, float, bool)):
+        return valor
+    return a_json(valor)
+
+
+async def filas_csv(pool, query: str, params: list, prefetch: int = PREFETCH):
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    encabezado = False
+    async for bloque in _bloques(pool, query, params, prefetch):
+        if not encabezado:
+            escritor.writerow(bloque[0].keys())
+            encabezado = True
+        escritor.writerows([_celda(v) for v in fila.values()] for fila in bloque)
+        yield salida.getvalue().encode()
+        salida.seek(0)
+        salida.truncate()
+
+
+def respuesta_ndjson(pool, query: str, params: list, prefetch: int = PREFETCH) -> StreamingResponse:
+    return StreamingResponse(
+        filas_ndjson(pool, query, params, prefetch),
+        media_type="application/x-ndjson"
+    )
+
+
+def respuesta_csv(pool, query: str, params: list, nombre_archivo: str, prefetch: int = PREFETCH) -> StreamingResponse:
+    return StreamingResponse(
+        filas_csv(pool, query, params, prefetch),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{nombre_archivo}"'}
+    )
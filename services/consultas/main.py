@@ -1,13 +1,38 @@
  
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, List
-from datetime import date, datetime
+from typing import Optional, List, Literal
+from datetime import datetime
 import asyncpg
 import os
-import json
+import re
+from common.cache import CacheTTL
+from common.cache_personas import CacheLectura, crear_cache_compartido
+from common.log_sink import LogSink
+from common.admision import Limite, instalar_admision
+from common.agregados import TRAMO_ANIOS_DEFECTO, calcular_agregados, interpretar
+from common.auth import instalar_auth
+from common.coalescencia import Coalescedor
+from common.condicional import CACHE_CONTROL, etag_debil, no_modificado, respuesta_condicional
+from common.db import DATABASE_URL_DIRECTA, consulta_preparada, crear_pool, sentencia
+from common.metricas import instalar_metricas
+from common.replicas import EnrutadorLecturas, instalar_replicas, token_actual
+from common.serializacion import RespuestaJSONRapida, codificar, columnas_proyectadas
+from common.streaming import respuesta_ndjson
 
 app = FastAPI(title="Consultas Service")
+# Límites por cliente y ruta (sobrescribibles con LIMITES_RUTAS); dentro de
+# la autenticación para identificar al cliente por su token
+admision = instalar_admision(app, "consultas", {
+    "GET /consultar": Limite(tasa=20, rafaga=40, concurrencia=8),
+    "GET /buscar": Limite(tasa=10, rafaga=20, concurrencia=4),
+    "GET /autocompletar": Limite(tasa=30, rafaga=60, concurrencia=8),
+    "GET /agregados": Limite(tasa=10, rafaga=20, concurrencia=4),
+})
+# Antes de CORS: las respuestas 401 también llevan las cabeceras CORS
+verificador = instalar_auth(app)
+# Token de consistencia de la petición para elegir réplica
+instalar_replicas(app)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,36 +40,135 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Siguiente-Cursor"],
 )
+instalar_metricas(app, "consultas")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 db_pool = None
+# Lecturas a réplicas (DATABASE_URL_LECTURA) con vuelta al primario
+lectura = None
+log_sink = LogSink()
+cache_documentos = CacheLectura("consulta_documento", compartido=crear_cache_compartido())
+# Peticiones idénticas simultáneas comparten una sola consulta
+coalescedor = Coalescedor("consultas")
+cache_estadisticas = CacheTTL(max_entradas=1, ttl=float(os.getenv("ESTADISTICAS_TTL", "5")))
+# Agregados por (consulta, versión de los datos): una escritura cambia la
+# versión, así que el TTL solo acota la memoria
+cache_agregados = CacheTTL(
+    max_entradas=int(os.getenv("AGREGADOS_CACHE_MAX", "256")),
+    ttl=float(os.getenv("AGREGADOS_TTL", "300"))
+)
+
+# Columnas que se devuelven en consultas (la foto la sirve el servicio de personas)
+CAMPOS_LISTADO = ("id", "tipo_documento", "numero_documento", "primer_nombre", "segundo_nombre",
+                  "apellidos", "fecha_nacimiento", "genero", "correo_electronico", "celular",
+                  "created_at", "updated_at")
+COLUMNAS_PERSONA = ", ".join(CAMPOS_LISTADO)
+LIMITE_PAGINA = 100
+LIMITE_PAGINA_MAX = 1000
+LIMITE_BUSQUEDA_MAX = 100
+
+# Consultas calientes, preparadas en cada conexión del pool; las de filtros
+# combinables usan la caché de sentencias de asyncpg
+PERSONA_POR_DOCUMENTO = consulta_preparada(
+    "persona_por_documento",
+    f"SELECT {COLUMNAS_PERSONA} FROM personas WHERE numero_documento = $1"
+)
+BUSQUEDA_NOMBRE = consulta_preparada("busqueda_nombre", f"""
+    SELECT {COLUMNAS_PERSONA},
+           word_similarity(normalizar_nombre($1), nombre_busqueda) AS relevancia
+    FROM personas
+    WHERE normalizar_nombre($1) <% nombre_busqueda
+    ORDER BY relevancia DESC, id
+    LIMIT $2
+""")
+AUTOCOMPLETAR = consulta_preparada("autocompletar", """
+    SELECT numero_documento,
+           concat_ws(' ', primer_nombre, segundo_nombre, apellidos) AS nombre
+    FROM personas
+    WHERE nombre_busqueda ~ ('(^| )' || normalizar_nombre($1))
+    ORDER BY nombre_busqueda
+    LIMIT $2
+""")
+VERSION_DATOS = consulta_preparada(
+    "version_datos", "SELECT version FROM version_datos WHERE tabla = 'personas'"
+)
+ESTADISTICAS_GENERO = consulta_preparada(
+    "estadisticas_genero",
+    "SELECT genero, cantidad FROM estadisticas_personas WHERE cantidad > 0 ORDER BY genero"
+)
+# Promedio de años cumplidos, como edad_promedio de /agregados
+EDAD_PROMEDIO = consulta_preparada("edad_promedio", """
+    SELECT (EXTRACT(YEAR FROM CURRENT_DATE) * SUM(cantidad) - SUM(suma_anio)
+            - COALESCE(SUM(cantidad) FILTER (WHERE cumpleanos > to_char(CURRENT_DATE, 'MMDD')::int), 0)
+           )::float8 / NULLIF(SUM(cantidad), 0)
+    FROM estadisticas_cumpleanos
+""")
+
+def escapar_regex(texto: str) -> str:
+    """Escapa los metacaracteres de expresiones regulares de PostgreSQL."""
+    return re.sub(r"([\\^$.|?*+()\[\]{}])", r"\\\1", texto)
+
+def escapar_like(texto: str) -> str:
+    """Escapa los comodines de LIKE para buscar el texto literal."""
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
 
 @app.on_event("startup")
 async def startup():
-    global db_pool
+    global db_pool, lectura
     print(f"Conectando a: {DATABASE_URL}")
-    db_pool = await asyncpg.create_pool(DATABASE_URL, min_size=2, max_size=10)
+    db_pool = await crear_pool(aplicacion="consultas")
+    lectura = EnrutadorLecturas(db_pool)
+    await lectura.iniciar()
+    log_sink.iniciar(db_pool)
+    # LISTEN necesita una sesión propia, fuera del pooler
+    cache_documentos.iniciar_escucha(DATABASE_URL_DIRECTA)
 
 @app.on_event("shutdown")
 async def shutdown():
+    if verificador:
+        await verificador.detener()
+    await cache_documentos.detener()
+    await log_sink.detener()
+    if lectura:
+        await lectura.detener()
     if db_pool:
         await db_pool.close()
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "consultas"}
+    return {
+        "status": "healthy",
+        "service": "consultas",
+        "cache": cache_documentos.estadisticas(),
+        "cache_agregados": cache_agregados.estadisticas(),
+        "log_sink": log_sink.estadisticas(),
+        "admision": admision.estadisticas(),
+        "coalescencia": coalescedor.estadisticas(),
+        "replicas": lectura.estadisticas() if lectura else {}
+    }
 
 @app.get("/consultar")
 async def consultar_personas(
+    response: Response,
     numero_documento: Optional[str] = Query(None),
     tipo_documento: Optional[str] = Query(None),
-    nombre: Optional[str] = Query(None)
+    nombre: Optional[str] = Query(None),
+    cursor: Optional[int] = Query(None, description="id del último registro de la página anterior"),
+    limite: Optional[int] = Query(None, ge=1),
+    formato: Literal["json", "ndjson"] = Query("json"),
+    campos: Optional[str] = Query(None, alias="fields", description="Columnas separadas por comas"),
+    rapido: bool = Query(False, description="Codifica las filas directamente, sin conversión adicional")
 ):
+    """Filtra personas con paginación keyset sobre ``id``. En formato ``ndjson``
+    el resultado completo se envía en streaming desde un cursor de servidor.
+    Con ``fields`` se devuelven solo esas columnas."""
     if not db_pool:
         raise HTTPException(status_code=500, detail="Database connection not available")
     
-    query = "SELECT * FROM personas WHERE 1=1"
+    columnas = ", ".join(columnas_proyectadas(campos, CAMPOS_LISTADO, CAMPOS_LISTADO))
+    query = f"SELECT {columnas} FROM personas WHERE 1=1"
     params = []
     param_count = 0
     
@@ -59,41 +183,155 @@ async def consultar_personas(
         params.append(tipo_documento)
     
     if nombre:
+        # Usa el índice de trigramas sobre el nombre normalizado
         param_count += 1
-        query += f" AND (primer_nombre ILIKE ${param_count} OR apellidos ILIKE ${param_count})"
-        params.append(f"%{nombre}%")
-    
-    async with db_pool.acquire() as conn:
-        results = await conn.fetch(query, *params)
-        
-        # Registrar consulta en log
-        await conn.execute(
-            """INSERT INTO logs (tipo_operacion, detalles) 
-               VALUES ($1, $2::jsonb)""",
-            "CONSULTA",
-            json.dumps({"filtros": {"documento": numero_documento, "tipo": tipo_documento, "nombre": nombre}})
+        query += f" AND nombre_busqueda LIKE '%' || normalizar_nombre(${param_count}) || '%'"
+        params.append(escapar_like(nombre))
+    
+    if cursor is not None:
+        param_count += 1
+        query += f" AND id > ${param_count}"
+        params.append(cursor)
+    
+    query += " ORDER BY id"
+    if formato == "json":
+        limite = min(limite or LIMITE_PAGINA, LIMITE_PAGINA_MAX)
+    if limite:
+        param_count += 1
+        query += f" LIMIT ${param_count}"
+        params.append(limite)
+    
+    # Registrar consulta en log (asíncrono, por lotes)
+    await log_sink.registrar(
+        "CONSULTA",
+        detalles={"filtros": {"documento": numero_documento, "tipo": tipo_documento, "nombre": nombre}}
+    )
+    
+    if formato == "ndjson":
+        return respuesta_ndjson(lectura.pool(), query, params)
+    
+    async def cargar():
+        async with lectura.pool().acquire() as conn:
+            return [dict(r) for r in await conn.fetch(query, *params)]
+    
+    async def cargar_documento():
+        # Lo que entra en la caché se lee del primario: una réplica atrasada
+        # guardaría un valor que la invalidación por NOTIFY ya descartó
+        async with db_pool.acquire() as conn:
+            return [dict(r) for r in await sentencia(conn, PERSONA_POR_DOCUMENTO).fetch(numero_documento)]
+    
+    # La búsqueda exacta por documento es la más frecuente: pasa por la caché
+    if numero_documento and not (tipo_documento or nombre or cursor is not None or campos):
+        # Tras una invalidación no se comparte una carga anterior a ella
+        clave = ("documento", numero_documento, cache_documentos.generacion)
+        results = await cache_documentos.obtener(
+            numero_documento, lambda: coalescedor.ejecutar(clave, cargar_documento)
         )
-        
+    else:
+        # El token de consistencia decide de qué pool se lee: va en la clave
+        results = await coalescedor.ejecutar(("consultar", query, tuple(params), token_actual()), cargar)
+    
+    siguiente = {"X-Siguiente-Cursor": str(results[-1]["id"])} if len(results) == limite else {}
+    if campos or rapido:
+        return RespuestaJSONRapida(codificar(results), headers=siguiente)
+    response.headers.update(siguiente)
+    return results
+
+@app.get("/buscar")
+async def buscar_por_nombre(
+    q: str = Query(..., min_length=3),
+    limite: int = Query(20, ge=1, le=LIMITE_BUSQUEDA_MAX)
+):
+    """Búsqueda por nombre ordenada por similitud (pg_trgm), insensible a tildes."""
+    if not db_pool:
+        raise HTTPException(status_code=500, detail="Database connection not available")
+    
+    async with lectura.pool().acquire() as conn:
+        results = await sentencia(conn, BUSQUEDA_NOMBRE).fetch(q, limite)
+    
+    await log_sink.registrar("CONSULTA", detalles={"busqueda": q})
+    return [dict(r) for r in results]
+
+@app.get("/autocompletar")
+async def autocompletar_nombre(
+    prefijo: str = Query(..., min_length=2),
+    limite: int = Query(10, ge=1, le=LIMITE_BUSQUEDA_MAX)
+):
+    """Sugerencias de personas cuyo nombre o apellido empieza por el prefijo."""
+    if not db_pool:
+        raise HTTPException(status_code=500, detail="Database connection not available")
+    
+    async with lectura.pool().acquire() as conn:
+        results = await sentencia(conn, AUTOCOMPLETAR).fetch(escapar_regex(prefijo), limite)
         return [dict(r) for r in results]
 
+async def calcular_estadisticas() -> dict:
+    async with lectura.pool().acquire() as conn:
+        # Contadores mantenidos por triggers: una fila por género
+        por_genero = await sentencia(conn, ESTADISTICAS_GENERO).fetch()
+        edad_promedio = await sentencia(conn, EDAD_PROMEDIO).fetchval()
+    
+    return {
+        "total_personas": sum(r["cantidad"] for r in por_genero),
+        "distribucion_genero": [{"genero": r["genero"], "cantidad": r["cantidad"]} for r in por_genero],
+        "edad_promedio": round(edad_promedio or 0, 2)
+    }
+
 @app.get("/estadisticas")
-async def obtener_estadisticas():
+async def obtener_estadisticas(request: Request):
     if not db_pool:
         raise HTTPException(status_code=500, detail="Database connection not available")
     
-    async with db_pool.acquire() as conn:
-        total = await conn.fetchval("SELECT COUNT(*) FROM personas")
-        por_genero = await conn.fetch(
-            "SELECT genero, COUNT(*) as cantidad FROM personas GROUP BY genero"
-        )
-        edad_promedio = await conn.fetchval("""
-            SELECT AVG(EXTRACT(YEAR FROM age(fecha_nacimiento))) 
-            FROM personas
-        """)
-        
-        return {
-            "total_personas": total,
-            "distribucion_genero": [dict(r) for r in por_genero],
-            "edad_promedio": float(edad_promedio) if edad_promedio else 0
-        }
- 
\ No newline at end of file
+    # El ETag sale de los datos; los metadatos de frescura no cuentan
+    estadisticas, metadatos = await cache_estadisticas.obtener_o_calcular(
+        "estadisticas", lambda: coalescedor.ejecutar("estadisticas", calcular_estadisticas)
+    )
+    return respuesta_condicional(request, estadisticas, {"metadatos": metadatos})
+
+@app.get("/agregados")
+async def obtener_agregados(
+    request: Request,
+    agrupar: Optional[str] = Query(None, description="genero, tipo_documento, anio_nacimiento, mes_creacion"),
+    metricas: Optional[str] = Query(None, description="cantidad, edad_min, edad_max, edad_promedio"),
+    genero: Optional[str] = Query(None),
+    tipo_documento: Optional[str] = Query(None),
+    tramo_anios: int = Query(TRAMO_ANIOS_DEFECTO, ge=1, le=100, description="Ancho de los tramos de año de nacimiento"),
+    total: bool = Query(False, description="Añade la fila del total general")
+):
+    """Conteos y edades agrupados, calculados con una sola consulta en la base."""
+    if not db_pool:
+        raise HTTPException(status_code=500, detail="Database connection not available")
+    try:
+        dimensiones, metricas_pedidas = interpretar(agrupar, metricas)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    condiciones, params = [], []
+    for campo, valor in (("genero", genero), ("tipo_documento", tipo_documento)):
+        if valor:
+            params.append(valor)
+            condiciones.append(f"{campo} = ${len(params)}")
+    where = " WHERE " + " AND ".join(condiciones) if condiciones else ""
+    
+    # Versión y agregados del mismo pool: el resultado cacheado corresponde
+    # a la versión de su clave aunque se lea de una réplica
+    pool = lectura.pool()
+    async with pool.acquire() as conn:
+        version = await sentencia(conn, VERSION_DATOS).fetchval()
+    
+    async def calcular():
+        async with pool.acquire() as conn:
+            return await calcular_agregados(conn, dimensiones, metricas_pedidas, where, params, tramo_anios, total)
+    
+    tramo = tramo_anios if "anio_nacimiento" in dimensiones else None
+    clave = (tuple(dimensiones), tuple(metricas_pedidas), genero, tipo_documento, tramo, total, version)
+    # La clave incluye la versión de los datos: sirve de ETag sin calcular nada
+    etag = etag_debil(clave)
+    if no_modificado(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    grupos, metadatos = await cache_agregados.obtener_o_calcular(clave, lambda: coalescedor.ejecutar(clave, calcular))
+    return respuesta_condicional(request, {
+        "dimensiones": dimensiones,
+        "metricas": metricas_pedidas,
+        "grupos": grupos,
+    }, {"metadatos": {**metadatos, "version_datos": version}}, etag=etag)
@@ -1,12 +1,35 @@
  
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
-from datetime import datetime, date
+from typing import Literal, Optional, Tuple
+from datetime import datetime, date, time, timedelta
 import asyncpg
+import asyncio
+import json
 import os
+from common.cache import CacheTTL
+from common.admision import Limite, instalar_admision
+from common.auth import exigir_alcance, instalar_auth
+from common.condicional import respuesta_condicional
+from common.db import consulta_preparada, crear_pool, sentencia
+from common.metricas import instalar_metricas
+from common.replicas import EnrutadorLecturas, instalar_replicas
+from common.serializacion import RespuestaJSONRapida, codificar_filas, columnas_proyectadas
+from common.streaming import respuesta_csv, respuesta_ndjson
+from particiones import tarea_mantenimiento, mantener_particiones
 
 app = FastAPI(title="Logs Service")
+# Límites por cliente y ruta (sobrescribibles con LIMITES_RUTAS); dentro de
+# la autenticación para identificar al cliente por su token
+admision = instalar_admision(app, "logs", {
+    "GET /logs": Limite(tasa=10, rafaga=20, concurrencia=4),
+    "GET /logs/export": Limite(tasa=0.2, rafaga=2, concurrencia=2),
+    "POST /logs/mantenimiento": Limite(tasa=0.1, rafaga=1, concurrencia=1),
+})
+# Antes de CORS: las respuestas 401 también llevan las cabeceras CORS
+verificador = instalar_auth(app)
+# Token de consistencia de la petición para elegir réplica
+instalar_replicas(app)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,83 +37,219 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Siguiente-Cursor"],
 )
+instalar_metricas(app, "logs")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 db_pool = None
+# Lecturas a réplicas (DATABASE_URL_LECTURA) con vuelta al primario
+lectura = None
+tarea_particiones = None
+cache_resumen = CacheTTL(max_entradas=1, ttl=float(os.getenv("RESUMEN_TTL", "5")))
+
+LIMITE_PAGINA = 100
+LIMITE_PAGINA_MAX = 1000
+CAMPOS_LOG = ("id", "tipo_operacion", "numero_documento", "usuario", "detalles", "fecha_transaccion")
+
+# Consultas del resumen, preparadas en cada conexión del pool
+ESTADISTICAS_POR_TIPO = consulta_preparada(
+    "estadisticas_por_tipo",
+    "SELECT tipo_operacion, cantidad FROM estadisticas_logs ORDER BY tipo_operacion"
+)
+OPERACIONES_24H = consulta_preparada(
+    "operaciones_24h",
+    """SELECT SUM(cantidad) FROM estadisticas_logs_hora
+       WHERE hora >= date_trunc('hour', NOW() - INTERVAL '24 hours')"""
+)
 
 @app.on_event("startup")
 async def startup():
-    global db_pool
+    global db_pool, lectura, tarea_particiones
     print(f"Conectando a: {DATABASE_URL}")
-    db_pool = await asyncpg.create_pool(DATABASE_URL, min_size=2, max_size=10)
+    db_pool = await crear_pool(aplicacion="logs")
+    lectura = EnrutadorLecturas(db_pool)
+    await lectura.iniciar()
+    tarea_particiones = asyncio.create_task(tarea_mantenimiento())
 
 @app.on_event("shutdown")
 async def shutdown():
+    if verificador:
+        await verificador.detener()
+    if tarea_particiones:
+        tarea_particiones.cancel()
+    if lectura:
+        await lectura.detener()
     if db_pool:
         await db_pool.close()
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "logs"}
+    return {
+        "status": "healthy",
+        "service": "logs",
+        "admision": admision.estadisticas(),
+        "replicas": lectura.estadisticas() if lectura else {}
+    }
+
+def filtros_logs(
+    tipo_operacion: Optional[str],
+    numero_documento: Optional[str],
+    fecha_inicio: Optional[date],
+    fecha_fin: Optional[date],
+    contiene: Optional[str],
+    ruta: Optional[str],
+) -> Tuple[str, list]:
+    """Condiciones ``WHERE`` y sus parámetros, comunes al listado y a la exportación."""
+    condiciones = []
+    params = []
+    
+    def agregar(condicion: str, valor):
+        params.append(valor)
+        condiciones.append(condicion.format(n=len(params)))
+    
+    if tipo_operacion:
+        agregar("tipo_operacion = ${n}", tipo_operacion)
+    
+    if numero_documento:
+        agregar("numero_documento = ${n}", numero_documento)
+    
+    # Rangos semiabiertos sobre timestamps para que el planner pode particiones;
+    # fecha_fin incluye el día completo
+    if fecha_inicio:
+        agregar("fecha_transaccion >= ${n}", datetime.combine(fecha_inicio, time.min))
+    
+    if fecha_fin:
+        agregar("fecha_transaccion < ${n}", datetime.combine(fecha_fin + timedelta(days=1), time.min))
+    
+    # Ambos filtros sobre detalles usan el índice GIN idx_logs_detalles
+    if contiene:
+        try:
+            json.loads(contiene)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="'contiene' debe ser un documento JSON")
+        agregar("detalles @> ${n}::jsonb", contiene)
+    
+    if ruta:
+        agregar("detalles @? ${n}::jsonpath", ruta)
+    
+    where = " WHERE " + " AND ".join(condiciones) if condiciones else ""
+    return where, params
+
+def codificar_cursor(fila) -> str:
+    return f"{fila['fecha_transaccion'].isoformat()}_{fila['id']}"
+
+def interpretar_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        fecha, _, id_ = cursor.rpartition("_")
+        return datetime.fromisoformat(fecha), int(id_)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+async def consultar(pool, query: str, params: list):
+    """Un jsonpath mal escrito llega como error de Postgres: es un 400."""
+    try:
+        async with pool.acquire() as conn:
+            return await conn.fetch(query, *params)
+    except (asyncpg.DataError, asyncpg.PostgresSyntaxError) as e:
+        raise HTTPException(status_code=400, detail=f"Filtro inválido: {e}")
 
 @app.get("/logs")
 async def consultar_logs(
+    response: Response,
     tipo_operacion: Optional[str] = Query(None),
     numero_documento: Optional[str] = Query(None),
     fecha_inicio: Optional[date] = Query(None),
-    fecha_fin: Optional[date] = Query(None)
+    fecha_fin: Optional[date] = Query(None),
+    contiene: Optional[str] = Query(None, description='Contención JSON sobre detalles, p. ej. {"accion": "Foto eliminada"}'),
+    ruta: Optional[str] = Query(None, description='jsonpath sobre detalles, p. ej. $.pregunta ? (@ like_regex "edad" flag "i")'),
+    cursor: Optional[str] = Query(None, description="X-Siguiente-Cursor de la página anterior"),
+    limite: int = Query(LIMITE_PAGINA, ge=1, le=LIMITE_PAGINA_MAX),
+    campos: Optional[str] = Query(None, alias="fields", description="Columnas separadas por comas"),
+    rapido: bool = Query(False, description="Codifica las filas directamente, sin conversión adicional")
 ):
+    """Logs del más reciente al más antiguo con paginación keyset sobre
+    ``(fecha_transaccion, id)``; la siguiente página se pide con el cursor
+    de ``X-Siguiente-Cursor``."""
     if not db_pool:
         return []
     
-    query = "SELECT * FROM logs WHERE 1=1"
-    params = []
-    param_count = 0
-    
-    if tipo_operacion:
-        param_count += 1
-        query += f" AND tipo_operacion = ${param_count}"
-        params.append(tipo_operacion)
+    # El cursor necesita fecha_transaccion e id aunque no se pidan
+    columnas = ", ".join(columnas_proyectadas(campos, CAMPOS_LOG, CAMPOS_LOG, obligatorias=("id", "fecha_transaccion")))
+    where, params = filtros_logs(tipo_operacion, numero_documento, fecha_inicio, fecha_fin, contiene, ruta)
+    if cursor:
+        fecha, id_ = interpretar_cursor(cursor)
+        params += [fecha, id_]
+        # La comparación de filas no poda particiones; la condición sobre
+        # fecha_transaccion sola, redundante, sí
+        condicion = (f"fecha_transaccion <= ${len(params) - 1}"
+                     f" AND (fecha_transaccion, id) < (${len(params) - 1}, ${len(params)})")
+        where += f" AND {condicion}" if where else f" WHERE {condicion}"
+    params.append(limite)
+    query = f"SELECT {columnas} FROM logs{where} ORDER BY fecha_transaccion DESC, id DESC LIMIT ${len(params)}"
     
-    if numero_documento:
-        param_count += 1
-        query += f" AND numero_documento = ${param_count}"
-        params.append(numero_documento)
-    
-    if fecha_inicio:
-        param_count += 1
-        query += f" AND fecha_transaccion >= ${param_count}"
-        params.append(fecha_inicio)
+    results = await consultar(lectura.pool(), query, params)
+    siguiente = {"X-Siguiente-Cursor": codificar_cursor(results[-1])} if len(results) == limite else {}
+    if campos or rapido:
+        return RespuestaJSONRapida(codificar_filas(results), headers=siguiente)
+    response.headers.update(siguiente)
+    return [dict(r) for r in results]
+
+@app.get("/logs/export")
+async def exportar_logs(
+    tipo_operacion: Optional[str] = Query(None),
+    numero_documento: Optional[str] = Query(None),
+    fecha_inicio: Optional[date] = Query(None),
+    fecha_fin: Optional[date] = Query(None),
+    contiene: Optional[str] = Query(None),
+    ruta: Optional[str] = Query(None),
+    formato: Literal["ndjson", "csv"] = Query("ndjson"),
+    campos: Optional[str] = Query(None, alias="fields", description="Columnas separadas por comas")
+):
+    """Todos los logs que cumplen los filtros, en una sola pasada con un
+    cursor de servidor: la memoria no crece con el tamaño del extracto."""
+    if not db_pool:
+        raise HTTPException(status_code=500, detail="Database connection not available")
     
-    if fecha_fin:
-        param_count += 1
-        query += f" AND fecha_transaccion <= ${param_count}"
-        params.append(fecha_fin)
+    columnas = ", ".join(columnas_proyectadas(campos, CAMPOS_LOG, CAMPOS_LOG, obligatorias=()))
+    where, params = filtros_logs(tipo_operacion, numero_documento, fecha_inicio, fecha_fin, contiene, ruta)
+    query = f"SELECT {columnas} FROM logs{where} ORDER BY fecha_transaccion DESC, id DESC"
+    pool = lectura.pool()
     
-    query += " ORDER BY fecha_transaccion DESC LIMIT 100"
+    # Los errores dentro del stream ya no pueden cambiar el estado; el filtro
+    # se valida antes con un EXPLAIN, que no ejecuta la consulta
+    await consultar(pool, f"EXPLAIN {query}", params)
+    if formato == "csv":
+        return respuesta_csv(pool, query, params, "logs.csv")
+    return respuesta_ndjson(pool, query, params)
+
+@app.post("/logs/mantenimiento")
+async def ejecutar_mantenimiento(request: Request):
+    """Crea particiones futuras y archiva las vencidas sin esperar al ciclo.
+    Borra datos: exige el alcance de administración (o, sin autenticación,
+    una llamada desde el propio contenedor con ``docker compose exec``)."""
+    exigir_alcance(request)
+    if not db_pool:
+        return {"creadas": 0, "archivadas": [], "omitido": True}
+    return await mantener_particiones()
+
+async def calcular_resumen() -> dict:
+    async with lectura.pool().acquire() as conn:
+        # Contadores mantenidos por trigger en cada inserción de logs
+        por_tipo = await sentencia(conn, ESTADISTICAS_POR_TIPO).fetch()
+        # Ventana de 24h aproximada a horas completas
+        ultimas_24h = await sentencia(conn, OPERACIONES_24H).fetchval()
     
-    async with db_pool.acquire() as conn:
-        results = await conn.fetch(query, *params)
-        return [dict(r) for r in results]
+    return {
+        "total_operaciones": sum(r["cantidad"] for r in por_tipo),
+        "operaciones_24h": ultimas_24h or 0,
+        "distribucion_tipos": [dict(r) for r in por_tipo]
+    }
 
 @app.get("/logs/resumen")
-async def resumen_logs():
+async def resumen_logs(request: Request):
     if not db_pool:
         return {"total_operaciones": 0, "operaciones_24h": 0, "distribucion_tipos": []}
     
-    async with db_pool.acquire() as conn:
-        total = await conn.fetchval("SELECT COUNT(*) FROM logs")
-        por_tipo = await conn.fetch(
-            "SELECT tipo_operacion, COUNT(*) as cantidad FROM logs GROUP BY tipo_operacion"
-        )
-        ultimas_24h = await conn.fetchval(
-            "SELECT COUNT(*) FROM logs WHERE fecha_transaccion > NOW() - INTERVAL '24 hours'"
-        )
-        
-        return {
-            "total_operaciones": total or 0,
-            "operaciones_24h": ultimas_24h or 0,
-            "distribucion_tipos": [dict(r) for r in por_tipo]
-        }
- 
\ No newline at end of file
+    resumen, metadatos = await cache_resumen.obtener_o_calcular("resumen", calcular_resumen)
+    return respuesta_condicional(request, resumen, {"metadatos": metadatos})
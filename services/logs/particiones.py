@@ -0,0 +1,120 @@
+"""Mantenimiento de las particiones mensuales de ``logs``.
+
+Periódicamente se crean las particiones de los próximos meses y las que
+superan el periodo de retención se exportan a CSV comprimido, se separan de
+la tabla con ``DETACH PARTITION ... CONCURRENTLY`` y se eliminan, descontando
+sus filas de ``estadisticas_logs``. Un advisory
+lock evita que dos réplicas hagan el mantenimiento a la vez. El lock es de
+sesión, así que se usa una conexión directa y no una del pool (que detrás de
+PgBouncer puede cambiar de servidor entre transacciones).
+"""
+import asyncio
+import gzip
+import os
+import re
+from datetime import datetime
+from typing import List, Tuple
+
+from common.db import conectar_directo
+
+LOGS_MESES_ADELANTE = int(os.getenv("LOGS_MESES_ADELANTE", "3"))
+LOGS_RETENCION_MESES = int(os.getenv("LOGS_RETENCION_MESES", "12"))
+LOGS_ARCHIVO_DIR = os.getenv("LOGS_ARCHIVO_DIR", "/archivo")
+LOGS_MANTENIMIENTO_INTERVALO = float(os.getenv("LOGS_MANTENIMIENTO_INTERVALO", "3600"))
+
+CLAVE_LOCK = "mantenimiento_logs"
+_LIMITE_SUPERIOR = re.compile(r"TO \('([^']+)'\)")
+
+
+def inicio_retencion(ahora: datetime, meses: int) -> datetime:
+    """Primer instante que se conserva: inicio del mes de hace ``meses`` meses."""
+    indice = ahora.year * 12 + ahora.month - 1 - meses
+    return datetime(indice // 12, indice % 12 + 1, 1)
+
+
+async def particiones_vencidas(conn, limite: datetime) -> List[Tuple[str, datetime]]:
+    """Particiones de logs cuyo límite superior es anterior a ``limite``."""
+    filas = await conn.fetch("""
+        SELECT c.relname AS nombre, pg_get_expr(c.relpartbound, c.oid) AS rango
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'logs'::regclass
+    """)
+    vencidas = []
+    for fila in filas:
+        coincidencia = _LIMITE_SUPERIOR.search(fila["rango"])
+        if coincidencia:
+            hasta = datetime.fromisoformat(coincidencia.group(1))
+            if hasta <= limite:
+                vencidas.append((fila["nombre"], hasta))
+    return sorted(vencidas, key=lambda p: p[1])
+
+
+async def archivar_particion(conn, nombre: str) -> str:
+    """Exporta la partición a ``<LOGS_ARCHIVO_DIR>/<nombre>.csv.gz``."""
+    os.makedirs(LOGS_ARCHIVO_DIR, exist_ok=True)
+    destino = os.path.join(LOGS_ARCHIVO_DIR, f"{nombre}.csv.gz")
+    temporal = destino + ".tmp"
+    loop = asyncio.get_running_loop()
+    archivo = gzip.open(temporal, "wb")
+    try:
+        async def escribir(datos: bytes):
+            # La compresión es CPU; se hace fuera del event loop
+            await loop.run_in_executor(None, archivo.write, datos)
+
+        await conn.copy_from_table(nombre, output=escribir, format="csv", header=True)
+    finally:
+        archivo.close()
+    os.replace(temporal, destino)
+    return destino
+
+
+async def mantener_particiones() -> dict:
+    """Una pasada de mantenimiento; devuelve lo que se hizo."""
+    resultado = {"creadas": 0, "archivadas": [], "omitido": False}
+    conn = await conectar_directo()
+    try:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", CLAVE_LOCK):
+            resultado["omitido"] = True
+            return resultado
+        try:
+            resultado["creadas"] = await conn.fetchval("SELECT crear_particiones_logs($1)", LOGS_MESES_ADELANTE)
+
+            limite = inicio_retencion(datetime.now(), LOGS_RETENCION_MESES)
+            for nombre, _ in await particiones_vencidas(conn, limite):
+                # Primero se archiva: si falla, la partición sigue intacta
+                destino = await archivar_particion(conn, nombre)
+                # DETACH ... CONCURRENTLY no admite transacción; el descuento de
+                # los contadores y el DROP van juntos en la siguiente
+                await conn.execute(f'ALTER TABLE logs DETACH PARTITION "{nombre}" CONCURRENTLY')
+                async with conn.transaction():
+                    await conn.execute(f"""
+                        UPDATE estadisticas_logs e SET cantidad = e.cantidad - p.cantidad
+                        FROM (SELECT tipo_operacion, COUNT(*) AS cantidad FROM "{nombre}"
+                              GROUP BY tipo_operacion) p
+                        WHERE e.tipo_operacion = p.tipo_operacion
+                    """)
+                    await conn.execute(f'DROP TABLE "{nombre}"')
+                resultado["archivadas"].append(destino)
+
+            # Las cubetas por hora solo se usan para la ventana de 24h
+            await conn.execute(
+                "DELETE FROM estadisticas_logs_hora WHERE hora < NOW() - INTERVAL '2 days'"
+            )
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", CLAVE_LOCK)
+    finally:
+        await conn.close()
+    return resultado
+
+
+async def tarea_mantenimiento():
+    """Bucle en segundo plano que ejecuta el mantenimiento periódicamente."""
+    while True:
+        try:
+            resultado = await mantener_particiones()
+            if resultado["creadas"] or resultado["archivadas"]:
+                print(f"Mantenimiento de logs: {resultado}")
+        except Exception as e:
+            print(f"Error en mantenimiento de logs: {e}")
+        await asyncio.sleep(LOGS_MANTENIMIENTO_INTERVALO)
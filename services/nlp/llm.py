@@ -0,0 +1,93 @@
+"""Cliente del modelo de lenguaje que no bloquea el event loop.
+
+``generate_content`` de Gemini es síncrono; se ejecuta en un executor acotado
+con un semáforo que limita las llamadas en curso y un timeout por llamada.
+``ModeloFalso`` reemplaza a Gemini en local y en pruebas de carga.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.metricas import llm_duracion
+
+LLM_MAX_CONCURRENCIA = int(os.getenv("LLM_MAX_CONCURRENCIA", "4"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+LLM_ESPERA_MAX = float(os.getenv("LLM_ESPERA_MAX", "5"))
+
+
+class LLMSaturado(Exception):
+    """No hubo hueco en el semáforo dentro del tiempo de espera."""
+
+
+class ModeloFalso:
+    """Modelo local con la misma interfaz que ``genai.GenerativeModel``."""
+
+    class _Respuesta:
+        def __init__(self, text: str):
+            self.text = text
+
+    def __init__(self, latencia: float = float(os.getenv("LLM_FALSO_LATENCIA", "0.2"))):
+        self.latencia = latencia
+
+    def generate_content(self, prompt: str):
+        time.sleep(self.latencia)
+        return self._Respuesta(f"[modelo falso] Respuesta generada a partir de {len(prompt)} caracteres de contexto.")
+
+
+class ClienteLLM:
+    def __init__(
+        self,
+        modelo,
+        nombre: str = "gemini",
+        max_concurrencia: int = LLM_MAX_CONCURRENCIA,
+        timeout: float = LLM_TIMEOUT,
+        espera_max: float = LLM_ESPERA_MAX,
+    ):
+        self.modelo = modelo
+        self.nombre = nombre
+        self.timeout = timeout
+        self.espera_max = espera_max
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrencia, thread_name_prefix="llm")
+        self._semaforo = asyncio.Semaphore(max_concurrencia)
+        self.contadores = {"llamadas": 0, "en_curso": 0, "timeouts": 0, "saturado": 0, "errores": 0}
+
+    async def generar(self, prompt: str) -> str:
+        try:
+            await asyncio.wait_for(self._semaforo.acquire(), timeout=self.espera_max)
+        except asyncio.TimeoutError:
+            self.contadores["saturado"] += 1
+            raise LLMSaturado("Demasiadas llamadas al modelo en curso")
+
+        loop = asyncio.get_running_loop()
+        futuro = loop.run_in_executor(self._executor, self.modelo.generate_content, prompt)
+        self.contadores["llamadas"] += 1
+        self.contadores["en_curso"] += 1
+        inicio = time.perf_counter()
+        # El hueco se libera cuando el hilo termina de verdad, no al vencer el
+        # timeout; así el semáforo refleja las llamadas realmente en curso
+        futuro.add_done_callback(self._liberar)
+        try:
+            respuesta = await asyncio.wait_for(asyncio.shield(futuro), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.contadores["timeouts"] += 1
+            llm_duracion.observar(time.perf_counter() - inicio, self.nombre, "timeout")
+            raise
+        except Exception:
+            self.contadores["errores"] += 1
+            llm_duracion.observar(time.perf_counter() - inicio, self.nombre, "error")
+            raise
+        llm_duracion.observar(time.perf_counter() - inicio, self.nombre, "ok")
+        return respuesta.text
+
+    def _liberar(self, futuro):
+        self.contadores["en_curso"] -= 1
+        self._semaforo.release()
+        if not futuro.cancelled():
+            futuro.exception()  # evita el aviso de excepción no recuperada
+
+    def cerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def estadisticas(self) -> dict:
+        return dict(self.contadores)
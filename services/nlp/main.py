@@ -2,13 +2,32 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import asyncpg
+import asyncio
 import os
+import re
 import json
-from typing import List, Dict
-from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+from common.cache import CacheTTL
+from common.log_sink import LogSink
+from common.admision import Limite, instalar_admision
+from common.auth import instalar_auth
+from common.coalescencia import Coalescedor
+from common.db import consulta_preparada, crear_pool, sentencia
+from common.metricas import PoolAgotado, instalar_metricas
+from common.replicas import EnrutadorLecturas, instalar_replicas
+from recuperacion import analizar_pregunta, recuperar_contexto, normalizar
+from llm import ClienteLLM, ModeloFalso, LLMSaturado
 
 app = FastAPI(title="NLP Service - RAG")
+# Límites por cliente y ruta (sobrescribibles con LIMITES_RUTAS); dentro de
+# la autenticación para identificar al cliente por su token
+admision = instalar_admision(app, "nlp", {
+    "POST /consulta-nlp": Limite(tasa=1, rafaga=5, concurrencia=8),
+})
+# Antes de CORS: las respuestas 401 también llevan las cabeceras CORS
+verificador = instalar_auth(app)
+# Token de consistencia de la petición para elegir réplica
+instalar_replicas(app)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,34 +36,71 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+instalar_metricas(app, "nlp")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+LLM_MODELO_FALSO = os.getenv("LLM_MODELO_FALSO", "").lower() in ("1", "true", "si")
 
 db_pool = None
+# Lecturas a réplicas (DATABASE_URL_LECTURA) con vuelta al primario
+lectura = None
+log_sink = LogSink()
 
-# Importar Gemini solo si hay API key
-if GEMINI_API_KEY:
+# Respuestas cacheadas por (pregunta normalizada, versión de los datos)
+cache_respuestas = CacheTTL(
+    max_entradas=int(os.getenv("NLP_CACHE_MAX", "1000")),
+    ttl=float(os.getenv("NLP_CACHE_TTL", "300"))
+)
+
+# La misma pregunta hecha a la vez por varios clientes recupera el contexto
+# y llama al modelo una sola vez
+coalescedor = Coalescedor("nlp")
+
+# Se consulta en cada petición para la clave de la caché
+VERSION_DATOS = consulta_preparada(
+    "version_datos", "SELECT version FROM version_datos WHERE tabla = 'personas'"
+)
+
+llm: Optional[ClienteLLM] = None
+modelo_nombre = None
+
+# Modelo falso para pruebas locales; Gemini solo si hay API key
+if LLM_MODELO_FALSO:
+    llm = ClienteLLM(ModeloFalso(), nombre="falso")
+    modelo_nombre = "falso"
+    print("LLM_MODELO_FALSO activo - usando modelo local de pruebas")
+elif GEMINI_API_KEY:
     try:
         import google.generativeai as genai
         genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        gemini_available = True
+        llm = ClienteLLM(genai.GenerativeModel('gemini-1.5-flash'), nombre="gemini-1.5-flash")
+        modelo_nombre = "gemini-1.5-flash"
     except Exception as e:
         print(f"Error configurando Gemini: {e}")
-        gemini_available = False
 else:
     print("GEMINI_API_KEY no configurada - usando respuestas simuladas")
-    gemini_available = False
+
+gemini_available = llm is not None
 
 @app.on_event("startup")
 async def startup():
-    global db_pool
+    global db_pool, lectura
     print(f"Conectando a: {DATABASE_URL}")
-    db_pool = await asyncpg.create_pool(DATABASE_URL, min_size=2, max_size=10)
+    db_pool = await crear_pool(aplicacion="nlp")
+    lectura = EnrutadorLecturas(db_pool)
+    await lectura.iniciar()
+    log_sink.iniciar(db_pool)
 
 @app.on_event("shutdown")
 async def shutdown():
+    if verificador:
+        await verificador.detener()
+    await log_sink.detener()
+    if llm:
+        llm.cerrar()
+    if lectura:
+        await lectura.detener()
     if db_pool:
         await db_pool.close()
 
@@ -56,69 +112,87 @@ class RespuestaNLP(BaseModel):
     respuesta: str
     contexto: List[Dict]
 
-async def obtener_contexto_personas():
-    """Obtiene todos los datos de personas para contexto"""
-    if not db_pool:
-        return []
-    
-    async with db_pool.acquire() as conn:
-        personas = await conn.fetch("""
-            SELECT tipo_documento, numero_documento, primer_nombre, 
-                   segundo_nombre, apellidos, fecha_nacimiento, 
-                   genero, correo_electronico, celular
-            FROM personas
-        """)
-        return [dict(p) for p in personas]
-
-def procesar_sin_gemini(pregunta: str, contexto: List[Dict]) -> str:
+def pool_lectura():
+    """Réplica elegida para la petición (o el primario). La versión y el
+    contexto se leen del mismo pool para que la respuesta cacheada
+    corresponda a la versión de su clave."""
+    return lectura.pool() if lectura else db_pool
+
+async def obtener_contexto_personas(pregunta: str, pool=None) -> Optional[Dict]:
+    """Recupera solo las filas o agregados relevantes para la pregunta"""
+    return await recuperar_contexto(pool or db_pool, pregunta)
+
+async def obtener_version_datos(pool=None) -> Optional[int]:
+    """Versión de la tabla personas, incrementada por trigger en cada escritura"""
+    pool = pool or db_pool
+    if not pool:
+        return None
+    async with pool.acquire() as conn:
+        return await sentencia(conn, VERSION_DATOS).fetchval()
+
+def normalizar_pregunta(pregunta: str) -> str:
+    return " ".join(re.findall(r"\w+", normalizar(pregunta)))
+
+def clave_pregunta(pregunta: str) -> Tuple:
+    """Texto normalizado más lo que la recuperación extrae de la pregunta: las
+    mayúsculas deciden si hay nombre ("busca a pedro" / "Busca a Pedro") y dos
+    preguntas que se recuperan distinto no pueden compartir respuesta."""
+    analisis = analizar_pregunta(pregunta)
+    return (normalizar_pregunta(pregunta), analisis["intencion"],
+            tuple(sorted(analisis["filtros"].items())), analisis["nombre"])
+
+def procesar_sin_gemini(pregunta: str, contexto: Dict) -> str:
     """Procesamiento básico sin Gemini para pruebas"""
-    pregunta_lower = pregunta.lower()
+    filas = contexto["filas"]
+    agregados = contexto["agregados"]
+    intencion = contexto["intencion"]
     
-    if not contexto:
-        return "No hay datos de personas registradas en el sistema."
+    if not filas and not agregados.get("total_personas"):
+        return "No hay datos de personas que coincidan con la consulta."
     
-    # Buscar el más joven
-    if "joven" in pregunta_lower or "menor" in pregunta_lower:
-        persona_mas_joven = None
-        fecha_mas_reciente = None
-        
-        for persona in contexto:
-            fecha_nac = persona.get('fecha_nacimiento')
-            if fecha_nac:
-                if isinstance(fecha_nac, str):
-                    fecha_nac = datetime.fromisoformat(fecha_nac).date()
-                
-                if fecha_mas_reciente is None or fecha_nac > fecha_mas_reciente:
-                    fecha_mas_reciente = fecha_nac
-                    persona_mas_joven = persona
-        
-        if persona_mas_joven:
-            nombre = f"{persona_mas_joven['primer_nombre']} {persona_mas_joven['apellidos']}"
-            return f"El empleado más joven registrado es {nombre}, nacido el {fecha_mas_reciente}"
+    # Más joven / más viejo: la consulta ya devolvió la persona
+    if intencion in ("mas_joven", "mas_viejo") and filas:
+        persona = filas[0]
+        nombre = f"{persona['primer_nombre']} {persona['apellidos']}"
+        calificativo = "más joven" if intencion == "mas_joven" else "mayor"
+        return f"El empleado {calificativo} registrado es {nombre}, nacido el {persona['fecha_nacimiento']}"
+    
+    # Contar personas / edad promedio
+    if intencion == "conteo":
+        return f"Hay {agregados['total_personas']} personas registradas en el sistema."
+    if intencion == "promedio_edad":
+        return (f"La edad promedio es de {agregados['edad_promedio']} años ({agregados['total_personas']} personas, "
+                f"entre {agregados['edad_minima']} y {agregados['edad_maxima']} años).")
     
-    # Contar personas
-    if "cuantos" in pregunta_lower or "total" in pregunta_lower:
-        return f"Hay {len(contexto)} personas registradas en el sistema."
+    if contexto.get("nombre_sin_coincidencias"):
+        return f"No hay personas registradas con el nombre {contexto['nombre_sin_coincidencias']}."
     
     # Listar nombres
-    if "quienes" in pregunta_lower or "lista" in pregunta_lower:
-        nombres = [f"{p['primer_nombre']} {p['apellidos']}" for p in contexto[:5]]
+    if filas:
+        nombres = [f"{p['primer_nombre']} {p['apellidos']}" for p in filas[:5]]
         return f"Algunas personas registradas son: {', '.join(nombres)}"
     
-    return f"Hay {len(contexto)} personas en la base de datos. Puedes preguntar por el más joven, cuántas personas hay, etc."
+    return f"Hay {agregados['total_personas']} personas en la base de datos. Puedes preguntar por el más joven, cuántas personas hay, etc."
 
-async def procesar_pregunta_rag(pregunta: str, contexto: List[Dict]) -> str:
-    """Procesa la pregunta usando RAG con Gemini o fallback"""
+async def procesar_pregunta_rag(pregunta: str, contexto: Dict) -> Tuple[str, bool]:
+    """Procesa la pregunta usando RAG con Gemini o fallback.
+    Devuelve la respuesta y si puede cachearse (no es un fallback por error)."""
     
-    if not gemini_available:
-        return procesar_sin_gemini(pregunta, contexto)
+    if not llm:
+        return procesar_sin_gemini(pregunta, contexto), True
     
-    contexto_str = json.dumps(contexto, default=str, ensure_ascii=False)
+    # Solo las filas recuperadas y los agregados calculados entran al prompt
+    recuperado = {"filas": contexto["filas"], "agregados": contexto["agregados"]}
+    if contexto.get("nombre_sin_coincidencias"):
+        # Las filas no son de esa persona: que el modelo no las confunda
+        recuperado["nombre_sin_coincidencias"] = contexto["nombre_sin_coincidencias"]
+    contexto_str = json.dumps(recuperado, default=str, ensure_ascii=False)
     
     prompt = f"""
     Eres un asistente que responde preguntas sobre una base de datos de personas.
     
-    CONTEXTO DE LA BASE DE DATOS:
+    CONTEXTO RECUPERADO DE LA BASE DE DATOS
+    (filas relevantes para la pregunta y agregados calculados sobre toda la tabla):
     {contexto_str}
     
     PREGUNTA DEL USUARIO:
@@ -126,7 +200,7 @@ async def procesar_pregunta_rag(pregunta: str, contexto: List[Dict]) -> str:
     
     INSTRUCCIONES:
     1. Responde basándote ÚNICAMENTE en los datos proporcionados
-    2. Si la pregunta es sobre el empleado más joven, calcula basándote en fecha_nacimiento
+    2. Para totales y promedios usa los agregados, no cuentes las filas
     3. Si no puedes responder con los datos disponibles, indícalo claramente
     4. Sé conciso y directo en tu respuesta
     
@@ -134,48 +208,77 @@ async def procesar_pregunta_rag(pregunta: str, contexto: List[Dict]) -> str:
     """
     
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        # Se ejecuta fuera del event loop, con timeout y concurrencia acotada
+        return await llm.generar(prompt), True
+    except asyncio.TimeoutError:
+        print("Timeout esperando respuesta del modelo")
+    except LLMSaturado as e:
+        print(f"Modelo saturado: {e}")
     except Exception as e:
         print(f"Error con Gemini: {e}")
-        return procesar_sin_gemini(pregunta, contexto)
+    return procesar_sin_gemini(pregunta, contexto), False
 
 @app.get("/health")
 async def health_check():
     return {
         "status": "healthy", 
         "service": "nlp",
-        "gemini_available": gemini_available
+        "gemini_available": gemini_available,
+        "modelo": modelo_nombre,
+        "llm": llm.estadisticas() if llm else None,
+        "cache": cache_respuestas.estadisticas(),
+        "log_sink": log_sink.estadisticas(),
+        "admision": admision.estadisticas(),
+        "coalescencia": coalescedor.estadisticas(),
+        "replicas": lectura.estadisticas() if lectura else {}
     }
 
+async def responder(pregunta: str, clave: Tuple, pool) -> Tuple[str, List[Dict]]:
+    """Respuesta sin caché; la comparten las peticiones con la misma clave."""
+    # Recuperar solo el contexto relevante de la base de datos
+    contexto = await obtener_contexto_personas(pregunta, pool)
+    
+    if not contexto:
+        respuesta, cacheable = "No hay datos de personas en la base de datos.", False
+        contexto_resumen = []
+    else:
+        # Procesar con RAG
+        respuesta, cacheable = await procesar_pregunta_rag(pregunta, contexto)
+        contexto_resumen = contexto["filas"][:3] or [contexto["agregados"]]
+    
+    if cacheable:
+        cache_respuestas.guardar(clave, (respuesta, contexto_resumen))
+    return respuesta, contexto_resumen
+
 @app.post("/consulta-nlp", response_model=RespuestaNLP)
 async def consulta_lenguaje_natural(consulta: ConsultaNLP):
     try:
-        # Obtener contexto de la base de datos
-        contexto = await obtener_contexto_personas()
+        # La versión cambia con cada escritura en personas e invalida la caché
+        pool = pool_lectura()
+        clave = (clave_pregunta(consulta.pregunta), await obtener_version_datos(pool))
+        cacheada = cache_respuestas.obtener(clave)
         
-        if not contexto:
-            respuesta = "No hay datos de personas en la base de datos."
+        if cacheada:
+            respuesta, contexto_resumen = cacheada
         else:
-            # Procesar con RAG
-            respuesta = await procesar_pregunta_rag(consulta.pregunta, contexto)
+            respuesta, contexto_resumen = await coalescedor.ejecutar(
+                clave, lambda: responder(consulta.pregunta, clave, pool)
+            )
         
-        # Registrar en log
-        if db_pool:
-            async with db_pool.acquire() as conn:
-                await conn.execute(
-                    """INSERT INTO logs (tipo_operacion, detalles) 
-                       VALUES ($1, $2::jsonb)""",
-                    "CONSULTA_NLP",
-                    json.dumps({"pregunta": consulta.pregunta, "respuesta": respuesta})
-                )
+        # Registrar en log (asíncrono, por lotes)
+        await log_sink.registrar(
+            "CONSULTA_NLP",
+            detalles={"pregunta": consulta.pregunta, "respuesta": respuesta, "cache": cacheada is not None}
+        )
         
         return RespuestaNLP(
             pregunta=consulta.pregunta,
             respuesta=respuesta,
-            contexto=contexto[:3] if contexto else []
+            contexto=contexto_resumen
         )
         
+    except PoolAgotado:
+        raise
     except Exception as e:
         print(f"Error en consulta NLP: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,214 @@
+"""Etapa de recuperación del pipeline RAG.
+
+En lugar de volcar toda la tabla ``personas`` en el prompt, la pregunta se
+traduce a filtros y a una intención (más joven, conteo, promedio, búsqueda
+por nombre...) que se resuelven con una sola consulta indexada. Al modelo
+solo llegan las filas relevantes (top-k) o los agregados calculados.
+"""
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from common.agregados import calcular_agregados
+
+TOP_K = int(os.getenv("NLP_TOP_K", "20"))
+
+COLUMNAS_CONTEXTO = """tipo_documento, numero_documento, primer_nombre,
+    segundo_nombre, apellidos, fecha_nacimiento,
+    genero, correo_electronico, celular"""
+
+# Palabras clave (ya normalizadas) que determinan la intención
+CLAVES_MAS_JOVEN = ("joven", "menor")
+CLAVES_MAS_VIEJO = ("mayor", "viejo", "anciano")
+CLAVES_PROMEDIO = ("promedio", "media")
+CLAVES_CONTEO = ("cuantos", "cuantas", "total", "cantidad")
+CLAVES_LISTA = ("quienes", "lista", "listar", "muestra")
+
+CLAVES_GENERO = {
+    "Femenino": ("mujer", "mujeres", "femenino", "femenina", "femeninas"),
+    "Masculino": ("hombre", "hombres", "masculino", "masculinos"),
+    "No binario": ("no binario", "no binaria", "no binarios"),
+}
+CLAVES_TIPO_DOCUMENTO = {
+    "Cédula": ("cedula",),
+    "Tarjeta de identidad": ("tarjeta",),
+}
+
+STOPWORDS = {
+    "que", "cual", "cuales", "quien", "quienes", "cuando", "donde", "como", "cuanto",
+    "cuantos", "cuantas", "hay", "es", "son", "esta", "estan", "el", "la", "los", "las",
+    "un", "una", "unos", "unas", "de", "del", "al", "a", "en", "y", "o", "por", "para",
+    "con", "sin", "se", "su", "sus", "mi", "me", "dime", "dame", "muestra", "lista",
+    "persona", "personas", "empleado", "empleados", "empleada", "registrado", "registrados",
+    "registrada", "registradas", "sistema", "base", "datos", "nombre", "nombres",
+    "llama", "llaman", "correo", "celular", "telefono", "documento", "edad", "fecha",
+    "nacimiento", "genero", "total", "mas", "menos", "todos", "todas", "tiene", "tienen",
+    "joven", "menor", "mayor", "viejo", "promedio", "media", "cantidad", "numero",
+    "cedula", "tarjeta", "identidad", "hombre", "hombres", "mujer", "mujeres",
+    # Verbos de pregunta o petición, que a veces llegan con mayúscula
+    "muestrame", "muestren", "mostrar", "indica", "indicame", "busca", "buscame", "buscar",
+    "encuentra", "encuentrame", "existe", "existen", "llamada", "llamadas", "llamado",
+    "llamados", "quiero", "necesito", "puedes", "podrias", "cuentame", "ver", "saber",
+    "hola", "favor", "gracias", "informacion", "listame", "listar", "dar", "decir",
+}
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas y sin tildes, igual que ``normalizar_nombre`` en la base."""
+    sin_tildes = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in sin_tildes if not unicodedata.combining(c)).lower()
+
+
+def _contiene(texto: str, claves) -> bool:
+    return any(re.search(rf"\b{re.escape(c)}", texto) for c in claves)
+
+
+def _contiene_palabra(texto: str, claves) -> bool:
+    """Como ``_contiene`` pero sin prefijos: "mayor" no encuentra "mayores"."""
+    return any(re.search(rf"\b{re.escape(c)}\b", texto) for c in claves)
+
+
+def _nombres_propios(pregunta: str) -> List[str]:
+    """Palabras con mayúscula inicial que no son stopwords. La que abre una
+    oración lleva mayúscula por ortografía ("Busca a Pedro") y solo cuenta si
+    la sigue otra palabra en mayúscula ("Juan Carlos es mayor?")."""
+    candidatas = []
+    for encontrada in re.finditer(r"[^\W\d_]+", pregunta):
+        palabra = encontrada.group()
+        if not palabra[0].isupper() or normalizar(palabra) in STOPWORDS:
+            continue
+        previo = pregunta[:encontrada.start()].rstrip(" \t\n¿¡\"'(")
+        inicial = not previo or previo[-1] in ".!?:"
+        candidatas.append((palabra, inicial, encontrada.start(), encontrada.end()))
+    nombres = []
+    for i, (palabra, inicial, _, fin) in enumerate(candidatas):
+        siguiente = candidatas[i + 1] if i + 1 < len(candidatas) else None
+        if inicial and not (siguiente and not pregunta[fin:siguiente[2]].strip()):
+            continue
+        nombres.append(palabra)
+    return nombres
+
+
+def analizar_pregunta(pregunta: str) -> Dict:
+    """Extrae intención, filtros y posibles nombres de la pregunta."""
+    texto = normalizar(pregunta)
+    filtros: Dict[str, str] = {}
+
+    documento = re.search(r"\b\d{6,10}\b", texto)
+    if documento:
+        filtros["numero_documento"] = documento.group()
+
+    # "no binario" debe evaluarse antes que las demás claves de género
+    for genero in ("No binario", "Femenino", "Masculino"):
+        if _contiene(texto, CLAVES_GENERO[genero]):
+            filtros["genero"] = genero
+            break
+
+    for tipo, claves in CLAVES_TIPO_DOCUMENTO.items():
+        if _contiene(texto, claves):
+            filtros["tipo_documento"] = tipo
+
+    # El conteo va primero: "¿Cuántas personas son mayores de 30?" pide un
+    # número, no a la persona mayor. "Cuántos años" pregunta una edad
+    if _contiene(texto, CLAVES_CONTEO) and not re.search(r"\bcuant[oa]s anos\b", texto):
+        intencion = "conteo"
+    elif _contiene_palabra(texto, CLAVES_MAS_JOVEN):
+        intencion = "mas_joven"
+    elif _contiene_palabra(texto, CLAVES_MAS_VIEJO):
+        intencion = "mas_viejo"
+    elif _contiene(texto, CLAVES_PROMEDIO):
+        intencion = "promedio_edad"
+    elif _contiene(texto, CLAVES_LISTA):
+        intencion = "lista"
+    else:
+        intencion = "busqueda"
+
+    # Los nombres propios suelen venir en mayúscula inicial
+    nombres = _nombres_propios(pregunta)
+
+    return {
+        "intencion": intencion,
+        "filtros": filtros,
+        "nombre": " ".join(nombres) if nombres else None,
+    }
+
+
+def _condiciones(analisis: Dict) -> Tuple[str, List]:
+    condiciones, params = [], []
+    for campo, valor in analisis["filtros"].items():
+        params.append(valor)
+        condiciones.append(f"{campo} = ${len(params)}")
+    if analisis["nombre"]:
+        params.append(analisis["nombre"])
+        condiciones.append(f"normalizar_nombre(${len(params)}) <% nombre_busqueda")
+    where = " WHERE " + " AND ".join(condiciones) if condiciones else ""
+    return where, params
+
+
+async def _filas(conn, analisis: Dict, k: int) -> List[Dict]:
+    where, params = _condiciones(analisis)
+    if analisis["intencion"] in ("mas_joven", "mas_viejo"):
+        orden = "fecha_nacimiento DESC, id" if analisis["intencion"] == "mas_joven" else "fecha_nacimiento, id"
+        limite = 1
+    elif analisis["nombre"]:
+        orden = f"word_similarity(normalizar_nombre(${len(params)}), nombre_busqueda) DESC, id"
+        limite = k
+    else:
+        orden = "id DESC"
+        limite = k
+    params.append(limite)
+    registros = await conn.fetch(
+        f"SELECT {COLUMNAS_CONTEXTO} FROM personas{where} ORDER BY {orden} LIMIT ${len(params)}",
+        *params
+    )
+    return [dict(r) for r in registros]
+
+
+async def recuperar_contexto(pool, pregunta: str, k: int = TOP_K) -> Optional[Dict]:
+    """Resuelve la pregunta con una consulta acotada.
+
+    Devuelve ``{"intencion", "filtros", "nombre", "filas", "agregados"}`` con
+    como mucho ``k`` filas, o ``None`` si no hay pool. Si el nombre detectado
+    no coincide con nadie, las filas se buscan sin él y el nombre pasa a
+    ``nombre_sin_coincidencias``; los conteos lo conservan (cero es la respuesta).
+    """
+    if not pool:
+        return None
+
+    analisis = analizar_pregunta(pregunta)
+    intencion = analisis["intencion"]
+    filas: List[Dict] = []
+    agregados: Dict = {}
+
+    async with pool.acquire() as conn:
+        if intencion in ("conteo", "promedio_edad"):
+            # Por género más el total, en la misma consulta agregada
+            where, params = _condiciones(analisis)
+            grupos = await calcular_agregados(
+                conn, ["genero"], ["cantidad", "edad_promedio", "edad_min", "edad_max"],
+                where, params, total=True
+            )
+            total = grupos[-1]
+            agregados = {
+                "total_personas": total["cantidad"],
+                "edad_promedio": total["edad_promedio"] or 0,
+                "edad_minima": total["edad_min"],
+                "edad_maxima": total["edad_max"],
+                "distribucion_genero": [
+                    {"genero": g["genero"], "cantidad": g["cantidad"]} for g in grupos if not g["es_total"]
+                ],
+            }
+        else:
+            filas = await _filas(conn, analisis, k)
+            if not filas and analisis["nombre"]:
+                analisis = {**analisis, "nombre": None, "nombre_sin_coincidencias": analisis["nombre"]}
+                filas = await _filas(conn, analisis, k)
+            if intencion == "busqueda" and not analisis["nombre"] and not analisis["filtros"]:
+                # Pregunta genérica: además de una muestra, el total de los
+                # contadores mantenidos por trigger, sin recorrer la tabla
+                agregados = {"total_personas": await conn.fetchval(
+                    "SELECT COALESCE(SUM(cantidad), 0)::int FROM estadisticas_personas"
+                )}
+
+    return {**analisis, "filas": filas, "agregados": agregados}
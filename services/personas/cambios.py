@@ -0,0 +1,229 @@
+"""Feed de cambios de personas.
+
+Un trigger registra cada modificación en ``personas_cambios`` y avisa por el
+canal ``personas_cambios`` con el último id. El ``HubCambios`` de cada
+réplica escucha el canal con una conexión propia, lee los cambios nuevos una
+sola vez y los reparte a todos sus suscriptores (los streams SSE), así el
+costo en la base no crece con el número de clientes.
+
+Los ids se asignan antes del commit, así que una transacción lenta puede
+confirmar un id menor después de uno mayor. Los ids que faltan se vuelven a
+buscar durante ``CAMBIOS_ESPERA_HUECOS`` segundos y se entregan en cuanto
+aparecen (fuera de orden); pasado ese tiempo se asume que fueron un rollback.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterator, Dict, Optional, Set
+
+from common.db import conectar_directo
+from common.metricas import registro
+from common.serializacion import codificar
+
+CANAL_CAMBIOS = "personas_cambios"
+CAMBIOS_LOTE = int(os.getenv("CAMBIOS_LOTE", "1000"))
+CAMBIOS_COLA_MAX = int(os.getenv("CAMBIOS_COLA_MAX", "10000"))
+CAMBIOS_ESPERA_HUECOS = float(os.getenv("CAMBIOS_ESPERA_HUECOS", "10"))
+CAMBIOS_RETENCION_DIAS = int(os.getenv("CAMBIOS_RETENCION_DIAS", "7"))
+CAMBIOS_LATIDO = float(os.getenv("CAMBIOS_LATIDO", "15"))
+MAX_HUECOS = 10000
+
+SQL_CAMBIOS = """SELECT id, operacion, numero_documento, datos, fecha
+                 FROM personas_cambios WHERE {condicion} ORDER BY id LIMIT $2"""
+
+eventos_entregados = registro.contador(
+    "personas_changes_delivered_total", "Eventos del feed de cambios entregados a suscriptores"
+)
+suscriptores_gauge = registro.gauge(
+    "personas_changes_subscribers", "Suscriptores conectados al feed de cambios"
+)
+
+
+class _Desbordado(Exception):
+    """El suscriptor no consume al ritmo del feed; debe reconectar."""
+
+
+class _Suscriptor:
+    __slots__ = ("cola", "desbordado")
+
+    def __init__(self):
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=CAMBIOS_COLA_MAX)
+        self.desbordado = False
+
+
+def _evento(fila) -> dict:
+    evento = dict(fila)
+    if isinstance(evento["datos"], str):
+        evento["datos"] = json.loads(evento["datos"])
+    return evento
+
+
+class HubCambios:
+    def __init__(self, pool):
+        self.pool = pool
+        self.ultimo_id = 0
+        self._suscriptores: Set[_Suscriptor] = set()
+        self._huecos: Dict[int, float] = {}
+        self._aviso = asyncio.Event()
+        self._tarea: Optional[asyncio.Task] = None
+        self.contadores = {"avisos": 0, "lecturas": 0, "eventos": 0, "recuperados_tarde": 0,
+                           "huecos_descartados": 0, "desbordados": 0, "reconexiones": 0}
+        suscriptores_gauge.fijar(lambda: len(self._suscriptores))
+
+    async def iniciar(self):
+        async with self.pool.acquire() as conn:
+            self.ultimo_id = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM personas_cambios")
+        self._tarea = asyncio.create_task(self._escuchar())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    def suscribir(self) -> _Suscriptor:
+        suscriptor = _Suscriptor()
+        self._suscriptores.add(suscriptor)
+        return suscriptor
+
+    def cancelar(self, suscriptor: _Suscriptor):
+        self._suscriptores.discard(suscriptor)
+
+    def _avisar(self, *args):
+        self.contadores["avisos"] += 1
+        self._aviso.set()
+
+    async def _escuchar(self):
+        """Conexión LISTEN dedicada; se reconecta si se pierde."""
+        ultima_limpieza = 0.0
+        while True:
+            conexion = None
+            try:
+                conexion = await conectar_directo()
+                await conexion.add_listener(CANAL_CAMBIOS, self._avisar)
+                # Lo que se confirmó mientras no se escuchaba
+                self._aviso.set()
+                while not conexion.is_closed():
+                    try:
+                        espera = 1.0 if self._huecos else CAMBIOS_LATIDO
+                        await asyncio.wait_for(self._aviso.wait(), timeout=espera)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._aviso.clear()
+                    await self._leer_nuevos()
+                    if time.monotonic() - ultima_limpieza > 3600:
+                        ultima_limpieza = time.monotonic()
+                        await self._limpiar()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error en el feed de cambios: {e}")
+            finally:
+                if conexion is not None and not conexion.is_closed():
+                    await conexion.close()
+            self.contadores["reconexiones"] += 1
+            await asyncio.sleep(1)
+
+    async def _leer_nuevos(self):
+        ahora = time.monotonic()
+        for id_, desde in list(self._huecos.items()):
+            if ahora - desde > CAMBIOS_ESPERA_HUECOS:
+                del self._huecos[id_]
+                self.contadores["huecos_descartados"] += 1
+
+        async with self.pool.acquire() as conn:
+            if self._huecos:
+                tardios = await conn.fetch(
+                    SQL_CAMBIOS.format(condicion="id = ANY($1::bigint[])"), list(self._huecos), len(self._huecos)
+                )
+                for fila in tardios:
+                    del self._huecos[fila["id"]]
+                    self.contadores["recuperados_tarde"] += 1
+                    self._publicar(_evento(fila))
+            while True:
+                filas = await conn.fetch(SQL_CAMBIOS.format(condicion="id > $1"), self.ultimo_id, CAMBIOS_LOTE)
+                self.contadores["lecturas"] += 1
+                for fila in filas:
+                    if len(self._huecos) < MAX_HUECOS:
+                        for faltante in range(self.ultimo_id + 1, min(fila["id"], self.ultimo_id + 1 + MAX_HUECOS)):
+                            self._huecos[faltante] = ahora
+                    self.ultimo_id = fila["id"]
+                    self._publicar(_evento(fila))
+                if len(filas) < CAMBIOS_LOTE:
+                    break
+
+    def _publicar(self, evento: dict):
+        self.contadores["eventos"] += 1
+        for suscriptor in list(self._suscriptores):
+            try:
+                suscriptor.cola.put_nowait(evento)
+            except asyncio.QueueFull:
+                # Un cliente lento no frena a los demás: se corta y reanuda con su último id
+                self._suscriptores.discard(suscriptor)
+                suscriptor.desbordado = True
+                self.contadores["desbordados"] += 1
+
+    async def _limpiar(self):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "DELETE FROM personas_cambios WHERE fecha < NOW() - make_interval(days => $1)",
+                CAMBIOS_RETENCION_DIAS
+            )
+
+    async def historial(self, desde: int, hasta: int) -> AsyncIterator[dict]:
+        """Cambios con ``desde < id <= hasta``, por lotes."""
+        while desde < hasta:
+            async with self.pool.acquire() as conn:
+                filas = await conn.fetch(
+                    SQL_CAMBIOS.format(condicion="id > $1 AND id <= $3"), desde, CAMBIOS_LOTE, hasta
+                )
+            if not filas:
+                return
+            for fila in filas:
+                yield _evento(fila)
+            desde = filas[-1]["id"]
+
+    async def eventos(self, desde: Optional[int]) -> AsyncIterator[Optional[dict]]:
+        """Historial desde ``desde`` seguido de los cambios en vivo; ``None``
+        cada ``CAMBIOS_LATIDO`` segundos sin cambios (para el latido SSE)."""
+        # Suscribirse y fijar el corte sin ceder el control: ningún cambio se pierde
+        suscriptor = self.suscribir()
+        corte = self.ultimo_id
+        try:
+            if desde is not None:
+                async for evento in self.historial(desde, corte):
+                    yield evento
+            while True:
+                if suscriptor.desbordado and suscriptor.cola.empty():
+                    raise _Desbordado()
+                try:
+                    evento = await asyncio.wait_for(suscriptor.cola.get(), timeout=CAMBIOS_LATIDO)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                eventos_entregados.inc()
+                yield evento
+        finally:
+            self.cancelar(suscriptor)
+
+    def estadisticas(self) -> dict:
+        return {**self.contadores, "ultimo_id": self.ultimo_id, "suscriptores": len(self._suscriptores),
+                "huecos_pendientes": len(self._huecos)}
+
+
+async def stream_sse(hub: HubCambios, desde: Optional[int]) -> AsyncIterator[bytes]:
+    """Formato Server-Sent Events; el ``id`` de cada evento sirve de
+    ``Last-Event-ID`` para reanudar."""
+    yield b"retry: 2000\n\n"
+    try:
+        async for evento in hub.eventos(desde):
+            if evento is None:
+                yield b": latido\n\n"
+                continue
+            yield b"id: %d\nevent: cambio\ndata: %s\n\n" % (evento["id"], codificar(evento))
+    except _Desbordado:
+        yield b"event: desbordado\ndata: {}\n\n"
@@ -0,0 +1,215 @@
+"""Almacén de fotos de personas direccionado por contenido.
+
+Los bytes se guardan en disco bajo ``FOTOS_DIR`` con su SHA-256 como nombre
+(``ab/cd/abcd...``); la tabla ``personas_fotos`` solo guarda el hash y los
+metadatos, así las consultas de personas nunca cargan imágenes. El mismo
+contenido subido dos veces ocupa un solo archivo. Las miniaturas se generan
+con Pillow en un pool de procesos y se guardan junto al original.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+
+FOTOS_DIR = os.getenv("FOTOS_DIR", "/datos/fotos")
+FOTOS_MAX_BYTES = int(os.getenv("FOTOS_MAX_BYTES", str(10 * 1024 * 1024)))
+FOTOS_PROCESOS = int(os.getenv("FOTOS_PROCESOS", "2"))
+TAMANOS_MINIATURA = tuple(int(t) for t in os.getenv("FOTOS_MINIATURAS", "64,256,512").split(","))
+TAM_BLOQUE = 64 * 1024
+LOTE_MIGRACION = 50
+
+_RANGO = re.compile(r"bytes=(\d*)-(\d*)$")
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+class FotoInvalida(Exception):
+    """El contenido no es una imagen soportada."""
+
+
+class FotoDemasiadoGrande(Exception):
+    """El contenido supera ``FOTOS_MAX_BYTES``."""
+
+
+def ruta_blob(hash_: str, sufijo: str = "") -> str:
+    return os.path.join(FOTOS_DIR, hash_[:2], hash_[2:4], hash_ + sufijo)
+
+
+def ruta_miniatura(hash_: str, tam: int) -> str:
+    return ruta_blob(hash_, f"_{tam}.jpg")
+
+
+def detectar_tipo(cabecera: bytes) -> Optional[str]:
+    """Tipo de imagen según los primeros bytes, sin fiarse del Content-Type."""
+    if cabecera.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if cabecera.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if cabecera[:4] == b"RIFF" and cabecera[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+async def guardar_stream(partes: AsyncIterator[bytes], exigir_imagen: bool = True) -> Tuple[str, int, Optional[str]]:
+    """Escribe el stream en un temporal calculando el SHA-256 y lo mueve a su
+    ruta definitiva. Devuelve ``(hash, tamaño, tipo)``."""
+    loop = asyncio.get_running_loop()
+    os.makedirs(FOTOS_DIR, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=FOTOS_DIR, suffix=".tmp")
+    archivo = os.fdopen(descriptor, "wb")
+    resumen = hashlib.sha256()
+    tamano = 0
+    cabecera = b""
+
+    def escribir(datos: bytes):
+        resumen.update(datos)
+        archivo.write(datos)
+
+    try:
+        async for parte in partes:
+            if not parte:
+                continue
+            tamano += len(parte)
+            if tamano > FOTOS_MAX_BYTES:
+                raise FotoDemasiadoGrande(f"La foto supera {FOTOS_MAX_BYTES} bytes")
+            if len(cabecera) < 16:
+                cabecera += parte[:16]
+            await loop.run_in_executor(None, escribir, parte)
+        archivo.close()
+
+        tipo = detectar_tipo(cabecera)
+        if tipo is None and exigir_imagen:
+            raise FotoInvalida("El contenido no es una imagen JPEG, PNG o WebP")
+        hash_ = resumen.hexdigest()
+        destino = ruta_blob(hash_)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        # Mismo contenido, mismo nombre: reemplazar es idempotente
+        os.replace(temporal, destino)
+        return hash_, tamano, tipo
+    except BaseException:
+        archivo.close()
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def interpretar_rango(cabecera: Optional[str], tamano: int) -> Optional[Tuple[int, int]]:
+    """``(inicio, fin)`` inclusivo de un encabezado ``Range`` de un solo rango.
+    Devuelve ``None`` si no hay rango utilizable (se envía el archivo completo)
+    y lanza ``ValueError`` si el rango no es satisfacible."""
+    if not cabecera:
+        return None
+    coincidencia = _RANGO.match(cabecera.strip())
+    if not coincidencia or coincidencia.group(1) == coincidencia.group(2) == "":
+        return None
+    desde, hasta = coincidencia.groups()
+    if desde == "":
+        # Sufijo: los últimos N bytes
+        inicio, fin = max(0, tamano - int(hasta)), tamano - 1
+    else:
+        inicio = int(desde)
+        fin = min(int(hasta), tamano - 1) if hasta else tamano - 1
+    if inicio >= tamano or inicio > fin:
+        raise ValueError("Rango no satisfacible")
+    return inicio, fin
+
+
+async def leer(ruta: str, inicio: int = 0, fin: Optional[int] = None):
+    """Lee ``ruta`` por bloques entre ``inicio`` y ``fin`` (inclusivo)."""
+    loop = asyncio.get_running_loop()
+    archivo = open(ruta, "rb")
+    try:
+        archivo.seek(inicio)
+        restante = (fin if fin is not None else os.path.getsize(ruta) - 1) - inicio + 1
+        while restante > 0:
+            datos = await loop.run_in_executor(None, archivo.read, min(TAM_BLOQUE, restante))
+            if not datos:
+                break
+            restante -= len(datos)
+            yield datos
+    finally:
+        archivo.close()
+
+
+def _crear_miniaturas(hash_: str, tamanos: Tuple[int, ...]) -> List[int]:
+    """Se ejecuta en un proceso del pool: el redimensionado es CPU."""
+    from PIL import Image, ImageOps  # dependencia opcional
+
+    with Image.open(ruta_blob(hash_)) as original:
+        imagen = ImageOps.exif_transpose(original).convert("RGB")
+    for tam in tamanos:
+        destino = ruta_miniatura(hash_, tam)
+        if os.path.exists(destino):
+            continue
+        copia = imagen.copy()
+        copia.thumbnail((tam, tam))
+        temporal = f"{destino}.{os.getpid()}.tmp"
+        copia.save(temporal, "JPEG", quality=85)
+        os.replace(temporal, destino)
+    return list(tamanos)
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=FOTOS_PROCESOS)
+    return _executor
+
+
+async def generar_miniaturas(hash_: str, tamanos: Tuple[int, ...] = TAMANOS_MINIATURA) -> List[int]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool(), _crear_miniaturas, hash_, tamanos)
+
+
+async def generar_miniaturas_en_segundo_plano(hash_: str):
+    try:
+        await generar_miniaturas(hash_)
+    except Exception as e:
+        print(f"Error generando miniaturas de {hash_}: {e}")
+
+
+async def miniatura(hash_: str, tam: int) -> str:
+    """Ruta de la miniatura; la genera si todavía no existe."""
+    destino = ruta_miniatura(hash_, tam)
+    if not os.path.exists(destino):
+        await generar_miniaturas(hash_, (tam,))
+    return destino
+
+
+def cerrar():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _un_bloque(datos: bytes):
+    yield datos
+
+
+async def migrar_fotos_legadas(pool) -> int:
+    """Mueve al almacén las fotos que aún estén en ``personas.foto``."""
+    migradas = 0
+    while True:
+        async with pool.acquire() as conn:
+            filas = await conn.fetch(
+                "SELECT numero_documento, foto FROM personas WHERE foto IS NOT NULL LIMIT $1",
+                LOTE_MIGRACION
+            )
+            if not filas:
+                return migradas
+            for fila in filas:
+                hash_, tamano, tipo = await guardar_stream(_un_bloque(fila["foto"]), exigir_imagen=False)
+                async with conn.transaction():
+                    await conn.execute(
+                        """INSERT INTO personas_fotos (numero_documento, hash, tamano, tipo_contenido)
+                           VALUES ($1, $2, $3, $4)
+                           ON CONFLICT (numero_documento) DO NOTHING""",
+                        fila["numero_documento"], hash_, tamano, tipo or "application/octet-stream"
+                    )
+                    await conn.execute(
+                        "UPDATE personas SET foto = NULL WHERE numero_documento = $1", fila["numero_documento"]
+                    )
+                migradas += 1
@@ -1,32 +1,121 @@
  
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Response, Request, BackgroundTasks, Body, Header
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr, validator, Field
-from typing import Optional, Literal
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, EmailStr, validator, Field, ValidationError
+from typing import Optional, Literal, Iterator, List
 from datetime import date, datetime
-import asyncpg
 import os
+import io
+import csv
 import json
+import asyncio
 from contextlib import asynccontextmanager
+import fotos
+import cambios
+from common.cache_personas import CacheLectura, crear_cache_compartido
+from common.log_sink import LogSink
+from common.admision import Limite, instalar_admision
+from common.auth import instalar_auth
+from common.condicional import respuesta_condicional
+from common.db import DATABASE_URL_DIRECTA, consulta_preparada, crear_pool, sentencia
+from common.metricas import PoolAgotado, instalar_metricas
+from common.replicas import CABECERA_CONSISTENCIA, instalar_replicas
+from common.serializacion import RespuestaJSONRapida, codificar_filas, columnas_proyectadas
+from common.streaming import respuesta_ndjson
 
 # Pool de conexiones global
 db_pool = None
+# Reparte el feed de cambios a los streams de /personas/changes
+hub_cambios = None
+log_sink = LogSink()
+cache_personas = CacheLectura("persona", compartido=crear_cache_compartido())
+
+# Columnas que se devuelven en listados (la foto se sirve en /personas/{doc}/foto)
+CAMPOS_LISTADO = ("id", "tipo_documento", "numero_documento", "primer_nombre", "segundo_nombre",
+                  "apellidos", "fecha_nacimiento", "genero", "correo_electronico", "celular",
+                  "created_at", "updated_at")
+COLUMNAS_PERSONA = ", ".join(CAMPOS_LISTADO)
+LIMITE_PAGINA = 100
+LIMITE_PAGINA_MAX = 1000
+
+# Carga masiva
+CAMPOS_PERSONA = ["tipo_documento", "numero_documento", "primer_nombre", "segundo_nombre",
+                  "apellidos", "fecha_nacimiento", "genero", "correo_electronico", "celular"]
+TAM_LOTE_BULK = int(os.getenv("BULK_TAM_LOTE", "5000"))
+MAX_ERRORES_REPORTE = 1000
+
+# Actualización por lotes
+CAMPOS_ACTUALIZABLES = [c for c in CAMPOS_PERSONA if c != "numero_documento"]
+CAMPOS_NULABLES = {"segundo_nombre"}
+MAX_ITEMS_PATCH = int(os.getenv("PATCH_MAX_ITEMS", "5000"))
+
+# Consultas calientes, preparadas en cada conexión del pool. El listado tiene
+# una variante por caso: con "$1 IS NULL OR id < $1" el plan genérico de la
+# sentencia preparada no puede usar el índice de forma óptima
+PERSONA_POR_DOCUMENTO = consulta_preparada(
+    "persona_por_documento",
+    f"SELECT {COLUMNAS_PERSONA} FROM personas WHERE numero_documento = $1"
+)
+LISTADO_INICIO = consulta_preparada(
+    "personas_listado_inicio",
+    f"SELECT {COLUMNAS_PERSONA} FROM personas ORDER BY id DESC LIMIT $1"
+)
+LISTADO_DESDE_CURSOR = consulta_preparada(
+    "personas_listado_cursor",
+    f"SELECT {COLUMNAS_PERSONA} FROM personas WHERE id < $2 ORDER BY id DESC LIMIT $1"
+)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global db_pool
+    global db_pool, hub_cambios
     DATABASE_URL = os.getenv("DATABASE_URL")
     print(f"Conectando a la base de datos: {DATABASE_URL}")
     try:
-        db_pool = await asyncpg.create_pool(DATABASE_URL, min_size=2, max_size=10)
+        db_pool = await crear_pool(aplicacion="personas")
+        log_sink.iniciar(db_pool)
+        # LISTEN necesita una sesión propia, fuera del pooler
+        cache_personas.iniciar_escucha(DATABASE_URL_DIRECTA)
+        hub_cambios = cambios.HubCambios(db_pool)
+        await hub_cambios.iniciar()
+        asyncio.create_task(migrar_fotos())
         print("Pool de conexiones creado exitosamente")
     except Exception as e:
         print(f"Error al crear pool: {e}")
     yield
+    if verificador:
+        await verificador.detener()
+    fotos.cerrar()
+    if hub_cambios:
+        await hub_cambios.detener()
+    await cache_personas.detener()
+    await log_sink.detener()
     if db_pool:
         await db_pool.close()
 
+async def migrar_fotos():
+    try:
+        migradas = await fotos.migrar_fotos_legadas(db_pool)
+        if migradas:
+            print(f"Fotos migradas al almacén: {migradas}")
+    except Exception as e:
+        print(f"Error migrando fotos: {e}")
+
 app = FastAPI(title="Personas Service", lifespan=lifespan)
+# Límites por cliente y ruta (sobrescribibles con LIMITES_RUTAS); dentro de
+# la autenticación para identificar al cliente por su token
+admision = instalar_admision(app, "personas", {
+    "POST /personas/bulk": Limite(tasa=0.2, rafaga=2, concurrencia=2),
+    "PATCH /personas/batch": Limite(tasa=1, rafaga=5, concurrencia=2),
+    "GET /personas/": Limite(tasa=10, rafaga=20, concurrencia=6),
+    "PUT /personas/{numero_documento}/foto": Limite(tasa=1, rafaga=5, concurrencia=4),
+})
+# Antes de CORS: las respuestas 401 también llevan las cabeceras CORS
+# El feed de cambios lo abre un EventSource, que no puede enviar cabeceras
+verificador = instalar_auth(app, token_en_consulta=("/personas/changes",))
+# Con réplicas configuradas, cada escritura devuelve X-Token-Consistencia
+instalar_replicas(app, primario=lambda: db_pool)
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,7 +123,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Siguiente-Cursor", CABECERA_CONSISTENCIA],
 )
+instalar_metricas(app, "personas")
 
 # Modelos Pydantic
 class PersonaBase(BaseModel):
@@ -60,6 +151,16 @@ class PersonaBase(BaseModel):
             raise ValueError('Los nombres no pueden contener números')
         return v
 
+class PersonaParcial(PersonaBase):
+    """Actualización parcial: solo ``numero_documento`` es obligatorio."""
+    tipo_documento: Optional[Literal["Tarjeta de identidad", "Cédula"]] = None
+    primer_nombre: Optional[str] = Field(None, max_length=30)
+    apellidos: Optional[str] = Field(None, max_length=60)
+    fecha_nacimiento: Optional[date] = None
+    genero: Optional[Literal["Masculino", "Femenino", "No binario", "Prefiero no reportar"]] = None
+    correo_electronico: Optional[EmailStr] = None
+    celular: Optional[str] = Field(None, pattern="^[0-9]{10}$")
+
 class PersonaResponse(PersonaBase):
     id: int
     created_at: datetime
@@ -73,70 +174,310 @@ class PersonaResponse(PersonaBase):
 
 # Función auxiliar para logs
 async def registrar_log(tipo: str, documento: str, detalles: dict):
-    if db_pool:
-        async with db_pool.acquire() as conn:
-            await conn.execute(
-                """INSERT INTO logs (tipo_operacion, numero_documento, detalles) 
-                   VALUES ($1, $2, $3::jsonb)""",
-                tipo, documento, json.dumps(detalles)
-            )
+    # Se encola; el flusher del sink lo escribe por lotes fuera del hot path
+    await log_sink.registrar(tipo, documento, detalles)
 
 # Endpoints
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "personas"}
+    return {
+        "status": "healthy",
+        "service": "personas",
+        "cache": cache_personas.estadisticas(),
+        "log_sink": log_sink.estadisticas(),
+        "admision": admision.estadisticas(),
+        "cambios": hub_cambios.estadisticas() if hub_cambios else None
+    }
+
+# Cada campo lleva una bandera: solo se escriben los que vienen en el item
+SQL_ACTUALIZACION_PARCIAL = "UPDATE personas SET {}, updated_at = CURRENT_TIMESTAMP WHERE numero_documento = $1".format(
+    ", ".join(f"{c} = CASE WHEN ${2 * i + 2} THEN ${2 * i + 3} ELSE {c} END" for i, c in enumerate(CAMPOS_ACTUALIZABLES))
+)
 
 @app.post("/personas/", response_model=PersonaResponse)
-async def crear_persona(persona: PersonaBase):
+async def crear_persona(
+    persona: PersonaBase,
+    upsert: bool = Query(False, description="Si el documento existe, lo actualiza en vez de rechazarlo")
+):
     if not db_pool:
         raise HTTPException(status_code=500, detail="Database connection not available")
     
+    # Una sola sentencia: ON CONFLICT evita la carrera entre comprobar e insertar
+    if upsert:
+        conflicto = "DO UPDATE SET {}, updated_at = CURRENT_TIMESTAMP".format(
+            ", ".join(f"{c} = EXCLUDED.{c}" for c in CAMPOS_ACTUALIZABLES)
+        )
+    else:
+        conflicto = "DO NOTHING"
+    
     try:
         async with db_pool.acquire() as conn:
-            # Verificar si ya existe
-            existing = await conn.fetchval(
-                "SELECT id FROM personas WHERE numero_documento = $1",
-                persona.numero_documento
-            )
-            if existing:
-                raise HTTPException(status_code=400, detail="El documento ya existe")
-            
-            # Insertar persona
             result = await conn.fetchrow(
-                """INSERT INTO personas 
-                   (tipo_documento, numero_documento, primer_nombre, segundo_nombre,
-                    apellidos, fecha_nacimiento, genero, correo_electronico, celular)
+                f"""INSERT INTO personas ({", ".join(CAMPOS_PERSONA)})
                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                   RETURNING *""",
-                persona.tipo_documento, persona.numero_documento, persona.primer_nombre,
-                persona.segundo_nombre, persona.apellidos, persona.fecha_nacimiento,
-                persona.genero, persona.correo_electronico, persona.celular
+                   ON CONFLICT (numero_documento) {conflicto}
+                   RETURNING {COLUMNAS_PERSONA}, (xmax = 0) AS insertada""",
+                *(getattr(persona, c) for c in CAMPOS_PERSONA)
             )
-            
-            await registrar_log("CREATE", persona.numero_documento, {"accion": "Persona creada"})
-            return PersonaResponse(**dict(result))
-            
-    except HTTPException:
+    except PoolAgotado:
         raise
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    if not result:
+        raise HTTPException(status_code=400, detail="El documento ya existe")
+    
+    datos = dict(result)
+    insertada = datos.pop("insertada")
+    await cache_personas.invalidar(persona.numero_documento)
+    if insertada:
+        await registrar_log("CREATE", persona.numero_documento, {"accion": "Persona creada"})
+    else:
+        await registrar_log("UPDATE", persona.numero_documento, {"accion": "Persona actualizada (upsert)"})
+    return PersonaResponse(**datos)
 
-@app.get("/personas/{numero_documento}", response_model=PersonaResponse)
-async def obtener_persona(numero_documento: str):
+@app.patch("/personas/batch")
+async def actualizar_personas_lote(actualizaciones: List[dict] = Body(...)):
+    """Aplica actualizaciones parciales a muchos documentos en una transacción.
+
+    Cada item lleva ``numero_documento`` y solo los campos a cambiar. Los items
+    inválidos o de documentos inexistentes se reportan sin afectar al resto.
+    """
     if not db_pool:
         raise HTTPException(status_code=500, detail="Database connection not available")
+    if len(actualizaciones) > MAX_ITEMS_PATCH:
+        raise HTTPException(status_code=413, detail=f"Máximo {MAX_ITEMS_PATCH} actualizaciones por petición")
+    
+    resultados = []
+    validas = []
+    for indice, item in enumerate(actualizaciones):
+        resultado = {"indice": indice, "numero_documento": item.get("numero_documento")}
+        resultados.append(resultado)
+        try:
+            parcial = PersonaParcial(**item)
+        except ValidationError as e:
+            resultado["estado"] = "invalida"
+            resultado["errores"] = [f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()]
+            continue
+        campos = parcial.model_fields_set - {"numero_documento"}
+        nulos = sorted(c for c in campos if getattr(parcial, c) is None and c not in CAMPOS_NULABLES)
+        if nulos or not campos:
+            resultado["estado"] = "invalida"
+            resultado["errores"] = [f"{c}: no puede ser nulo" for c in nulos] or ["Sin campos para actualizar"]
+            continue
+        argumentos = [parcial.numero_documento]
+        for c in CAMPOS_ACTUALIZABLES:
+            argumentos.extend((c in campos, getattr(parcial, c)))
+        validas.append((resultado, argumentos))
     
+    documentos = sorted({argumentos[0] for _, argumentos in validas})
     async with db_pool.acquire() as conn:
-        result = await conn.fetchrow(
-            "SELECT * FROM personas WHERE numero_documento = $1",
-            numero_documento
-        )
-        if not result:
-            raise HTTPException(status_code=404, detail="Persona no encontrada")
-        
-        await registrar_log("READ", numero_documento, {"accion": "Consulta realizada"})
-        return PersonaResponse(**dict(result))
+        async with conn.transaction():
+            # Bloquea las filas en orden fijo: dos lotes concurrentes no se interbloquean
+            existentes = {r["numero_documento"] for r in await conn.fetch(
+                """SELECT numero_documento FROM personas
+                   WHERE numero_documento = ANY($1::varchar[])
+                   ORDER BY numero_documento FOR UPDATE""",
+                documentos
+            )}
+            filas = [argumentos for _, argumentos in validas if argumentos[0] in existentes]
+            if filas:
+                await conn.executemany(SQL_ACTUALIZACION_PARCIAL, filas)
+    
+    for resultado, argumentos in validas:
+        resultado["estado"] = "actualizada" if argumentos[0] in existentes else "no_encontrada"
+    
+    actualizados = sorted(existentes)
+    if actualizados:
+        await cache_personas.invalidar(*actualizados)
+    resumen = {
+        "procesadas": len(resultados),
+        "actualizadas": sum(r["estado"] == "actualizada" for r in resultados),
+        "no_encontradas": sum(r["estado"] == "no_encontrada" for r in resultados),
+        "invalidas": sum(r["estado"] == "invalida" for r in resultados),
+    }
+    await registrar_log("BATCH_UPDATE", None, {"accion": "Actualización por lotes", **resumen})
+    return {**resumen, "resultados": resultados}
+
+def leer_registros(archivo: UploadFile, formato: str) -> Iterator[dict]:
+    """Itera los registros del archivo subido sin cargarlo entero en memoria."""
+    texto = io.TextIOWrapper(archivo.file, encoding="utf-8-sig", newline="")
+    if formato == "csv":
+        for fila in csv.DictReader(texto):
+            # En CSV los campos vacíos se interpretan como nulos
+            yield {k: (v if v != "" else None) for k, v in fila.items() if k}
+    else:
+        for linea in texto:
+            if not linea.strip():
+                continue
+            try:
+                yield json.loads(linea)
+            except ValueError as e:
+                # Una línea corrupta se reporta sin cortar la lectura
+                yield e
+
+def validar_lote(registros: Iterator[dict], inicio: int, tamano: int):
+    """Valida hasta ``tamano`` registros; devuelve filas para COPY, errores y
+    cuántos registros se leyeron."""
+    validas, errores = [], []
+    leidas = 0
+    while leidas < tamano:
+        try:
+            registro = next(registros)
+        except StopIteration:
+            break
+        except (ValueError, csv.Error) as e:
+            # Error de lectura del archivo: no se puede continuar
+            errores.append({"fila": inicio + leidas, "errores": [str(e)]})
+            break
+        fila = inicio + leidas
+        leidas += 1
+        if isinstance(registro, Exception):
+            errores.append({"fila": fila, "errores": [str(registro)]})
+            continue
+        try:
+            persona = PersonaBase(**registro)
+        except ValidationError as e:
+            errores.append({
+                "fila": fila,
+                "errores": [f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()]
+            })
+            continue
+        except TypeError as e:
+            errores.append({"fila": fila, "errores": [str(e)]})
+            continue
+        validas.append((fila, *(getattr(persona, c) for c in CAMPOS_PERSONA)))
+    return validas, errores, leidas
+
+@app.post("/personas/bulk")
+async def importar_personas(
+    archivo: UploadFile = File(...),
+    formato: Optional[Literal["csv", "ndjson"]] = Query(None)
+):
+    """Importación masiva desde CSV o NDJSON.
+
+    Los registros se validan por lotes, se cargan con COPY en una tabla
+    temporal y se fusionan en ``personas`` en una sola transacción. Los
+    documentos ya existentes o repetidos en el archivo se reportan por fila.
+    """
+    if not db_pool:
+        raise HTTPException(status_code=500, detail="Database connection not available")
+    
+    if formato is None:
+        nombre = (archivo.filename or "").lower()
+        formato = "ndjson" if nombre.endswith((".ndjson", ".jsonl")) or "ndjson" in (archivo.content_type or "") else "csv"
+    
+    registros = leer_registros(archivo, formato)
+    errores = []
+    procesadas = 0
+    cargadas = 0
+    
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("""
+                CREATE TEMP TABLE personas_staging (
+                    fila INT NOT NULL,
+                    tipo_documento VARCHAR(20), numero_documento VARCHAR(10),
+                    primer_nombre VARCHAR(30), segundo_nombre VARCHAR(30),
+                    apellidos VARCHAR(60), fecha_nacimiento DATE, genero VARCHAR(20),
+                    correo_electronico VARCHAR(100), celular VARCHAR(10)
+                ) ON COMMIT DROP
+            """)
+            
+            while True:
+                # La validación con Pydantic es CPU; se hace fuera del event loop
+                validas, errores_lote, leidas = await run_in_threadpool(
+                    validar_lote, registros, procesadas + 1, TAM_LOTE_BULK
+                )
+                procesadas += leidas
+                errores.extend(errores_lote)
+                cargadas += len(validas)
+                if validas:
+                    await conn.copy_records_to_table(
+                        "personas_staging", records=validas, columns=["fila", *CAMPOS_PERSONA]
+                    )
+                if leidas < TAM_LOTE_BULK:
+                    break
+            
+            # Lo que ya existía se deduce de lo que el INSERT no devolvió: sin
+            # una consulta previa que otra transacción pueda adelantar. Cada
+            # fila rechazada se reporta una sola vez: la primera aparición de
+            # un documento existente como tal y las siguientes como repetidas
+            rechazadas = await conn.fetch(f"""
+                WITH insertadas AS (
+                    INSERT INTO personas ({", ".join(CAMPOS_PERSONA)})
+                    SELECT DISTINCT ON (numero_documento) {", ".join(CAMPOS_PERSONA)}
+                    FROM personas_staging
+                    ORDER BY numero_documento, fila
+                    ON CONFLICT (numero_documento) DO NOTHING
+                    RETURNING numero_documento
+                )
+                SELECT fila, n > 1 AS repetida FROM (
+                    SELECT fila, numero_documento,
+                           row_number() OVER (PARTITION BY numero_documento ORDER BY fila) AS n
+                    FROM personas_staging
+                ) s
+                WHERE n > 1 OR NOT EXISTS (
+                    SELECT 1 FROM insertadas i WHERE i.numero_documento = s.numero_documento
+                )
+            """)
+    
+    errores.extend({
+        "fila": r["fila"],
+        "errores": ["numero_documento: repetido en el archivo" if r["repetida"] else "numero_documento: El documento ya existe"]
+    } for r in rechazadas)
+    errores.sort(key=lambda e: e["fila"])
+    insertadas = cargadas - len(rechazadas)
+    
+    resumen = {"procesadas": procesadas, "insertadas": insertadas, "rechazadas": procesadas - insertadas}
+    await registrar_log("BULK_CREATE", None, {"accion": "Importación masiva", "formato": formato, **resumen})
+    return {
+        **resumen,
+        "errores": errores[:MAX_ERRORES_REPORTE],
+        "errores_truncados": len(errores) > MAX_ERRORES_REPORTE
+    }
+
+@app.get("/personas/changes")
+async def feed_cambios(
+    desde: Optional[int] = Query(None, description="Reanuda después de este id de cambio"),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")
+):
+    """Server-Sent Events con cada alta, modificación y baja de personas.
+    Sin ``desde`` solo llegan los cambios nuevos; al reconectar, el navegador
+    envía ``Last-Event-ID`` y el feed continúa desde ahí."""
+    if not hub_cambios:
+        raise HTTPException(status_code=500, detail="Database connection not available")
+    if last_event_id and last_event_id.isdigit():
+        desde = int(last_event_id)
+    return StreamingResponse(
+        cambios.stream_sse(hub_cambios, desde),
+        media_type="text/event-stream",
+        # Sin buffering en nginx para que cada evento salga al instante
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/personas/{numero_documento}", response_model=PersonaResponse)
+async def obtener_persona(numero_documento: str, request: Request):
+    """Con ``ETag`` y ``Last-Modified`` (de ``updated_at``): si el cliente ya
+    tiene la versión actual recibe un 304 sin cuerpo. La lectura se registra
+    igual, por eso el gateway no guarda esta ruta."""
+    if not db_pool:
+        raise HTTPException(status_code=500, detail="Database connection not available")
+    
+    async def cargar():
+        async with db_pool.acquire() as conn:
+            result = await sentencia(conn, PERSONA_POR_DOCUMENTO).fetchrow(numero_documento)
+            return dict(result) if result else None
+    
+    # Caché de lectura; las escrituras la invalidan vía trigger + NOTIFY
+    result = await cache_personas.obtener(numero_documento, cargar)
+    if not result:
+        raise HTTPException(status_code=404, detail="Persona no encontrada")
+    
+    await registrar_log("READ", numero_documento, {"accion": "Consulta realizada"})
+    persona = PersonaResponse(**result)
+    return respuesta_condicional(request, persona.model_dump(mode="json"), ultima_modificacion=persona.updated_at)
 
 @app.put("/personas/{numero_documento}", response_model=PersonaResponse)
 async def actualizar_persona(numero_documento: str, persona: PersonaBase):
@@ -145,12 +486,12 @@ async def actualizar_persona(numero_documento: str, persona: PersonaBase):
     
     async with db_pool.acquire() as conn:
         result = await conn.fetchrow(
-            """UPDATE personas 
+            f"""UPDATE personas 
                SET tipo_documento=$1, primer_nombre=$2, segundo_nombre=$3,
                    apellidos=$4, fecha_nacimiento=$5, genero=$6,
                    correo_electronico=$7, celular=$8, updated_at=CURRENT_TIMESTAMP
                WHERE numero_documento=$9
-               RETURNING *""",
+               RETURNING {COLUMNAS_PERSONA}""",
             persona.tipo_documento, persona.primer_nombre, persona.segundo_nombre,
             persona.apellidos, persona.fecha_nacimiento, persona.genero,
             persona.correo_electronico, persona.celular, numero_documento
@@ -158,6 +499,8 @@ async def actualizar_persona(numero_documento: str, persona: PersonaBase):
         if not result:
             raise HTTPException(status_code=404, detail="Persona no encontrada")
         
+        # Invalidación local inmediata; las demás réplicas la reciben por NOTIFY
+        await cache_personas.invalidar(numero_documento)
         await registrar_log("UPDATE", numero_documento, {"accion": "Persona actualizada"})
         return PersonaResponse(**dict(result))
 
@@ -174,15 +517,163 @@ async def eliminar_persona(numero_documento: str):
         if result == "DELETE 0":
             raise HTTPException(status_code=404, detail="Persona no encontrada")
         
+        await cache_personas.invalidar(numero_documento)
         await registrar_log("DELETE", numero_documento, {"accion": "Persona eliminada"})
         return {"message": "Persona eliminada exitosamente"}
 
+@app.put("/personas/{numero_documento}/foto")
+async def subir_foto(numero_documento: str, request: Request, background_tasks: BackgroundTasks):
+    """Recibe la imagen como cuerpo binario, en streaming, y la guarda en el
+    almacén por contenido. Las miniaturas se generan después de responder."""
+    if not db_pool:
+        raise HTTPException(status_code=500, detail="Database connection not available")
+    
+    longitud = request.headers.get("content-length")
+    if longitud and longitud.isdigit() and int(longitud) > fotos.FOTOS_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"La foto supera {fotos.FOTOS_MAX_BYTES} bytes")
+    
+    async with db_pool.acquire() as conn:
+        if not await conn.fetchval("SELECT 1 FROM personas WHERE numero_documento = $1", numero_documento):
+            raise HTTPException(status_code=404, detail="Persona no encontrada")
+    
+    try:
+        hash_, tamano, tipo = await fotos.guardar_stream(request.stream())
+    except fotos.FotoDemasiadoGrande as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except fotos.FotoInvalida as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            """INSERT INTO personas_fotos (numero_documento, hash, tamano, tipo_contenido)
+               VALUES ($1, $2, $3, $4)
+               ON CONFLICT (numero_documento) DO UPDATE
+               SET hash = EXCLUDED.hash, tamano = EXCLUDED.tamano,
+                   tipo_contenido = EXCLUDED.tipo_contenido, actualizada = CURRENT_TIMESTAMP""",
+            numero_documento, hash_, tamano, tipo
+        )
+    
+    background_tasks.add_task(fotos.generar_miniaturas_en_segundo_plano, hash_)
+    await registrar_log("FOTO", numero_documento, {"accion": "Foto actualizada", "bytes": tamano})
+    return {
+        "numero_documento": numero_documento,
+        "hash": hash_,
+        "tamano": tamano,
+        "tipo_contenido": tipo,
+        "miniaturas": list(fotos.TAMANOS_MINIATURA)
+    }
+
+@app.get("/personas/{numero_documento}/foto")
+async def obtener_foto(
+    numero_documento: str,
+    request: Request,
+    tam: Optional[int] = Query(None, description="Lado de la miniatura en píxeles")
+):
+    """Sirve la foto o una miniatura en streaming, con ETag y rangos de bytes."""
+    if not db_pool:
+        raise HTTPException(status_code=500, detail="Database connection not available")
+    
+    async with db_pool.acquire() as conn:
+        foto = await conn.fetchrow(
+            "SELECT hash, tipo_contenido FROM personas_fotos WHERE numero_documento = $1",
+            numero_documento
+        )
+    if not foto:
+        raise HTTPException(status_code=404, detail="La persona no tiene foto")
+    
+    if tam is None:
+        ruta, tipo, etag = fotos.ruta_blob(foto["hash"]), foto["tipo_contenido"], f'"{foto["hash"]}"'
+    elif tam in fotos.TAMANOS_MINIATURA:
+        try:
+            ruta = await fotos.miniatura(foto["hash"], tam)
+        except Exception as e:
+            print(f"Error generando miniatura: {e}")
+            raise HTTPException(status_code=503, detail="Miniatura no disponible")
+        tipo, etag = "image/jpeg", f'"{foto["hash"]}-{tam}"'
+    else:
+        raise HTTPException(status_code=400, detail=f"Tamaños disponibles: {list(fotos.TAMANOS_MINIATURA)}")
+    
+    if not os.path.exists(ruta):
+        raise HTTPException(status_code=404, detail="Archivo de la foto no encontrado")
+    
+    # El contenido nunca cambia para un mismo hash
+    cabeceras = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "private, max-age=31536000, immutable"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=cabeceras)
+    
+    tamano = os.path.getsize(ruta)
+    rango = None
+    if request.headers.get("if-range", etag) == etag:
+        try:
+            rango = fotos.interpretar_rango(request.headers.get("range"), tamano)
+        except ValueError:
+            return Response(status_code=416, headers={**cabeceras, "Content-Range": f"bytes */{tamano}"})
+    
+    if rango is None:
+        cabeceras["Content-Length"] = str(tamano)
+        return StreamingResponse(fotos.leer(ruta), media_type=tipo, headers=cabeceras)
+    
+    inicio, fin = rango
+    cabeceras["Content-Range"] = f"bytes {inicio}-{fin}/{tamano}"
+    cabeceras["Content-Length"] = str(fin - inicio + 1)
+    return StreamingResponse(fotos.leer(ruta, inicio, fin), status_code=206, media_type=tipo, headers=cabeceras)
+
+@app.delete("/personas/{numero_documento}/foto")
+async def eliminar_foto(numero_documento: str):
+    """Quita la foto de la persona. El archivo se conserva: otro registro
+    puede apuntar al mismo contenido."""
+    if not db_pool:
+        raise HTTPException(status_code=500, detail="Database connection not available")
+    
+    async with db_pool.acquire() as conn:
+        result = await conn.execute("DELETE FROM personas_fotos WHERE numero_documento = $1", numero_documento)
+    if result == "DELETE 0":
+        raise HTTPException(status_code=404, detail="La persona no tiene foto")
+    
+    await registrar_log("FOTO", numero_documento, {"accion": "Foto eliminada"})
+    return {"message": "Foto eliminada exitosamente"}
+
 @app.get("/personas/")
-async def listar_personas():
+async def listar_personas(
+    response: Response,
+    cursor: Optional[int] = Query(None, description="id del último registro de la página anterior"),
+    limite: Optional[int] = Query(None, ge=1),
+    formato: Literal["json", "ndjson"] = Query("json"),
+    campos: Optional[str] = Query(None, alias="fields", description="Columnas separadas por comas"),
+    rapido: bool = Query(False, description="Codifica las filas directamente, sin modelos de respuesta")
+):
+    """Lista personas de la más reciente a la más antigua con paginación keyset
+    sobre ``id``. En formato ``ndjson`` se hace streaming sin límite por defecto.
+    Con ``fields`` o ``rapido`` las filas se codifican sin pasar por Pydantic."""
     if not db_pool:
         raise HTTPException(status_code=500, detail="Database connection not available")
     
+    columnas = ", ".join(columnas_proyectadas(campos, CAMPOS_LISTADO, CAMPOS_LISTADO))
+    # Igual que en las consultas preparadas: una variante con cursor y otra sin él
+    query = f"SELECT {columnas} FROM personas"
+    params = []
+    if cursor is not None:
+        query += " WHERE id < $1"
+        params.append(cursor)
+    query += " ORDER BY id DESC"
+    
+    if formato == "ndjson":
+        if limite:
+            params.append(limite)
+            query += f" LIMIT ${len(params)}"
+        return respuesta_ndjson(db_pool, query, params)
+    
+    limite = min(limite or LIMITE_PAGINA, LIMITE_PAGINA_MAX)
     async with db_pool.acquire() as conn:
-        results = await conn.fetch("SELECT * FROM personas ORDER BY id DESC LIMIT 100")
-        return [PersonaResponse(**dict(r)) for r in results]
- 
+        if campos:
+            results = await conn.fetch(query + f" LIMIT ${len(params) + 1}", *params, limite)
+        elif cursor is None:
+            results = await sentencia(conn, LISTADO_INICIO).fetch(limite)
+        else:
+            results = await sentencia(conn, LISTADO_DESDE_CURSOR).fetch(limite, cursor)
+    
+    siguiente = {"X-Siguiente-Cursor": str(results[-1]["id"])} if len(results) == limite else {}
+    if campos or rapido:
+        return RespuestaJSONRapida(codificar_filas(results), headers=siguiente)
+    response.headers.update(siguiente)
+    return [PersonaResponse(**dict(r)) for r in results]
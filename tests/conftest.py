@@ -0,0 +1,15 @@
+"""Pruebas unitarias de los servicios, sin Docker ni Postgres.
+
+    pip install -r tests/requirements.txt
+    python -m pytest tests
+
+Los servicios importan ``common`` y sus módulos locales por nombre, como en
+sus contenedores; aquí se añaden las mismas rutas.
+"""
+import os
+import sys
+
+RAIZ_SERVICIOS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "services")
+for ruta in (RAIZ_SERVICIOS, os.path.join(RAIZ_SERVICIOS, "nlp")):
+    if ruta not in sys.path:
+        sys.path.insert(0, ruta)
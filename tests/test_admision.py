@@ -0,0 +1,68 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import common.admision as admision
+from common.admision import ControlAdmision, Limite, instalar_admision
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 100.0
+
+    def monotonic(self):
+        return self.ahora
+
+
+def control(monkeypatch, **opciones) -> tuple:
+    reloj = Reloj()
+    monkeypatch.setattr(admision, "time", reloj)
+    return ControlAdmision("prueba", {"GET /x": Limite(tasa=2, rafaga=3)}, **opciones), reloj
+
+
+def test_la_rafaga_se_agota_y_la_cubeta_se_rellena(monkeypatch):
+    limites, reloj = control(monkeypatch)
+    assert [limites.tomar_token("GET /x", "a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Sin tokens: espera hasta el próximo (1 token a 2 por segundo)
+    assert limites.tomar_token("GET /x", "a") == 0.5
+    reloj.ahora += 0.5
+    assert limites.tomar_token("GET /x", "a") == 0.0
+    # Nunca se acumulan más tokens que la ráfaga
+    reloj.ahora += 60
+    assert [limites.tomar_token("GET /x", "a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limites.tomar_token("GET /x", "a") > 0
+
+
+def test_cada_cliente_tiene_su_cubeta(monkeypatch):
+    limites, _ = control(monkeypatch)
+    for _ in range(3):
+        limites.tomar_token("GET /x", "a")
+    assert limites.tomar_token("GET /x", "a") > 0
+    assert limites.tomar_token("GET /x", "b") == 0.0
+
+
+def test_las_cubetas_estan_acotadas(monkeypatch):
+    limites, _ = control(monkeypatch, max_clientes=2)
+    for cliente in ("a", "b", "c"):
+        limites.tomar_token("GET /x", cliente)
+    assert limites.estadisticas()["clientes"] == 2
+
+
+def test_el_middleware_responde_429_con_retry_after():
+    app = FastAPI()
+
+    @app.get("/x")
+    def x():
+        return {"ok": True}
+
+    @app.get("/libre")
+    def libre():
+        return {"ok": True}
+
+    limites = instalar_admision(app, "prueba_http", {"GET /x": Limite(tasa=0.5, rafaga=1)})
+    cliente = TestClient(app)
+    assert cliente.get("/x").status_code == 200
+    rechazo = cliente.get("/x")
+    assert rechazo.status_code == 429
+    assert rechazo.headers["Retry-After"] == "2"
+    assert cliente.get("/libre").status_code == 200
+    assert limites.estadisticas()["rutas"]["GET /x"]["rechazadas_tasa"] == 1
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from common.coalescencia import Coalescedor
+
+
+def test_una_sola_ejecucion_para_peticiones_simultaneas():
+    async def prueba():
+        coalescedor = Coalescedor("prueba_compartida")
+        llamadas = 0
+
+        async def calcular():
+            nonlocal llamadas
+            llamadas += 1
+            await asyncio.sleep(0.05)
+            return "valor"
+
+        resultados = await asyncio.gather(*(coalescedor.ejecutar("k", calcular) for _ in range(5)))
+        assert resultados == ["valor"] * 5
+        assert llamadas == 1
+        assert coalescedor.contadores["lideres"] == 1
+        assert coalescedor.contadores["seguidores"] == 4
+
+    asyncio.run(prueba())
+
+
+def test_la_clave_se_libera_al_terminar():
+    async def prueba():
+        coalescedor = Coalescedor("prueba_libera")
+        llamadas = 0
+
+        async def calcular():
+            nonlocal llamadas
+            llamadas += 1
+            return llamadas
+
+        assert await coalescedor.ejecutar("k", calcular) == 1
+        assert coalescedor.estadisticas()["en_vuelo"] == 0
+        # Nada se guarda: la siguiente petición vuelve a ejecutar
+        assert await coalescedor.ejecutar("k", calcular) == 2
+
+    asyncio.run(prueba())
+
+
+def test_el_error_llega_a_todos_los_que_esperan():
+    async def prueba():
+        coalescedor = Coalescedor("prueba_error")
+
+        async def fallar():
+            await asyncio.sleep(0.02)
+            raise ValueError("sin base")
+
+        resultados = await asyncio.gather(
+            *(coalescedor.ejecutar("k", fallar) for _ in range(3)), return_exceptions=True
+        )
+        assert all(isinstance(r, ValueError) and str(r) == "sin base" for r in resultados)
+        assert coalescedor.contadores["errores"] == 1
+        assert coalescedor.estadisticas()["en_vuelo"] == 0
+
+    asyncio.run(prueba())
+
+
+def test_cancelar_al_lider_no_cancela_a_los_seguidores():
+    async def prueba():
+        coalescedor = Coalescedor("prueba_cancela_lider")
+
+        async def calcular():
+            await asyncio.sleep(0.05)
+            return "valor"
+
+        lider = asyncio.create_task(coalescedor.ejecutar("k", calcular))
+        await asyncio.sleep(0)
+        seguidores = [asyncio.create_task(coalescedor.ejecutar("k", calcular)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        lider.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await lider
+        assert await asyncio.gather(*seguidores) == ["valor", "valor"]
+        assert coalescedor.contadores["ok"] == 1
+        assert coalescedor.contadores["cancelados"] == 0
+
+    asyncio.run(prueba())
+
+
+def test_sin_nadie_esperando_se_cancela_y_libera_la_clave():
+    async def prueba():
+        coalescedor = Coalescedor("prueba_cancela_todos")
+        cancelada = asyncio.Event()
+
+        async def lenta():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelada.set()
+                raise
+
+        esperas = [asyncio.create_task(coalescedor.ejecutar("k", lenta)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for espera in esperas:
+            espera.cancel()
+        await asyncio.gather(*esperas, return_exceptions=True)
+        await asyncio.wait_for(cancelada.wait(), 1)
+        assert coalescedor.estadisticas()["en_vuelo"] == 0
+
+        # Una petición nueva no se une a la ejecución cancelada
+        async def rapida():
+            return "nueva"
+
+        assert await coalescedor.ejecutar("k", rapida) == "nueva"
+
+    asyncio.run(prueba())
@@ -0,0 +1,33 @@
+from datetime import datetime
+
+import pytest
+from starlette.requests import Request
+
+from common.condicional import no_modificado
+
+ULTIMA_MODIFICACION = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def peticion(**cabeceras) -> Request:
+    return Request({
+        "type": "http",
+        "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in cabeceras.items()],
+    })
+
+
+@pytest.mark.parametrize("fecha, esperado", [
+    ("Thu, 01 Jan 2026 12:00:00 GMT", True),
+    # "-0000" da una fecha sin zona: se toma como UTC en lugar de fallar
+    ("Thu, 01 Jan 2026 12:00:00 -0000", True),
+    ("Thu, 01 Jan 2026 11:00:00 -0000", False),
+    ("Thu, 01 Jan 2026 14:00:00 +0200", True),
+    ("no es una fecha", False),
+])
+def test_if_modified_since(fecha, esperado):
+    assert no_modificado(peticion(if_modified_since=fecha), 'W/"a"', ULTIMA_MODIFICACION) is esperado
+
+
+def test_if_none_match_tiene_prioridad():
+    solicitud = peticion(if_none_match='"b"', if_modified_since="Thu, 01 Jan 2026 12:00:00 GMT")
+    assert not no_modificado(solicitud, 'W/"a"', ULTIMA_MODIFICACION)
+    assert no_modificado(peticion(if_none_match='W/"x", "a"'), 'W/"a"')
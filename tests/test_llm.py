@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from llm import ClienteLLM, LLMSaturado, ModeloFalso
+
+
+def cliente(latencia: float, **opciones) -> ClienteLLM:
+    return ClienteLLM(ModeloFalso(latencia=latencia), nombre="falso", **opciones)
+
+
+def test_genera_con_el_modelo_falso():
+    async def prueba():
+        llm = cliente(0.01)
+        respuesta = await llm.generar("hola")
+        assert respuesta.startswith("[modelo falso]")
+        assert llm.estadisticas()["llamadas"] == 1
+        assert llm.estadisticas()["en_curso"] == 0
+
+    asyncio.run(prueba())
+
+
+def test_timeout():
+    async def prueba():
+        llm = cliente(0.3, timeout=0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await llm.generar("hola")
+        assert llm.estadisticas()["timeouts"] == 1
+
+    asyncio.run(prueba())
+
+
+def test_el_hueco_se_libera_cuando_termina_el_hilo():
+    async def prueba():
+        llm = cliente(0.3, max_concurrencia=1, timeout=0.05, espera_max=0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await llm.generar("primera")
+        # El hilo sigue ocupado aunque la llamada ya venció
+        assert llm.estadisticas()["en_curso"] == 1
+        with pytest.raises(LLMSaturado):
+            await llm.generar("segunda")
+        await asyncio.sleep(0.35)
+        assert llm.estadisticas()["en_curso"] == 0
+        llm.timeout = 1
+        assert (await llm.generar("tercera")).startswith("[modelo falso]")
+
+    asyncio.run(prueba())
+
+
+def test_saturado():
+    async def prueba():
+        llm = cliente(0.2, max_concurrencia=1, espera_max=0.05)
+        resultados = await asyncio.gather(llm.generar("a"), llm.generar("b"), return_exceptions=True)
+        assert sum(isinstance(r, str) for r in resultados) == 1
+        assert sum(isinstance(r, LLMSaturado) for r in resultados) == 1
+        assert llm.estadisticas()["saturado"] == 1
+
+    asyncio.run(prueba())
+
+
+@pytest.fixture
+def nlp(monkeypatch):
+    """El servicio nlp con el modelo falso y la base sustituida."""
+    import main
+
+    estado = {"version": 1}
+
+    async def version(pool=None):
+        return estado["version"]
+
+    async def contexto(pregunta, pool=None):
+        return {"intencion": "conteo", "filtros": {}, "nombre": None, "filas": [],
+                "agregados": {"total_personas": 3}}
+
+    monkeypatch.setattr(main, "obtener_version_datos", version)
+    monkeypatch.setattr(main, "obtener_contexto_personas", contexto)
+    monkeypatch.setattr(main, "pool_lectura", lambda: None)
+    main.cache_respuestas.limpiar()
+    return main, estado
+
+
+def consultar(main, pregunta: str):
+    return main.consulta_lenguaje_natural(main.ConsultaNLP(pregunta=pregunta))
+
+
+def test_cache_por_version_de_datos(nlp, monkeypatch):
+    main, estado = nlp
+
+    async def prueba():
+        llm = cliente(0.01)
+        monkeypatch.setattr(main, "llm", llm)
+        await consultar(main, "¿Cuántas personas hay?")
+        # Misma pregunta normalizada y misma versión: desde la caché
+        await consultar(main, "cuantas personas hay")
+        assert llm.estadisticas()["llamadas"] == 1
+        # Una escritura cambia la versión y la respuesta se recalcula
+        estado["version"] = 2
+        await consultar(main, "¿Cuántas personas hay?")
+        assert llm.estadisticas()["llamadas"] == 2
+
+    asyncio.run(prueba())
+
+
+def test_las_mayusculas_del_nombre_separan_la_cache(nlp, monkeypatch):
+    main, _ = nlp
+
+    async def prueba():
+        llm = cliente(0.01)
+        monkeypatch.setattr(main, "llm", llm)
+        # Sin mayúscula no se detecta el nombre: se recupera otra cosa
+        await consultar(main, "busca a pedro")
+        await consultar(main, "Busca a Pedro")
+        assert llm.estadisticas()["llamadas"] == 2
+
+    asyncio.run(prueba())
+
+
+def test_saturado_responde_sin_modelo_y_no_cachea(nlp, monkeypatch):
+    main, _ = nlp
+
+    async def prueba():
+        llm = cliente(0.3, max_concurrencia=1, espera_max=0.01)
+        monkeypatch.setattr(main, "llm", llm)
+        ocupada = asyncio.create_task(llm.generar("ocupa el único hueco"))
+        await asyncio.sleep(0.01)
+        respuesta = await consultar(main, "¿Cuántas personas hay?")
+        assert respuesta.respuesta == "Hay 3 personas registradas en el sistema."
+        assert llm.estadisticas()["saturado"] == 1
+        await ocupada
+        # La respuesta de respaldo no quedó en la caché: ahora sí llega al modelo
+        respuesta = await consultar(main, "¿Cuántas personas hay?")
+        assert respuesta.respuesta.startswith("[modelo falso]")
+
+    asyncio.run(prueba())
@@ -0,0 +1,94 @@
+import asyncio
+
+from common.log_sink import COLUMNAS_LOG, LogSink
+
+
+class ConexionFalsa:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def copy_records_to_table(self, tabla, records, columns):
+        assert tabla == "logs" and columns == COLUMNAS_LOG
+        if self.pool.fallar:
+            raise ConnectionError("sin base")
+        self.pool.lotes.append(list(records))
+
+
+class _Adquirida:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return ConexionFalsa(self.pool)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class PoolFalso:
+    def __init__(self, fallar: bool = False):
+        self.fallar = fallar
+        self.lotes = []
+
+    def acquire(self):
+        return _Adquirida(self)
+
+
+def test_escribe_por_lotes_y_vacia_la_cola_al_detener():
+    async def prueba():
+        sink = LogSink(tam_lote=3, intervalo=10)
+        pool = PoolFalso()
+        for i in range(7):
+            await sink.registrar("CREAR", str(i), {"i": i})
+        sink.iniciar(pool)
+        await sink.detener()
+        assert [len(lote) for lote in pool.lotes] == [3, 3, 1]
+        assert [fila[1] for lote in pool.lotes for fila in lote] == [str(i) for i in range(7)]
+        assert sink.estadisticas()["escritos"] == 7
+        assert sink.estadisticas()["lotes"] == 3
+        assert sink.estadisticas()["pendientes"] == 0
+
+    asyncio.run(prueba())
+
+
+def test_un_lote_incompleto_se_escribe_al_vencer_el_intervalo():
+    async def prueba():
+        sink = LogSink(tam_lote=100, intervalo=0.05)
+        pool = PoolFalso()
+        sink.iniciar(pool)
+        await sink.registrar("READ", "1")
+        await sink.registrar("READ", "2")
+        await asyncio.sleep(0.2)
+        assert [len(lote) for lote in pool.lotes] == [2]
+        await sink.detener()
+
+    asyncio.run(prueba())
+
+
+def test_cola_llena_descarta_tras_la_espera():
+    async def prueba():
+        sink = LogSink(max_cola=2, espera_max=0.01)
+        assert await sink.registrar("READ", "1")
+        assert await sink.registrar("READ", "2")
+        assert not await sink.registrar("READ", "3")
+        estadisticas = sink.estadisticas()
+        assert estadisticas["encolados"] == 2
+        assert estadisticas["descartados"] == 1
+        assert estadisticas["esperas_backpressure"] == 1
+
+    asyncio.run(prueba())
+
+
+def test_un_lote_que_falla_cuenta_como_descartado():
+    async def prueba():
+        sink = LogSink(tam_lote=2, intervalo=10)
+        for i in range(3):
+            await sink.registrar("CREAR", str(i))
+        sink.iniciar(PoolFalso(fallar=True))
+        await sink.detener()
+        estadisticas = sink.estadisticas()
+        assert estadisticas["errores"] == 2
+        assert estadisticas["descartados"] == 3
+        assert estadisticas["escritos"] == 0
+
+    asyncio.run(prueba())
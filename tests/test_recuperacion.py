@@ -0,0 +1,61 @@
+import pytest
+
+from recuperacion import analizar_pregunta
+
+
+@pytest.mark.parametrize("pregunta, nombre", [
+    ("Muéstrame las mujeres registradas", None),
+    ("Indica el empleado mayor", None),
+    ("Busca a Pedro", "Pedro"),
+    ("Existen personas llamadas Juan?", "Juan"),
+    ("¿Quién es Juan Carlos Pérez?", "Juan Carlos Pérez"),
+    ("¿Cuál es el correo de María?", "María"),
+    ("Juan Carlos es mayor?", "Juan Carlos"),
+    ("¿Cuántas personas hay?", None),
+    ("datos de juan", None),
+    ("¿Cuántas personas hay? Muestra a María", "María"),
+])
+def test_nombre(pregunta, nombre):
+    assert analizar_pregunta(pregunta)["nombre"] == nombre
+
+
+def test_filtros_e_intencion():
+    analisis = analizar_pregunta("Muéstrame las mujeres registradas")
+    assert analisis["intencion"] == "lista"
+    assert analisis["filtros"] == {"genero": "Femenino"}
+
+    analisis = analizar_pregunta("¿Cuál es el hombre más joven con cédula?")
+    assert analisis["intencion"] == "mas_joven"
+    assert analisis["filtros"] == {"genero": "Masculino", "tipo_documento": "Cédula"}
+
+
+def test_no_binario_antes_que_otros_generos():
+    # "no binario" contiene "binario" pero no debe leerse como otro género
+    assert analizar_pregunta("¿Cuántas personas no binarias hay?")["filtros"]["genero"] == "No binario"
+    assert analizar_pregunta("Lista de hombres")["filtros"]["genero"] == "Masculino"
+
+
+def test_documento():
+    analisis = analizar_pregunta("¿De quién es el documento 1234567890?")
+    assert analisis["filtros"]["numero_documento"] == "1234567890"
+    assert analisis["nombre"] is None
+
+
+def test_numero_de_un_dato_no_es_conteo():
+    analisis = analizar_pregunta("¿Cuál es el número de celular de Pedro Ramírez?")
+    assert analisis["intencion"] == "busqueda"
+    assert analisis["nombre"] == "Pedro Ramírez"
+
+
+@pytest.mark.parametrize("pregunta, intencion", [
+    ("¿Cuántas personas son mayores de 30 años?", "conteo"),
+    ("¿Cuántos menores de edad hay?", "conteo"),
+    ("¿Cuántas mujeres hay?", "conteo"),
+    ("¿Quién es la persona mayor?", "mas_viejo"),
+    ("¿Cuál es el empleado más joven?", "mas_joven"),
+    ("¿Cuántos años tiene el menor?", "mas_joven"),
+    ("Lista de personas mayores", "lista"),
+    ("¿Cuál es la edad promedio?", "promedio_edad"),
+])
+def test_intencion(pregunta, intencion):
+    assert analizar_pregunta(pregunta)["intencion"] == intencion
@@ -0,0 +1,148 @@
+import asyncio
+
+from common.replicas import (
+    EnrutadorLecturas,
+    MiddlewareConsistencia,
+    entero_a_lsn,
+    lsn_a_entero,
+    token_actual,
+)
+
+
+class ConexionFalsa:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def fetchval(self, sql):
+        return self.pool.lsn
+
+    async def fetchrow(self, sql):
+        if self.pool.caida:
+            raise ConnectionError("conexión rechazada")
+        return {"en_recuperacion": self.pool.en_recuperacion, "lsn": self.pool.lsn,
+                "desde_ultima": self.pool.desde_ultima}
+
+
+class _Adquirida:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return ConexionFalsa(self.pool)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class PoolFalso:
+    """Lo justo de un pool de asyncpg: una conexión que responde con el LSN
+    y el atraso que se le fijen."""
+
+    def __init__(self, lsn: str, en_recuperacion: bool = True, desde_ultima: float = 0.0):
+        self.lsn = lsn
+        self.en_recuperacion = en_recuperacion
+        self.desde_ultima = desde_ultima
+        self.caida = False
+
+    def acquire(self, timeout=None):
+        return _Adquirida(self)
+
+
+def enrutador(*replicas: PoolFalso, primario: str = "0/5000") -> EnrutadorLecturas:
+    enrutador = EnrutadorLecturas(PoolFalso(primario, en_recuperacion=False),
+                                  dsns=[f"replica{i}" for i in range(len(replicas))], atraso_max=5)
+    for replica, pool in zip(enrutador.replicas, replicas):
+        replica.pool = pool
+    asyncio.run(enrutador.sondear())
+    return enrutador
+
+
+def test_lsn_ida_y_vuelta():
+    assert lsn_a_entero("16/B374D848") == (0x16 << 32) + 0xB374D848
+    assert entero_a_lsn(lsn_a_entero("16/B374D848")) == "16/B374D848"
+
+
+def test_replica_al_dia_recibe_las_lecturas():
+    replica = PoolFalso("0/5000", desde_ultima=60)
+    lecturas = enrutador(replica)
+    # Alcanzó al primario: el tiempo sin escrituras no cuenta como atraso
+    assert lecturas.replicas[0].atraso == 0.0
+    assert lecturas.pool() is replica
+
+
+def test_reparte_entre_replicas_sanas():
+    a, b = PoolFalso("0/5000"), PoolFalso("0/5000")
+    lecturas = enrutador(a, b)
+    assert {lecturas.pool() for _ in range(4)} == {a, b}
+
+
+def test_replica_atrasada_sale_de_la_rotacion():
+    al_dia, atrasada = PoolFalso("0/5000"), PoolFalso("0/4000", desde_ultima=30)
+    lecturas = enrutador(al_dia, atrasada)
+    assert not lecturas.replicas[1].sana
+    assert "Atraso" in lecturas.replicas[1].error
+    assert {lecturas.pool() for _ in range(4)} == {al_dia}
+
+
+def test_replica_atrasada_dentro_del_margen_sigue_sana():
+    replica = PoolFalso("0/4000", desde_ultima=2)
+    lecturas = enrutador(replica)
+    assert lecturas.replicas[0].sana
+    assert lecturas.pool() is replica
+
+
+def test_sin_replicas_sanas_se_lee_del_primario():
+    caida = PoolFalso("0/5000")
+    caida.caida = True
+    lecturas = enrutador(caida, PoolFalso("0/1000", desde_ultima=30))
+    assert lecturas.replicas[0].error == "conexión rechazada"
+    assert lecturas.pool() is lecturas.primario
+
+
+def test_un_primario_no_cuenta_como_replica():
+    lecturas = enrutador(PoolFalso("0/5000", en_recuperacion=False))
+    assert not lecturas.replicas[0].sana
+    assert lecturas.pool() is lecturas.primario
+
+
+def test_la_replica_se_recupera_en_el_siguiente_sondeo():
+    replica = PoolFalso("0/5000")
+    replica.caida = True
+    lecturas = enrutador(replica)
+    assert lecturas.pool() is lecturas.primario
+    replica.caida = False
+    asyncio.run(lecturas.sondear())
+    assert lecturas.pool() is replica
+
+
+def test_token_de_consistencia():
+    atrasada, al_dia = PoolFalso("0/4000", desde_ultima=1), PoolFalso("0/5000")
+    lecturas = enrutador(atrasada, al_dia)
+    # Solo la réplica que ya aplicó la escritura puede servir la lectura
+    assert {lecturas.pool(lsn_a_entero("0/4800")) for _ in range(4)} == {al_dia}
+    assert {lecturas.pool(lsn_a_entero("0/4000")) for _ in range(4)} == {atrasada, al_dia}
+    # Ninguna la alcanzó todavía: primario
+    assert lecturas.pool(lsn_a_entero("0/6000")) is lecturas.primario
+
+
+def ejecutar_middleware(cabeceras):
+    vistos = []
+
+    async def app(scope, receive, send):
+        vistos.append(token_actual())
+
+    asyncio.run(MiddlewareConsistencia(app)({"type": "http", "headers": cabeceras}, None, None))
+    return vistos[0]
+
+
+def test_middleware_lee_el_token_de_la_cabecera():
+    assert ejecutar_middleware([(b"x-token-consistencia", b" 0/4800 ")]) == lsn_a_entero("0/4800")
+    assert ejecutar_middleware([]) is None
+    # Fuera de la petición no queda token
+    assert token_actual() is None
+
+
+def test_token_mal_formado_va_al_primario():
+    token = ejecutar_middleware([(b"x-token-consistencia", b"basura")])
+    lecturas = enrutador(PoolFalso("0/5000"))
+    assert lecturas.pool(token) is lecturas.primario